@@ -0,0 +1,55 @@
+"""
+Compares the throughput of one aiohttp session per request (module level fetch_* functions) against the pooled
+MappleClient, both talking to a local stand-in of the Mapple API.
+
+    python -m benchmarks.client_benchmark -n 500 -b 10 -f 100
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.fake_mapple_server import load_payload, start_server
+from src.mapple_api import MappleClient, fetch_walking_reachability
+
+LATITUDE = 60.1681411
+LONGITUDE = 24.9306796
+
+
+async def per_request_sessions(base_url: str, requests: int, batch: int):
+    for index in range(0, requests, batch):
+        await asyncio.gather(*[fetch_walking_reachability(base_url=base_url, latitude=LATITUDE,
+                                                          longitude=LONGITUDE)
+                               for _ in range(min(batch, requests - index))])
+
+
+async def pooled_client(base_url: str, requests: int, batch: int):
+    async with MappleClient(base_url=base_url, limit_per_host=batch) as client:
+        for index in range(0, requests, batch):
+            await asyncio.gather(*[client.fetch_walking_reachability(latitude=LATITUDE, longitude=LONGITUDE)
+                                   for _ in range(min(batch, requests - index))])
+
+
+async def run(requests: int, batch: int, features: int):
+    runner, base_url = await start_server(load_payload(features))
+    try:
+        for name, scenario in [("session per request", per_request_sessions), ("pooled MappleClient", pooled_client)]:
+            start = time.perf_counter()
+            await scenario(base_url, requests, batch)
+            elapsed = time.perf_counter() - start
+            print("{name:<22} {requests} requests in {elapsed:.2f} s -> {rate:.1f} requests/s".format(
+                name=name, requests=requests, elapsed=elapsed, rate=requests / elapsed))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='MappleClient connection pooling benchmark')
+    parser.add_argument('-n', '--requests', metavar='', type=int, default=500,
+                        help='Number of reachability requests per scenario.')
+    parser.add_argument('-b', '--batch', metavar='', type=int, default=10,
+                        help='Number of concurrent requests (and pooled connections).')
+    parser.add_argument('-f', '--features', metavar='', type=int, default=100,
+                        help='Number of features in each response. Use a small value to isolate connection overhead.')
+    args = parser.parse_args()
+
+    asyncio.run(run(requests=args.requests, batch=args.batch, features=args.features))
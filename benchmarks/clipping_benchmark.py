@@ -0,0 +1,64 @@
+"""
+Compares gpd.overlay against ClippingEngine for limiting a nationwide facility layer to a buffered municipality,
+on synthetic data: random facilities over Finland and a municipality with detailed borders (ETRS-TM35FIN).
+
+    python -m benchmarks.clipping_benchmark -n 50000 -r 5
+"""
+import argparse
+import time
+
+import geopandas
+import numpy
+from shapely.geometry import Point
+
+from src.clipping import ClippingEngine
+
+CRS = "EPSG:3067"
+CENTER = (435000.0, 6900000.0)
+
+
+def municipality_borders() -> geopandas.GeoDataFrame:
+    # two overlapping municipalities with a few thousand border vertices, like jkl_mrm_dissolved.shp before dissolving
+    return geopandas.GeoDataFrame(geometry=[Point(CENTER).buffer(30000, 1024),
+                                            Point(CENTER[0] + 20000, CENTER[1] - 25000).buffer(15000, 512)], crs=CRS)
+
+
+def facilities(count: int) -> geopandas.GeoDataFrame:
+    random = numpy.random.default_rng(42)
+    return geopandas.GeoDataFrame({"id": numpy.arange(count)},
+                                  geometry=geopandas.points_from_xy(random.uniform(60000, 740000, count),
+                                                                    random.uniform(6630000, 7770000, count)),
+                                  crs=CRS)
+
+
+def overlay(layer: geopandas.GeoDataFrame, buffer: float) -> geopandas.GeoDataFrame:
+    # what getLipasData did on every call: load and buffer the borders, then intersect every facility
+    borders = municipality_borders()
+    area = geopandas.GeoDataFrame(geometry=borders.buffer(buffer), crs=CRS)
+    return geopandas.overlay(layer, area, how="intersection")
+
+
+def run(count: int, repeat: int, buffer: float):
+    layer = facilities(count)
+    engine = ClippingEngine(lambda municipality: municipality_borders())
+    for name, clip in [("gpd.overlay", lambda: overlay(layer, buffer)),
+                       ("ClippingEngine", lambda: engine.clip(layer, "municipality", buffer))]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            selected = clip()
+        elapsed = (time.perf_counter() - start) / repeat
+        print("{name:<16} {count} facilities -> {selected} in {elapsed:.3f} s".format(
+            name=name, count=count, selected=len(selected["id"].unique()), elapsed=elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Facility clipping benchmark')
+    parser.add_argument('-n', '--facilities', metavar='', type=int, default=50000,
+                        help='Number of facilities over the whole country.')
+    parser.add_argument('-r', '--repeat', metavar='', type=int, default=5,
+                        help='Number of clippings per method (the layers of one notebook run).')
+    parser.add_argument('-b', '--buffer', metavar='', type=float, default=1000,
+                        help='Buffer around the municipality borders in meters.')
+    args = parser.parse_args()
+
+    run(count=args.facilities, repeat=args.repeat, buffer=args.buffer)
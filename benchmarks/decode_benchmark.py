@@ -0,0 +1,104 @@
+"""
+Compares the decode modes of MappleClient on the transit reachability resource: CPU time per response, peak
+Python allocations (tracemalloc) and peak RSS of a process decoding one response.
+The compact modes take more CPU than 'dict': rapidjson builds the dicts in C, while the compact decoder converts
+every feature into the arrays in Python. They trade that for a fraction of the memory, and for layers that the
+reducer and the columnar writer read without going through a dict per grid cell.
+
+    python -m benchmarks.decode_benchmark -n 20
+"""
+import argparse
+import io
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import rapidjson
+
+from src.decoding import decode_compact
+
+# the resource is read directly: fake_mapple_server imports aiohttp and numpy, whose memory would hide the decoding
+# in the peak RSS of the child process
+RESOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources",
+                        "transit_reachability.geojson")
+
+MODES = {
+    "dict": rapidjson.loads,
+    "compact": decode_compact,
+    "compact (chunked)": lambda body: decode_compact(io.BytesIO(body)),
+    "raw": bytes,
+}
+
+
+def peak_rss_mb(mode: str) -> float:
+    """
+    Decodes one response in a fresh interpreter, so that the peak RSS of one mode is not hidden by another.
+    """
+    output = subprocess.run([sys.executable, "-m", "benchmarks.decode_benchmark", "--rss", mode],
+                            check=True, capture_output=True, text=True).stdout
+    return float(output)
+
+
+def rss_kb(field: str) -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    raise KeyError(field)
+
+
+def measure_rss(mode: str):
+    # read the resource as is: load_payload decodes it, which would set the peak before the measurement
+    with open(RESOURCE, "rb") as resource_file:
+        body = resource_file.read()
+    try:
+        # reset the peak RSS (VmHWM) of the process to its current RSS, Linux only
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+        baseline = rss_kb("VmRSS")
+        MODES[mode](body)
+        peak = rss_kb("VmHWM")
+    except OSError:
+        # ru_maxrss cannot be reset: the decoding only shows when it goes above the peak of the interpreter start
+        baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        MODES[mode](body)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # both are in kilobytes on Linux
+    print((peak - baseline) / 1024)
+
+
+def run(responses: int):
+    from benchmarks.fake_mapple_server import load_payload
+
+    body = load_payload()
+    print("response of {size:.1f} MB".format(size=len(body) / 2 ** 20))
+    for mode, decode in MODES.items():
+        start = time.process_time()
+        for _ in range(responses):
+            decode(body)
+        cpu = (time.process_time() - start) / responses
+
+        tracemalloc.start()
+        decoded = decode(body)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del decoded
+
+        print("{mode:<18} {cpu:7.1f} ms CPU/response  {peak:7.1f} MB peak allocations  {rss:7.1f} MB peak RSS".format(
+            mode=mode, cpu=cpu * 1000, peak=peak / 2 ** 20, rss=peak_rss_mb(mode)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Reachability response decoding benchmark')
+    parser.add_argument('-n', '--responses', metavar='', type=int, default=20,
+                        help='Number of responses decoded per mode for the CPU time.')
+    parser.add_argument('--rss', metavar='', type=str, choices=list(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.rss:
+        measure_rss(args.rss)
+    else:
+        run(responses=args.responses)
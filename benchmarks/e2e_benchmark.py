@@ -0,0 +1,221 @@
+"""
+Runs main.main end to end against the local stand-in of the Mapple API, for several numbers of entry points, and
+reports requests/s, the p50/p95/p99 latency of the answers, the peak RSS of the client process and the bytes it
+wrote. Every run is appended as one JSON line to --output; with --baseline, the runs are compared to the last
+matching run of the baseline file and the command fails when one of them regressed.
+
+    python -m benchmarks.e2e_benchmark -p 20 100 --latency lognormal:0.05:0.5 --throttle_rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import rapidjson
+
+from benchmarks.fake_mapple_server import FakeMappleAPI, Latency, load_payload, start_server
+
+ROOT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# compared to the baseline: (metric, True when higher is better)
+REGRESSION_METRICS = [("requests_per_s", True), ("latency_p95_ms", False), ("peak_rss_mb", False)]
+SCENARIO_FIELDS = ["pois", "travel_modes", "features", "latency", "throttle_rate", "error_rate", "quota",
+                   "concurrency", "rate", "output_format", "decode"]
+
+
+def write_pois(path: str, count: int, seed: int = 0):
+    generator = random.Random(seed)
+    features = [{
+        "type": "Feature",
+        "properties": {"id": "poi-{index}".format(index=index)},
+        "geometry": {"type": "Point", "coordinates": [generator.uniform(24.85, 25.05), generator.uniform(60.15, 60.25)]}
+    } for index in range(count)]
+    with open(path, "w") as pois_file:
+        pois_file.write(rapidjson.dumps({"type": "FeatureCollection", "features": features}))
+
+
+def percentile(values: List[float], share: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+def folder_size(folder: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for path, _, names in os.walk(folder) for name in names)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_FOLDER, check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_client(config: Dict):
+    """
+    Child process: one main.main run, so that the peak RSS is the client's only.
+    """
+    import main
+
+    counts = {"completed": 0, "failed": 0}
+
+    def on_result(job, reachability):
+        counts["failed" if reachability is None else "completed"] += 1
+
+    start = time.perf_counter()
+    succeeded = asyncio.run(main.main(config["pois_path"], mapple_url=config["url"], output_folder=config["folder"],
+                                      travel_mode=config["travel_modes"], rate=config["rate"],
+                                      burst=config["concurrency"], concurrency=config["concurrency"],
+                                      max_connections=config["concurrency"], max_attempts=config["max_attempts"],
+                                      output_format=config["output_format"], decode=config["decode"],
+                                      cache_dir=None, on_result=on_result))
+    elapsed = time.perf_counter() - start
+    with open(config["result_path"], "w") as result_file:
+        json.dump(dict(counts, succeeded=succeeded, elapsed_s=elapsed, bytes_written=folder_size(config["folder"]),
+                       # ru_maxrss is in kilobytes on Linux
+                       peak_rss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024), result_file)
+
+
+async def run_scenario(args, pois: int, payload: bytes) -> Dict:
+    api = FakeMappleAPI(payload, latency=Latency.parse(args.latency), throttle_rate=args.throttle_rate,
+                        error_rate=args.error_rate, retry_after=args.retry_after, quota=args.quota,
+                        quota_window=args.quota_window)
+    runner, url = await start_server(api)
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            config = {"pois_path": os.path.join(folder, "pois.geojson"), "url": url,
+                      "folder": os.path.join(folder, "output"), "result_path": os.path.join(folder, "result.json"),
+                      "travel_modes": args.travel_modes, "rate": args.rate, "concurrency": args.concurrency,
+                      "max_attempts": args.max_attempts, "output_format": args.format, "decode": args.decode}
+            write_pois(config["pois_path"], pois)
+            child = await asyncio.create_subprocess_exec(sys.executable, "-m", "benchmarks.e2e_benchmark",
+                                                         "--client", json.dumps(config), cwd=ROOT_FOLDER,
+                                                         stdout=asyncio.subprocess.DEVNULL)
+            await child.wait()
+            with open(config["result_path"]) as result_file:
+                client = json.load(result_file)
+    finally:
+        await runner.cleanup()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pois": pois,
+        "travel_modes": args.travel_modes,
+        "features": args.features,
+        "latency": str(Latency.parse(args.latency)),
+        "throttle_rate": args.throttle_rate,
+        "error_rate": args.error_rate,
+        "quota": args.quota,
+        "concurrency": args.concurrency,
+        "rate": args.rate,
+        "output_format": args.format,
+        "decode": args.decode,
+        "succeeded": client["succeeded"],
+        "requests": api.requests,
+        "statuses": {str(status): count for status, count in sorted(api.statuses.items())},
+        "completed": client["completed"],
+        "failed": client["failed"],
+        "elapsed_s": round(client["elapsed_s"], 3),
+        "requests_per_s": round(client["completed"] / client["elapsed_s"], 2),
+        "latency_p50_ms": round(percentile(api.latencies, 0.50) * 1000, 2) if api.latencies else None,
+        "latency_p95_ms": round(percentile(api.latencies, 0.95) * 1000, 2) if api.latencies else None,
+        "latency_p99_ms": round(percentile(api.latencies, 0.99) * 1000, 2) if api.latencies else None,
+        "peak_rss_mb": round(client["peak_rss_mb"], 1),
+        "bytes_written": client["bytes_written"],
+    }
+
+
+def regressions(result: Dict, baseline: List[Dict], tolerance: float) -> List[str]:
+    matching = [record for record in baseline
+                if all(record.get(field) == result.get(field) for field in SCENARIO_FIELDS)]
+    if not matching:
+        return []
+    reference = matching[-1]
+    found = []
+    for metric, higher_is_better in REGRESSION_METRICS:
+        if reference.get(metric) is None or result.get(metric) is None:
+            continue
+        limit = reference[metric] * (1 - tolerance if higher_is_better else 1 + tolerance)
+        if result[metric] < limit if higher_is_better else result[metric] > limit:
+            found.append("{pois} POIs: {metric} {value} (baseline {reference} at {commit})".format(
+                pois=result["pois"], metric=metric, value=result[metric], reference=reference[metric],
+                commit=reference.get("commit")))
+    return found
+
+
+async def run(args) -> int:
+    payload = load_payload(args.features)
+    baseline = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = [json.loads(line) for line in baseline_file if line.strip()]
+
+    found = []
+    for pois in args.pois:
+        result = await run_scenario(args, pois, payload)
+        print("{pois:>6} POIs  {requests_per_s:8.1f} requests/s  p50 {latency_p50_ms} ms  p95 {latency_p95_ms} ms  "
+              "p99 {latency_p99_ms} ms  {peak_rss_mb} MB RSS  {bytes_written} bytes  {failed} failed".format(**result))
+        if args.output:
+            with open(args.output, "a") as output_file:
+                output_file.write(json.dumps(result) + "\n")
+        found.extend(regressions(result, baseline, args.tolerance))
+
+    for regression in found:
+        print("REGRESSION", regression)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='End to end benchmark of main.py against a fake Mapple API')
+    parser.add_argument('-p', '--pois', metavar='', type=int, nargs='+', default=[20, 100],
+                        help='Numbers of entry points, one run each.')
+    parser.add_argument('-t', '--travel_modes', metavar='', type=str, nargs='+', default=["walking"],
+                        help='Travel modes requested for every entry point.')
+    parser.add_argument('-f', '--features', metavar='', type=int, default=None,
+                        help='Number of features in each answer (default: the whole transit resource, ~2.5 MB).')
+    parser.add_argument('--latency', metavar='', type=str, default="constant:0",
+                        help="Answer delay distribution in seconds: 'constant:<delay>', 'uniform:<low>:<high>' or 'lognormal:<median>:<sigma>'.")
+    parser.add_argument('--throttle_rate', metavar='', type=float, default=0.0,
+                        help="Share of the requests answered with 429 'Too Many Requests'.")
+    parser.add_argument('--error_rate', metavar='', type=float, default=0.0,
+                        help='Share of the requests answered with a 5xx error.')
+    parser.add_argument('--retry_after', metavar='', type=float, default=1.0,
+                        help="'Retry-After' of the injected 429 answers, in seconds.")
+    parser.add_argument('--quota', metavar='', type=int, default=None,
+                        help='Maximum number of requests served per quota window, the others get a 429.')
+    parser.add_argument('--quota_window', metavar='', type=float, default=1.0,
+                        help='Length of the quota window in seconds.')
+    parser.add_argument('--rate', metavar='', type=float, default=1000.0,
+                        help='--rate of main.py.')
+    parser.add_argument('--concurrency', metavar='', type=int, default=10,
+                        help='--concurrency, --burst and --max_connections of main.py.')
+    parser.add_argument('--max_attempts', metavar='', type=int, default=5,
+                        help='--max_attempts of main.py.')
+    parser.add_argument('--format', metavar='', type=str, default="geojson",
+                        help='--format of main.py.')
+    parser.add_argument('--decode', metavar='', type=str, default="dict",
+                        help='--decode of main.py.')
+    parser.add_argument('-o', '--output', metavar='', type=str, default="benchmark_results.jsonl",
+                        help='File the results are appended to, one JSON object per run.')
+    parser.add_argument('--baseline', metavar='', type=str, default=None,
+                        help='Results file of a previous version to compare to.')
+    parser.add_argument('--tolerance', metavar='', type=float, default=0.2,
+                        help='Relative change of requests/s, p95 latency or peak RSS counted as a regression.')
+    parser.add_argument('--client', metavar='', type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        run_client(json.loads(args.client))
+    else:
+        sys.exit(asyncio.run(run(args)))
@@ -0,0 +1,153 @@
+import asyncio
+import math
+import os
+import random
+import time
+from collections import Counter
+from typing import List, Optional
+
+import rapidjson
+from aiohttp import web
+
+from src.config import TravelModes
+
+RESOURCES_FOLDER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "resources")
+SERVER_ERRORS = (500, 502, 503)
+
+
+def load_payload(features: int = None) -> bytes:
+    """
+    Returns the body the fake server answers with: the transit reachability resource, optionally cut down to the
+    first `features` features so that the benchmark measures the client rather than JSON decoding.
+    """
+    with open(os.path.join(RESOURCES_FOLDER, "transit_reachability.geojson")) as resource_file:
+        reachability = rapidjson.loads(resource_file.read())
+    if features is not None:
+        reachability["features"] = reachability["features"][:features]
+    return rapidjson.dumps(reachability).encode("utf-8")
+
+
+class Latency:
+    """
+    Delay before the fake server answers, in seconds: 'constant:<delay>', 'uniform:<low>:<high>' or
+    'lognormal:<median>:<sigma>' (long tail, like a routing engine under load).
+    """
+
+    KINDS = ("constant", "uniform", "lognormal")
+
+    def __init__(self, kind: str = "constant", a: float = 0.0, b: float = 0.0):
+        if kind not in self.KINDS:
+            raise ValueError("Unknown latency distribution '{kind}'".format(kind=kind))
+        self.kind = kind
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def parse(cls, value: Optional[str]) -> "Latency":
+        if not value:
+            return cls()
+        kind, *parameters = value.split(":")
+        return cls(kind, *[float(parameter) for parameter in parameters])
+
+    def sample(self, generator: random.Random) -> float:
+        if self.kind == "uniform":
+            return generator.uniform(self.a, self.b)
+        if self.kind == "lognormal":
+            return generator.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        return self.a
+
+    def __str__(self):
+        return ":".join([self.kind, str(self.a), str(self.b)])
+
+
+class FakeMappleAPI:
+    """
+    Local stand-in of the reachability endpoints. Every answer waits for a delay drawn from `latency`; a share of
+    the requests is answered with 429 'Too Many Requests' (`throttle_rate`) or a 5xx error (`error_rate`), and at
+    most `quota` requests are served per `quota_window` seconds, the others get a 429 with the time left in the
+    window as 'Retry-After'. The statistics of the answers are kept for the benchmarks.
+    """
+
+    def __init__(self, payload: bytes, latency: Latency = None, throttle_rate: float = 0.0, error_rate: float = 0.0,
+                 retry_after: float = 1.0, quota: int = None, quota_window: float = 1.0, seed: int = 0):
+        self.payload = payload
+        self.latency = latency if latency is not None else Latency()
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.quota = quota
+        self.quota_window = quota_window
+        self.random = random.Random(seed)
+        self.statuses: Counter = Counter()
+        self.latencies: List[float] = []
+        self.bytes_sent = 0
+        self._window_start = time.monotonic()
+        self._window_requests = 0
+
+    @property
+    def requests(self) -> int:
+        return sum(self.statuses.values())
+
+    def _over_quota(self) -> Optional[float]:
+        if self.quota is None:
+            return None
+        now = time.monotonic()
+        if now - self._window_start >= self.quota_window:
+            self._window_start = now
+            self._window_requests = 0
+        self._window_requests += 1
+        if self._window_requests > self.quota:
+            return self._window_start + self.quota_window - now
+        return None
+
+    def _error(self, status: int, detail: str, retry_after: float = None) -> web.Response:
+        self.statuses[status] += 1
+        headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after is not None else None
+        return web.json_response({"detail": detail}, status=status, headers=headers)
+
+    async def reachability(self, request: web.Request):
+        start = time.perf_counter()
+        if request.match_info["travel_mode"] not in [mode.value for mode in TravelModes]:
+            return self._error(404, "Unknown travel mode")
+        wait = self._over_quota()
+        if wait is not None:
+            return self._error(429, "Quota exceeded", retry_after=wait)
+        draw = self.random.random()
+        if draw < self.throttle_rate:
+            return self._error(429, "Too Many Requests", retry_after=self.retry_after)
+        await asyncio.sleep(self.latency.sample(self.random))
+        if draw < self.throttle_rate + self.error_rate:
+            return self._error(self.random.choice(SERVER_ERRORS), "Injected server error")
+
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        response.content_length = len(self.payload)
+        await response.prepare(request)
+        await response.write(self.payload)
+        await response.write_eof()
+        self.statuses[200] += 1
+        self.bytes_sent += len(self.payload)
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/fi/reachability/travelTime/{travel_mode}/1", self.reachability)
+        return app
+
+
+def create_app(payload: bytes, **behaviour) -> web.Application:
+    return FakeMappleAPI(payload, **behaviour).app()
+
+
+async def start_server(payload, host: str = "127.0.0.1", port: int = 0):
+    """
+    Starts the fake Mapple API in the running event loop, from a payload or a configured FakeMappleAPI.
+    Returns the runner (to be cleaned up) and the base URL.
+    """
+    api = payload if isinstance(payload, FakeMappleAPI) else FakeMappleAPI(payload)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, "http://{host}:{port}".format(host=host, port=bound_port)
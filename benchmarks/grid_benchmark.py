@@ -0,0 +1,70 @@
+"""
+Compares attributing reachability layers to the 250 m population grid with a spatial join per layer (the notebook's
+former loop) against a CellGridMapping hash join, on a synthetic grid and synthetic layers.
+
+    python -m benchmarks.grid_benchmark -g 200 -l 12
+"""
+import argparse
+import time
+
+import geopandas
+import numpy
+from shapely.geometry import box
+
+from src.grid import CellGridMapping, accessibility_metrics, attribute_grid
+
+X0, Y0 = 384750, 6691750
+
+
+def population_grid(size: int) -> geopandas.GeoDataFrame:
+    squares = [box(X0 + 250 * column, Y0 + 250 * row, X0 + 250 * (column + 1), Y0 + 250 * (row + 1))
+               for row in range(size) for column in range(size)]
+    return geopandas.GeoDataFrame({"he_vakiy": numpy.random.default_rng(1).integers(0, 200, len(squares))},
+                                  geometry=squares, crs="EPSG:3067")
+
+
+def reachability_layer(size: int, seed: int) -> geopandas.GeoDataFrame:
+    random = numpy.random.default_rng(seed)
+    rows, columns = numpy.divmod(numpy.arange(size * size), size)
+    points = geopandas.points_from_xy(X0 + 125 + 250 * columns, Y0 + 125 + 250 * rows, crs="EPSG:3067")
+    layer = geopandas.GeoDataFrame({"id": (5000000 + numpy.arange(size * size)).astype(str),
+                                    "travel_time": random.uniform(0, 60, size * size)}, geometry=points)
+    return layer.to_crs("EPSG:4326")
+
+
+def run(size: int, layers: int):
+    grid = population_grid(size)
+    outputs = {("sport", str(index)): reachability_layer(size, index) for index in range(layers)}
+
+    start = time.perf_counter()
+    for output in outputs.values():
+        projected = grid.to_crs(output.crs)
+        geopandas.sjoin(output, projected, how="inner", op="intersects")
+    print("sjoin per layer     {layers} layers of {cells} cells in {elapsed:.2f} s".format(
+        layers=layers, cells=size * size, elapsed=time.perf_counter() - start))
+
+    start = time.perf_counter()
+    mapping = CellGridMapping()
+    first = next(iter(outputs.values()))
+    mapping.extend(first["id"], first.geometry, grid)
+    built = time.perf_counter() - start
+    for output in outputs.values():
+        attribute_grid(output, grid, mapping)
+    print("CellGridMapping     {layers} layers of {cells} cells in {elapsed:.2f} s (mapping built in {built:.2f} s)"
+          .format(layers=layers, cells=size * size, elapsed=time.perf_counter() - start, built=built))
+
+    start = time.perf_counter()
+    accessibility_metrics(outputs, mapping, grid["he_vakiy"])
+    print("accessibility_metrics for {layers} layers in {elapsed:.3f} s".format(
+        layers=layers, elapsed=time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Grid attribution benchmark')
+    parser.add_argument('-g', '--grid', metavar='', type=int, default=200,
+                        help='Side of the square population grid, in 250 m cells.')
+    parser.add_argument('-l', '--layers', metavar='', type=int, default=12,
+                        help='Number of reachability layers (sports x travel modes).')
+    args = parser.parse_args()
+
+    run(size=args.grid, layers=args.layers)
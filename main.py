@@ -1,131 +1,479 @@
 import argparse
 import asyncio
-import json
+import cProfile
+import multiprocessing
 import os
+import re
+import shutil
 import sys
 import tempfile
 import time
 import traceback
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 
-import geopandas
+from starlette.exceptions import HTTPException
 
-from src.config import TimeOfDay, TimeProfile, WalkingSpeeds, CyclingSpeeds, TravelModes
-from src.mapple_api import fetch_walking_reachability, fetch_cycling_reachability, fetch_transit_reachability, \
-    fetch_driving_reachability
+from src.config import CyclingSpeeds, MappleAPIConfig, TimeOfDay, TimeProfile, TravelModes, WalkingSpeeds
+from src.columnar import ColumnarWriter
+from src.dead_letter import DeadLetterWriter, dead_letter_path, read_dead_letters
+from src.dump_index import compact_dump, reset_indexes
+from src.entry_points import read_entry_points
+from src.manifest import JobKey, RunManifest, job_key, manifest_path
+from src.mapple_api import MappleClient
+from src.metrics import RunMetrics, metrics_path, write_profile
+from src.progress import ProgressBar
+from src.rate_limiter import RateLimiter
+from src.reducer import NearestFacilityReducer, iter_layers, layer_files, nearest_path, nearest_state_path, \
+    reduce_columnar, reduce_layers
+from src.refresh import diff_origins, previous_origins
+from src.response_cache import ResponseCache
+from src.retry import RetryPolicy
+from src.scheduler import ReachabilityJob, origin_id, parse_mode_limits, schedule
+from src.sweep import SweepPlan, within_threshold
+from src.shards import ShardPlan, ShardProgress, count_lines, merge_shards, plan_path, shard_folder, shard_options, \
+    shard_totals, split_entry_points, split_failed_jobs
+from src.writer import ReachabilityWriter
 
 
-async def main(points_geojson, mapple_url="http://localhost:8080", prefix="reachability", travel_mode: List = None,
+async def main(points_geojson=None, mapple_url="http://localhost:8080", prefix="reachability", travel_mode: List = None,
                maxTimeThreshold: int = 30, radius: int = 20000, output_folder=None,
-               individual_files: bool = False):
+               individual_files: bool = False, max_connections: int = 10, timeout: float = 300,
+               rate: float = 2.0, burst: int = 10, concurrency: int = 10, mode_limits: Dict[TravelModes, int] = None,
+               max_attempts: int = 5, failed_jobs: str = None, resume: bool = False, cache_dir: str = None,
+               cache_size_mb: int = 1024, cache_ttl_days: float = 30, cache_precision: int = 5,
+               output_format: str = "geojson", nearest: bool = False, decode: str = "dict", workers: int = 1,
+               shard_by: str = "hash", api_key: str = None,
+               on_result: Callable[[ReachabilityJob, object], None] = None, progress: bool = False,
+               metrics_output: str = None, profile: str = None, sweep: SweepPlan = None,
+               cell_index: bool = False, refresh: bool = False, nearest_k: int = 3) -> bool:
+    """
+    Returns False when the run stopped on an error. `on_result` is called with every job and its reachability
+    layer, or None when the job failed. With `progress`, a progress bar is drawn on stderr and a summary of the
+    metrics is printed at the end; `metrics_output` is the file the metrics are written to (Prometheus text when it
+    ends with '.prom' or '.txt', JSON otherwise). With `profile`, the run is profiled with cProfile and the stats
+    are dumped to that file. With a `sweep`, the layers of every variant are written to its own folder
+    '<output_folder>/<variant name>', and maxTimeThreshold is ignored. With `cell_index`, the '.acc_dump' files get
+    an index of the origins reaching every grid cell ('<dump>.cells.sqlite'). With `refresh`, the entry points are
+    compared to the origins of the previous run in the output folder: the layers of the removed and moved ones are
+    dropped, and only the new and moved ones are fetched. The nearest facility layers keep the `nearest_k` shortest
+    travel times of every cell ('<prefix>_nearest_<travel_mode>.state.json'), so that they are updated in place.
+    """
+    if workers > 1:
+        options = dict(locals())
+        try:
+            return await run_shards(options)
+        except Exception:
+            traceback.print_exc(file=sys.stdout)
+            return False
+
+    if profile is not None:
+        options = dict(locals(), profile=None)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return await main(**options)
+        finally:
+            profiler.disable()
+            print("Profile written to {path}, the slowest calls by cumulative time:".format(path=profile))
+            print(write_profile(profiler, profile))
+
+    metrics = RunMetrics()
+    cache = None
+    if cache_dir is not None:
+        cache = ResponseCache(cache_dir, max_bytes=cache_size_mb * 1024 * 1024, ttl=cache_ttl_days * 24 * 3600,
+                              precision=cache_precision)
+    client = MappleClient(base_url=mapple_url, api_key=api_key, limit_per_host=max_connections, total_timeout=timeout,
+                          rate_limiter=RateLimiter(rate=rate, burst=burst),
+                          retry_policy=RetryPolicy(max_attempts=max_attempts), cache=cache, decode=decode,
+                          metrics=metrics)
+    dead_letters = None
+    manifest = None
+    writers: Dict[object, ReachabilityWriter] = {}
+    progress_bar = None
     try:
-        pois_df = geopandas.read_file(points_geojson,
-                                      driver="GeoJSON")
+        await client.open()
 
         if not os.path.exists(output_folder):
             os.mkdir(output_folder)
 
-        prefix_pattern = "{prefix}_{travel_mode}_"
-
-        walking_target_file_path = None
-        cycling_target_file_path = None
-        transit_target_file_path = None
-        driving_target_file_path = None
-
-        if not individual_files:
-            walking_target_file_fd, walking_target_file_path = tempfile.mkstemp(
-                prefix=prefix_pattern.format(prefix=prefix,
-                                             travel_mode=TravelModes.WALKING),
-                dir=output_folder,
-                suffix=".acc_dump")
-            cycling_target_file_fd, cycling_target_file_path = tempfile.mkstemp(
-                prefix=prefix_pattern.format(prefix=prefix,
-                                             travel_mode=TravelModes.CYCLING),
-                dir=output_folder,
-                suffix=".acc_dump")
-            transit_target_file_fd, transit_target_file_path = tempfile.mkstemp(
-                prefix=prefix_pattern.format(prefix=prefix,
-                                             travel_mode=TravelModes.TRANSIT),
-                dir=output_folder,
-                suffix=".acc_dump")
-            driving_target_file_fd, driving_target_file_path = tempfile.mkstemp(
-                prefix=prefix_pattern.format(prefix=prefix,
-                                             travel_mode=TravelModes.DRIVING),
-                dir=output_folder,
-                suffix=".acc_dump")
-
-        for index in range(0, len(pois_df) + 10, 10):  # +10 to if the length is not multiple of 10
-            chunk = pois_df[index:index + 10]
-            if not chunk.empty:
-                if (travel_mode is None) or (TravelModes.WALKING in travel_mode):
-                    coroutines = chunk.apply(lambda row: fetch_walking_reachability(
-                        base_url=mapple_url, latitude=row.geometry.y, longitude=row.geometry.x, radius=radius,
-                        walking_speed_kmph=WalkingSpeeds.AVERAGE, maxTimeThreshold=maxTimeThreshold), axis=1).to_list()
-
-                    walking_reachability = await asyncio.gather(*coroutines)
-
-                    await save(individual_files, output_folder, prefix, prefix_pattern,
-                               walking_reachability, walking_target_file_path, travel_mode=TravelModes.WALKING)
-
-                    # sleep the requests for 5 secs so the server is not going to throw 'Too Many Requests Exceptions'
-                    time.sleep(5)
-
-                if (travel_mode is None) or (TravelModes.CYCLING in travel_mode):
-                    coroutines = chunk.apply(lambda row: fetch_cycling_reachability(
-                        base_url=mapple_url, latitude=row.geometry.y, longitude=row.geometry.x, radius=radius,
-                        walking_speed_kmph=WalkingSpeeds.AVERAGE,
-                        cycling_speed_kmph=CyclingSpeeds.AVERAGE_CYCLING, maxTimeThreshold=maxTimeThreshold),
-                                             axis=1).to_list()
-
-                    cycling_reachability = await asyncio.gather(*coroutines)
-                    await save(individual_files, output_folder, prefix, prefix_pattern,
-                               cycling_reachability, cycling_target_file_path, travel_mode=TravelModes.CYCLING)
-
-                    time.sleep(5)
-
-                if (travel_mode is None) or (TravelModes.TRANSIT in travel_mode):
-                    coroutines = chunk.apply(lambda row: fetch_transit_reachability(
-                        base_url=mapple_url, latitude=row.geometry.y, longitude=row.geometry.x, radius=radius,
-                        walking_speed_kmph=WalkingSpeeds.AVERAGE,
-                        timeOfDay=TimeOfDay.RUSH_HOUR,
-                        timeProfile=TimeProfile.FASTEST, maxTimeThreshold=maxTimeThreshold), axis=1).to_list()
-
-                    transit_reachability = await asyncio.gather(*coroutines)
-                    await save(individual_files, output_folder, prefix, prefix_pattern,
-                               transit_reachability, transit_target_file_path, travel_mode=TravelModes.TRANSIT)
-
-                    time.sleep(5)
-
-                if (travel_mode is None) or (TravelModes.DRIVING in travel_mode):
-                    coroutines = chunk.apply(lambda row: fetch_driving_reachability(
-                        base_url=mapple_url, latitude=row.geometry.y, longitude=row.geometry.x, radius=radius,
-                        walking_speed_kmph=WalkingSpeeds.AVERAGE,
-                        timeOfDay=TimeOfDay.RUSH_HOUR,
-                        timeProfile=TimeProfile.FASTEST, maxTimeThreshold=maxTimeThreshold), axis=1).to_list()
-
-                    driving_reachability = await asyncio.gather(*coroutines)
-                    await save(individual_files, output_folder, prefix, prefix_pattern,
-                               driving_reachability, driving_target_file_path, travel_mode=TravelModes.DRIVING)
-
-                    time.sleep(5)
+        dead_letters = DeadLetterWriter(dead_letter_path(output_folder, prefix))
+
+        if refresh and (points_geojson is None or failed_jobs is not None or sweep is not None or
+                        output_format != "geojson"):
+            raise ValueError("--refresh needs the entry points (-e), the geojson output format, and neither "
+                             "--failed_jobs nor a sweep")
+
+        if failed_jobs is not None:
+            if os.path.abspath(failed_jobs) == os.path.abspath(dead_letters.path):
+                # the dead letter file is rewritten by this run, so the jobs to re-run are moved aside first
+                replayed_path = "{path}.replayed".format(path=failed_jobs)
+                os.replace(failed_jobs, replayed_path)
+                failed_jobs = replayed_path
+            jobs = list(read_dead_letters(failed_jobs))
+            travel_modes = list(dict.fromkeys(job.travel_mode for job in jobs))
+            total = len(jobs)
+        else:
+            entry_points = read_entry_points(points_geojson)
+            travel_modes = [TravelModes(mode) for mode in travel_mode] if travel_mode else list(TravelModes)
+            jobs = planned_jobs(entry_points, travel_modes, radius, maxTimeThreshold, sweep)
+            if sweep is None:
+                total = len(entry_points) * len(travel_modes)
+            else:
+                total = len(entry_points) * sweep.requests_per_entry_point(travel_modes)
+                print("Sweep of {variants} variants: {requests} requests per entry point instead of {full}".format(
+                    variants=len(sweep.variants), requests=sweep.requests_per_entry_point(travel_modes),
+                    full=len(sweep.variants) * len(travel_modes)))
+
+        # a plain run writes its layers to the output folder, a sweep every variant to its own folder
+        folders = {None: output_folder} if sweep is None else \
+            {variant: os.path.join(output_folder, name) for variant, name in sweep.names.items()}
+        for folder in folders.values():
+            os.makedirs(folder, exist_ok=True)
+
+        # failed jobs are not in the manifest, so they are retried by a resumed run and logged again if they fail
+        if os.path.exists(dead_letters.path):
+            os.remove(dead_letters.path)
+
+        # re-running failed jobs or resuming appends to the outputs of the previous run, otherwise they are replaced
+        append = resume or failed_jobs is not None or refresh
+        manifest = RunManifest(manifest_path(output_folder, prefix))
+        if refresh:
+            diff = diff_origins(previous_origins(manifest, [output_file_path(output_folder, prefix, mode)
+                                                            for mode in TravelModes]), entry_points)
+            print("Refresh: {diff}".format(diff=diff.format()))
+            drop_origins(output_folder, prefix, diff.dropped)
+            manifest.remove_origins(diff.dropped)
+        completed = set()
+        if append:
+            completed = manifest.completed_keys()
+            # the manifest may also hold the jobs of other travel modes or variants, so only the planned jobs are
+            # counted
+            planned = jobs if failed_jobs is not None else planned_jobs(entry_points, travel_modes, radius,
+                                                                        maxTimeThreshold, sweep)
+            total = sum(1 for job in planned if pending(job, completed, sweep))
+            jobs = (job for job in jobs if pending(job, completed, sweep))
+        else:
+            manifest.clear()
+            if output_format == "geojson" and not individual_files:
+                for folder in folders.values():
+                    for mode in travel_modes:
+                        open(output_file_path(folder, prefix, mode), "w").close()
+                        reset_indexes(output_file_path(folder, prefix, mode))
+
+        in_flight = 0
+
+        async def fetch_reachability(job: ReachabilityJob):
+            nonlocal in_flight
+            in_flight += 1
+            metrics.sample("in_flight", in_flight)
+            try:
+                return await client.fetch_reachability(job)
+            except HTTPException as e:
+                dead_letters.write(job, e, attempts=getattr(e, "attempts", 1))
+                return None
+            finally:
+                in_flight -= 1
+
+        reducers = {}
+        for variant, folder in folders.items():
+            columnar = None
+            if output_format != "geojson":
+                columnar = ColumnarWriter(folder, prefix, output_format=output_format, append=append)
+            if nearest:
+                for mode in travel_modes:
+                    if refresh and os.path.exists(nearest_state_path(folder, prefix, mode)):
+                        # already without the dropped origins
+                        reducers[(variant, mode)] = NearestFacilityReducer.read_state(
+                            nearest_state_path(folder, prefix, mode))
+                        continue
+                    reducer = reducers[(variant, mode)] = NearestFacilityReducer(k=nearest_k)
+                    if append and columnar is not None:
+                        reduce_columnar(folder, prefix, mode, reducer)
+                    elif append:
+                        reduce_layers(layer_files(folder, mode, prefix), reducer)
+
+            def reduce(job: ReachabilityJob, reachability, variant=variant):
+                reducers[(variant, job.travel_mode)].add_record(job, reachability)
+
+            # jobs are recorded in the manifest only once their layers are flushed to disk
+            writers[variant] = ReachabilityWriter(on_flushed=manifest.mark_completed_many, columnar=columnar,
+                                                  on_record=reduce if nearest else None, metrics=metrics,
+                                                  cell_index=cell_index)
+
+        def layers(job: ReachabilityJob, reachability):
+            if sweep is None:
+                return [(None, job, reachability)]
+            return [(variant, variant_job, reachability if variant.maxTimeThreshold >= job.maxTimeThreshold
+                     else within_threshold(reachability, variant.maxTimeThreshold))
+                    for variant, variant_job in sweep.derived(job) if job_key(variant_job) not in completed]
+
+        if progress:
+            progress_bar = ProgressBar(total)
+        async for job, reachability in schedule(jobs, fetch_reachability, concurrency=concurrency,
+                                                mode_limits=mode_limits):
+            if on_result is not None:
+                on_result(job, reachability)
+            metrics.increment("jobs_total", result="failed" if reachability is None else "completed")
+            metrics.sample("writer_queue", sum(writer.pending for writer in writers.values()))
+            if progress_bar is not None:
+                progress_bar.advance(failed=reachability is None, details="in flight {in_flight}".format(
+                    in_flight=in_flight))
+            if reachability is None:
+                continue
+            for variant, layer_job, layer in layers(job, reachability):
+                writer = writers[variant]
+                if writer.columnar is not None:
+                    await writer.write(None, layer, layer_job)
+                else:
+                    await writer.write(output_file_path(folders[variant], prefix, layer_job.travel_mode,
+                                                        layer_job.origin_id if individual_files else None),
+                                       layer, layer_job)
+        for writer in writers.values():
+            await writer.close()
+
+        for (variant, mode), reducer in reducers.items():
+            reducer.write(nearest_path(folders[variant], prefix, mode))
+            reducer.write_state(nearest_state_path(folders[variant], prefix, mode))
+
+        if progress_bar is not None:
+            progress_bar.close()
+        if dead_letters.count:
+            print("{count} requests failed, they were written to {path}".format(count=dead_letters.count,
+                                                                                 path=dead_letters.path))
+        return True
     except Exception as e:
         traceback.print_exc(file=sys.stdout)
+        return False
+    finally:
+        for writer in writers.values():
+            if not writer.closed:
+                try:
+                    await writer.close()
+                except Exception:
+                    traceback.print_exc(file=sys.stdout)
+        if dead_letters is not None:
+            dead_letters.close()
+        if manifest is not None:
+            manifest.close()
+        await client.close()
+        if cache is not None:
+            cache.close()
+        _report(metrics, progress_bar, metrics_output)
+
+
+def _report(metrics: RunMetrics, progress_bar: ProgressBar = None, metrics_output: str = None):
+    metrics.finish()
+    try:
+        if progress_bar is not None:
+            progress_bar.close()
+            print(metrics.summary())
+        if metrics_output is not None:
+            metrics.write(metrics_output)
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+
+
+async def run_shards(options: Dict, progress_interval: float = 5) -> bool:
+    """
+    '--workers' runs: the entry points are split between `workers` processes, each one a regular run with its own
+    client, API key, rate budget, manifest and outputs in 'shard_<index>' of the output folder. The shard outputs
+    are merged into the output folder once every shard has finished.
+    """
+    workers, prefix, output_folder = options["workers"], options["prefix"], options["output_folder"]
+    failed_jobs = options["failed_jobs"]
+    append = options["resume"] or failed_jobs is not None
+    if options["refresh"]:
+        raise ValueError("--refresh needs --workers 1")
+    os.makedirs(output_folder, exist_ok=True)
+
+    path = plan_path(output_folder, prefix)
+    if append:
+        if not os.path.exists(path):
+            raise ValueError("{folder} holds no '--workers' run to resume".format(folder=output_folder))
+        plan = ShardPlan.load(path)
+        if (plan.workers, plan.shard_by) != (workers, options["shard_by"]):
+            raise ValueError("The run in {folder} was split with --workers {workers} --shard_by {shard_by}".format(
+                folder=output_folder, workers=plan.workers, shard_by=plan.shard_by))
 
+    if failed_jobs is not None:
+        entry_points = [None] * workers
+        replayed = split_failed_jobs(failed_jobs, plan, output_folder, prefix)
+        totals = [count_lines(replay_path) if replay_path else 0 for replay_path in replayed]
+    else:
+        replayed = [None] * workers
+        origins = [(origin_id(feature_id, longitude, latitude), longitude, latitude)
+                   for feature_id, longitude, latitude in read_entry_points(options["points_geojson"])]
+        if not append:
+            plan = ShardPlan(workers, "hash") if options["shard_by"] == "hash" else \
+                ShardPlan.spatial([latitude for _, _, latitude in origins], workers)
+            plan.save(path)
+        entry_points = split_entry_points(origins, plan, output_folder, prefix)
+        travel_modes = [TravelModes(mode) for mode in options["travel_mode"]] if options["travel_mode"] else \
+            list(TravelModes)
+        totals = shard_totals(plan, origins, len(travel_modes) if options["sweep"] is None
+                              else options["sweep"].requests_per_entry_point(travel_modes))
+        if options["resume"]:
+            for index in range(workers):
+                if os.path.exists(manifest_path(shard_folder(output_folder, index), prefix)):
+                    manifest = RunManifest(manifest_path(shard_folder(output_folder, index), prefix))
+                    completed = manifest.completed_keys()
+                    shard_origins = [origin for origin in origins if plan.shard_of(origin[0], origin[2]) == index]
+                    totals[index] = sum(1 for job in planned_jobs(shard_origins, travel_modes, options["radius"],
+                                                                  options["maxTimeThreshold"], options["sweep"])
+                                        if pending(job, completed, options["sweep"]))
+                    manifest.close()
 
-async def save(individual_files, output_folder, prefix, prefix_pattern, reachability_dict, target_file_path,
-               travel_mode: TravelModes):
-    for reachability in reachability_dict:
-        if not individual_files:
-            with open(target_file_path, "a") as target_file:
-                target_file.write("{}\n".format(json.dumps(reachability)))
+    api_keys = [options["api_key"]] if options["api_key"] else MappleAPIConfig.getMappleAPIKeys()
+    context = multiprocessing.get_context("spawn")
+    progress = ShardProgress(totals, context=context)
+    progress_bar = ProgressBar(sum(totals)) if options["progress"] else None
+    metrics = RunMetrics()
+    processes = {}
+    try:
+        for index in range(workers):
+            if entry_points[index] is None and replayed[index] is None:
+                if not append and os.path.isdir(shard_folder(output_folder, index)):
+                    # outputs of a previous run, they must not be merged into this one
+                    shutil.rmtree(shard_folder(output_folder, index))
+                continue
+            shard = shard_options(options, index, workers, api_keys)
+            shard.update(points_geojson=entry_points[index], failed_jobs=replayed[index], on_result=None,
+                         progress=False, metrics_output=metrics_path(shard["output_folder"], prefix),
+                         profile="{path}.shard_{index:02d}".format(path=options["profile"], index=index)
+                         if options["profile"] else None)
+            process = context.Process(target=_run_shard, args=(index, shard, progress),
+                                      name="shard_{index:02d}".format(index=index))
+            process.start()
+            processes[index] = process
+
+        printed = time.monotonic()
+        while any(process.is_alive() for process in processes.values()):
+            await asyncio.sleep(0.5)
+            if progress_bar is not None:
+                progress_bar.update(sum(progress.done()), sum(progress.failed()))
+            elif time.monotonic() - printed >= progress_interval:
+                print(progress.format())
+                printed = time.monotonic()
+        if progress_bar is not None:
+            progress_bar.update(sum(progress.done()), sum(progress.failed()))
         else:
-            temp_target_file_fd, temp_target_file_path = tempfile.mkstemp(
-                prefix=prefix_pattern.format(prefix=prefix,
-                                             travel_mode=travel_mode),
-                dir=output_folder,
-                suffix=".geojson")
-            with open(temp_target_file_path, "a") as target_file:
-                target_file.write("{}\n".format(json.dumps(reachability)))
+            print(progress.format())
+    finally:
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        for index in processes:
+            shard_metrics = metrics_path(shard_folder(output_folder, index), prefix)
+            if os.path.exists(shard_metrics):
+                metrics.merge(RunMetrics.load(shard_metrics))
+        _report(metrics, progress_bar, options["metrics_output"])
+
+    failed_shards = [index for index, process in processes.items() if process.exitcode != 0]
+    if failed_shards:
+        print("Shards {shards} stopped on an error, run again with --resume to complete them".format(
+            shards=", ".join(str(index) for index in failed_shards)))
+        return False
+
+    failed = await asyncio.get_event_loop().run_in_executor(
+        None, merge_shards, [shard_folder(output_folder, index) for index in range(workers)], output_folder, prefix,
+        options["output_format"], options["nearest"])
+    if options["sweep"] is not None:
+        for name in options["sweep"].names.values():
+            os.makedirs(os.path.join(output_folder, name), exist_ok=True)
+            shard_folders = [os.path.join(shard_folder(output_folder, index), name) for index in range(workers)]
+            await asyncio.get_event_loop().run_in_executor(
+                None, merge_shards, shard_folders, os.path.join(output_folder, name), prefix, options["output_format"],
+                options["nearest"])
+    if failed:
+        print("{count} requests failed, they were written to {path}".format(
+            count=failed, path=dead_letter_path(output_folder, prefix)))
+    return True
+
+
+def _run_shard(index: int, options: Dict, progress: ShardProgress):
+    def on_result(job: ReachabilityJob, reachability):
+        progress.record(index, failed=reachability is None)
+
+    if not asyncio.run(main(**dict(options, on_result=on_result))):
+        sys.exit(1)
+
+
+def reachability_jobs(entry_points: Iterable[Tuple[Optional[object], float, float]], travel_modes: List[TravelModes],
+                      radius: int = 20000, maxTimeThreshold: int = 30) -> Iterator[ReachabilityJob]:
+    """
+    The jobs of (id, longitude, latitude) entry points, e.g. EntryPoints, one per travel mode.
+    """
+    for feature_id, longitude, latitude in entry_points:
+        job_origin_id = origin_id(feature_id, longitude, latitude)
+        for mode in travel_modes:
+            yield ReachabilityJob(origin_id=job_origin_id, latitude=latitude, longitude=longitude,
+                                  travel_mode=mode, radius=radius, maxTimeThreshold=maxTimeThreshold)
+
+
+def planned_jobs(entry_points: Iterable[Tuple[Optional[object], float, float]], travel_modes: List[TravelModes],
+                 radius: int, maxTimeThreshold: int, sweep: Optional[SweepPlan]) -> Iterator[ReachabilityJob]:
+    """
+    The requests of a run over `entry_points`, without a sweep or with one.
+    """
+    if sweep is None:
+        return reachability_jobs(entry_points, travel_modes, radius=radius, maxTimeThreshold=maxTimeThreshold)
+    return sweep.jobs(entry_points, travel_modes, radius=radius)
+
+
+def pending(job: ReachabilityJob, completed: Set[JobKey], sweep: Optional[SweepPlan]) -> bool:
+    if sweep is None:
+        return job_key(job) not in completed
+    # the manifest holds the variants written, a request is sent again while one of its variants is missing
+    return any(job_key(variant_job) not in completed for _, variant_job in sweep.derived(job))
+
+
+def drop_origins(output_folder: str, prefix: str, origin_ids: Set[str]):
+    """
+    Removes the layers of `origin_ids` from the outputs of every travel mode, and updates the nearest facility
+    layers written with them.
+    """
+    if not origin_ids:
+        return
+    for mode in TravelModes:
+        dump = output_file_path(output_folder, prefix, mode)
+        if os.path.exists(dump):
+            compact_dump(dump, origin_ids)
+        for origin in origin_ids:
+            path = output_file_path(output_folder, prefix, mode, origin)
+            if os.path.exists(path):
+                os.remove(path)
+        state = nearest_state_path(output_folder, prefix, mode)
+        if os.path.exists(state):
+            reducer = NearestFacilityReducer.read_state(state)
+            exhausted = reducer.remove(origin_ids)
+            reducer.refill(exhausted, iter_layers(layer_files(output_folder, mode, prefix)))
+            reducer.write(nearest_path(output_folder, prefix, mode))
+            reducer.write_state(state)
+
+
+def positive_int(value: str) -> int:
+    if int(value) < 1:
+        raise argparse.ArgumentTypeError("{value} is not a positive integer".format(value=value))
+    return int(value)
+
+
+def positive_float(value: str) -> float:
+    if not float(value) > 0:
+        raise argparse.ArgumentTypeError("{value} is not a positive number".format(value=value))
+    return float(value)
+
+
+def output_file_path(output_folder: str, prefix: str, travel_mode: TravelModes, origin_id: str = None) -> str:
+    """
+    Results are dumped in '<prefix>_<travel_mode>.acc_dump', or in '<prefix>_<travel_mode>_<origin_id>.geojson' when
+    every origin gets its own file.
+    """
+    if origin_id is None:
+        return os.path.join(output_folder, "{prefix}_{travel_mode}.acc_dump".format(
+            prefix=prefix, travel_mode=TravelModes(travel_mode).value))
+    return os.path.join(output_folder, "{prefix}_{travel_mode}_{origin_id}.geojson".format(
+        prefix=prefix, travel_mode=TravelModes(travel_mode).value, origin_id=re.sub(r"[^\w.-]", "_", origin_id)))
 
 
 if __name__ == "__main__":
@@ -133,9 +481,11 @@ if __name__ == "__main__":
     parser.add_argument('-u', '--mapple_url', metavar='', type=str,
                         default="http://localhost:8080",
                         help='Mapple API URL.')
-    parser.add_argument('-e', '--entry_points', metavar='', type=str,
-                        required=True,
-                        help='Geojson containing the points to consider as starting points (GeoJSON).')
+    entry_points_group = parser.add_mutually_exclusive_group(required=True)
+    entry_points_group.add_argument('-e', '--entry_points', metavar='', type=str,
+                                    help="Geojson containing the points to consider as starting points (GeoJSON FeatureCollection, or one feature per line with the extension '.geojsonl', '.geojsons', '.ndjson' or '.jsonl').")
+    entry_points_group.add_argument('-f', '--failed_jobs', metavar='', type=str,
+                                    help="Re-run only the requests listed in a failed requests file '<prefix>_failed.geojsonl' of a previous run.")
     parser.add_argument('-t', '--travel_modes', metavar='', type=str, nargs='+',
                         help='Define what travel modes to calculate reachability data (walking, cycling, transit, driving) Leave it without define if accessibility for all travel modes must be calculated.'.format(
                             walking=TravelModes.WALKING,
@@ -151,6 +501,22 @@ if __name__ == "__main__":
     parser.add_argument('-m', '--max_time_threshold', metavar='', type=int,
                         default=30,
                         help='Maximum Travel Time in minutes of the temporal threshold (limits) to define the temporal area for accessibility calculation. Maximum value accepted 500.')
+    parser.add_argument('--thresholds', metavar='', type=int, nargs='+',
+                        help="Sweep: the maximum travel times in minutes to compare, e.g. '15 30 60'. Only the largest one is requested from the Mapple API, the layers of the others are derived from it. Every combination of --thresholds, --times_of_day, --time_profiles, --walking_speeds and --cycling_speeds is written to its own folder in the output directory.")
+    parser.add_argument('--times_of_day', metavar='', type=str, nargs='+',
+                        choices=[time_of_day.value for time_of_day in TimeOfDay],
+                        help='Sweep: the times of day to compare ({choices}), for transit and driving.'.format(
+                            choices=", ".join(time_of_day.value for time_of_day in TimeOfDay)))
+    parser.add_argument('--time_profiles', metavar='', type=str, nargs='+',
+                        choices=[time_profile.value for time_profile in TimeProfile],
+                        help='Sweep: the time profiles to compare ({choices}), for transit and driving.'.format(
+                            choices=", ".join(time_profile.value for time_profile in TimeProfile)))
+    parser.add_argument('--walking_speeds', metavar='', type=float, nargs='+',
+                        help='Sweep: the walking speeds in km/h to compare (default {default}).'.format(
+                            default=WalkingSpeeds.AVERAGE.value))
+    parser.add_argument('--cycling_speeds', metavar='', type=float, nargs='+',
+                        help='Sweep: the cycling speeds in km/h to compare ({choices}), for cycling.'.format(
+                            choices=", ".join(str(speed.value) for speed in CyclingSpeeds)))
     parser.add_argument('-p', '--output_file_prefix', metavar='', type=str,
                         default="reachability",
                         help='Prefix to add to the output files.')
@@ -163,10 +529,96 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--individual_files', metavar='', type=bool,
                         default=False,
                         help="If 'true', the accessibility layers will be stored in individual 'geojson' files. Otherwise, they will be dumped in files '.acc_dump'")
+    parser.add_argument('--format', metavar='', type=str,
+                        default="geojson", choices=["geojson", "parquet", "arrow"],
+                        help="Output format (geojson, parquet, arrow). 'parquet' and 'arrow' write every grid cell once to '<prefix>_cells.<format>' and the travel times as (origin_id, travel_mode, cell_id, travel_time) rows to the folder '<prefix>_reachability'. They need pyarrow.")
+    parser.add_argument('--decode', metavar='', type=str,
+                        default="dict", choices=["dict", "compact", "raw"],
+                        help="How the answers are decoded (dict, compact, raw). 'compact' decodes the answers while they are received into typed arrays of cell ids, travel times and coordinates, without building a dict per feature. 'raw' does not decode them and writes the bytes as received.")
+    parser.add_argument('--nearest', action='store_true',
+                        help="While fetching, keep the shortest travel time of every grid cell over all the entry points, and write it to '<prefix>_nearest_<travel_mode>.geojson' with the id of the nearest entry point.")
+    parser.add_argument('--nearest_k', metavar='', type=positive_int,
+                        default=3,
+                        help="Number of shortest travel times kept per grid cell with --nearest, in '<prefix>_nearest_<travel_mode>.state.json', so that --refresh can remove facilities without reading the other layers again.")
+    parser.add_argument('--refresh', action='store_true',
+                        help="Update the outputs of a previous run for a new version of the entry points: they are compared to the origins of the previous run by id and coordinates, the layers of the removed and moved ones are dropped, and only the new and moved ones are fetched. The nearest facility layers are updated in place. Needs -e and --workers 1.")
+    parser.add_argument('--cell_index', action='store_true',
+                        help="Also index which origins reach every grid cell, and in how long, in '<prefix>_<travel_mode>.acc_dump.cells.sqlite' (see CellIndex in 'src/dump_index.py').")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue an interrupted run: the requests already written to the output directory (listed in '<prefix>_manifest.sqlite') are skipped and the new results are appended.")
+    parser.add_argument('--workers', metavar='', type=positive_int,
+                        default=1,
+                        help="Number of processes. The entry points are split between them, each one writes its outputs to 'shard_<index>' in the output directory and uses its own API key when MAPPLE_API_KEYS holds several comma separated keys. The outputs are merged at the end.")
+    parser.add_argument('--shard_by', metavar='', type=str,
+                        default="hash", choices=["hash", "spatial"],
+                        help="How the entry points are split between the workers (hash, spatial). 'spatial' gives every worker a latitude band with the same number of entry points.")
+    parser.add_argument('-c', '--max_connections', metavar='', type=int,
+                        default=10,
+                        help='Maximum number of simultaneous keep-alive connections to the Mapple API host.')
+    parser.add_argument('--timeout', metavar='', type=float,
+                        default=300,
+                        help="Total timeout in seconds for a single reachability request. Requests that time out are not retried, they are written to '<prefix>_failed.geojsonl'.")
+    parser.add_argument('--rate', metavar='', type=positive_float,
+                        default=2.0,
+                        help='Maximum number of requests per second sent to the Mapple API. The rate is lowered automatically when the API answers "Too Many Requests" and raised back afterwards.')
+    parser.add_argument('--burst', metavar='', type=positive_int,
+                        default=10,
+                        help='Number of requests that can be sent at once before the rate limit applies.')
+    parser.add_argument('--concurrency', metavar='', type=positive_int,
+                        default=10,
+                        help='Maximum number of reachability requests in flight, over all points and travel modes.')
+    parser.add_argument('--mode_limits', metavar='', type=str, nargs='+',
+                        help='Optional per travel mode limits of requests in flight, e.g. "transit=2 driving=4".')
+    parser.add_argument('--max_attempts', metavar='', type=int,
+                        default=5,
+                        help="Number of attempts for a request that fails with 'Too Many Requests', a server error or a connection error. Requests that still fail are written to '<prefix>_failed.geojsonl' in the output directory.")
+    parser.add_argument('--no_progress', action='store_true',
+                        help='Do not draw the progress bar nor print the summary of the metrics at the end of the run.')
+    parser.add_argument('--metrics', metavar='', type=str,
+                        help="File to write the metrics of the run to: requests and retries per travel mode and status, latency, payload size, decoding and writing time histograms, requests in flight and queued layers. Prometheus text format when the name ends with '.prom' or '.txt', JSON otherwise.")
+    parser.add_argument('--profile', metavar='', type=str,
+                        help="Profile the run with cProfile and dump the stats to this file (open it with 'python -m pstats' or snakeviz). With --workers, every shard writes '<file>.shard_<index>'.")
+
+    cache_directory = os.path.join(tempfile.gettempdir(), "mapple_api_cache")
+    parser.add_argument('--cache_dir', metavar='', type=str,
+                        default=cache_directory,
+                        help='Path where the Mapple API responses are cached between runs (default: {default}).'.format(
+                            default=cache_directory))
+    parser.add_argument('--no_cache', action='store_true',
+                        help='Always fetch the reachability data from the Mapple API, without reading or filling the cache.')
+    parser.add_argument('--cache_size', metavar='', type=int,
+                        default=1024,
+                        help='Maximum size of the cache in megabytes. The least recently used responses are evicted first.')
+    parser.add_argument('--cache_ttl', metavar='', type=float,
+                        default=30,
+                        help='Number of days a cached response stays valid.')
+    parser.add_argument('--cache_precision', metavar='', type=int,
+                        default=5,
+                        help='Number of decimals the coordinates are rounded to when looking up the cache (5 decimals is about one meter).')
 
     args = parser.parse_args()
+    try:
+        mode_limits = parse_mode_limits(args.mode_limits)
+    except ValueError as e:
+        parser.error("argument --mode_limits: {error}".format(error=e))
+
+    sweep = None
+    if args.thresholds or args.times_of_day or args.time_profiles or args.walking_speeds or args.cycling_speeds:
+        sweep = SweepPlan.grid(args.thresholds or [args.max_time_threshold],
+                               times_of_day=args.times_of_day or [TimeOfDay.RUSH_HOUR],
+                               time_profiles=args.time_profiles or [TimeProfile.FASTEST],
+                               walking_speeds=args.walking_speeds or [WalkingSpeeds.AVERAGE],
+                               cycling_speeds=args.cycling_speeds or [CyclingSpeeds.AVERAGE_CYCLING])
 
-    asyncio.run(main(points_geojson=args.entry_points, mapple_url=args.mapple_url, prefix=args.output_file_prefix,
-                     travel_mode=args.travel_modes,
-                     maxTimeThreshold=args.max_time_threshold, radius=args.radius, output_folder=args.output_directory,
-                     individual_files=args.individual_files))
+    succeeded = asyncio.run(main(
+        points_geojson=args.entry_points, mapple_url=args.mapple_url, prefix=args.output_file_prefix,
+        travel_mode=args.travel_modes, maxTimeThreshold=args.max_time_threshold, radius=args.radius,
+        output_folder=args.output_directory, individual_files=args.individual_files,
+        max_connections=args.max_connections, timeout=args.timeout, rate=args.rate, burst=args.burst,
+        concurrency=args.concurrency, mode_limits=mode_limits, max_attempts=args.max_attempts,
+        failed_jobs=args.failed_jobs, resume=args.resume, cache_dir=None if args.no_cache else args.cache_dir,
+        cache_size_mb=args.cache_size, cache_ttl_days=args.cache_ttl, cache_precision=args.cache_precision,
+        output_format=args.format, nearest=args.nearest, decode=args.decode, workers=args.workers,
+        shard_by=args.shard_by, progress=not args.no_progress, metrics_output=args.metrics, profile=args.profile,
+        sweep=sweep, cell_index=args.cell_index, refresh=args.refresh, nearest_k=args.nearest_k))
+    sys.exit(0 if succeeded else 1)
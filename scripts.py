@@ -1,16 +1,21 @@
 import contextily as ctx
-import geojson
 import geopandas as gpd
 import mapclassify
 import matplotlib.pyplot as plt
 import os
 import pandas as pd
-import requests
 
 from matplotlib_scalebar.scalebar import ScaleBar
 from osgeo import ogr
 from pyproj import CRS
 
+from src.clipping import ClippingEngine
+from src.columnar import read_cells, read_reachability
+from src.dump_index import AccDumpReader, CellIndex, cell_index_path, dump_path
+from src.grid import TIME_BANDS, CellGridMapping, accessibility_metrics, attribute_grid
+from src.lipas import LipasLayer, fetch_lipas_layers, run_blocking
+from src.reducer import layer_files, reduce_layers
+
 def getBordersFile(borders_path):
     # Read borders file. This file contains all municipality borders in Finland
     borders = gpd.read_file(borders_path)
@@ -23,6 +28,11 @@ def getJyväskyläAndMuurame():
     
     return borders
 
+# Clips the facility layers. Only the Jyväskylä and Muurame borders are available for now, whatever the municipality
+CLIPPING = ClippingEngine(lambda municipality: getJyväskyläAndMuurame())
+
+CELL_GRID_MAPPING_PATH = "../250m/jkl_mrm_250_mapple_cells.npz"
+
 def getGrid():
     grid_path = "../250m/jkl_mrm_250.shp"
     assert os.path.isfile(grid_path) 
@@ -34,70 +44,158 @@ def getGrid():
 # 1180 = frisbeegolf_rata
 # 1340 = pallokenttä
 # 2120 = kuntosali
-def getLipasData(typecode='1180', typename='frisbeegolf_rata', municipality='Jyväskylä', buffer=0):
+def getLipasLayers(layers, municipality='Jyväskylä', buffer=0, exact=False):
     """
-    This function fetches LIPAS data from WFS and sets its crs.
-    Arguments: First argument is 4 digit typecode of the sport facility and second is the typename of the sport facility in Finnish. The third argument is the chosen municipality. Fourth argument is the buffered distance from
-    municipality border.
+    This function fetches several LIPAS layers from WFS at once and sets their crs.
+    Arguments: First argument is a dict of 4 digit typecodes of the sport facilities to their typenames in Finnish.
+    The second argument is the chosen municipality. Third argument is the buffered distance from municipality border.
+    If exact is True, the facilities crossing the buffered border (routes, areas) are cut at the border, otherwise
+    they are kept whole.
+    Returns a dict of typecodes to the sport facilities near the municipality (EPSG:4326).
+    Only the facilities in the bounding box of the buffered municipality are downloaded. The WFS answers are cached,
+    and revalidated with the server after a day.
     """
-    # Fetching data from WFS using requests, in json format, using bounding box over the helsinki area
-    r = requests.get(r"http://lipas.cc.jyu.fi/geoserver/lipas/ows?service=wfs&version=2.0.0&request=GetFeature&typeNames=lipas:lipas_"""+typecode+"""_"""+typename+"""&bbox=-548576.0,1548576.0,6291456.0,8388608.0,EPSG:3067&outputFormat=json""")
+    # the buffered municipality area is computed once per (municipality, buffer)
+    area = CLIPPING.area(municipality, buffer)
 
-    # Creating GeoDataFrame from geojson
-    lipas_data = gpd.GeoDataFrame.from_features(geojson.loads(r.content))
-    
-    # Define crs for lipas_data
-    lipas_data.crs = CRS.from_epsg(3067)
-    
-    # Get the borders for municipalities
-    borders_path = "../sport-facility-data/data/mml/hallintorajat_10k/2020/SuomenKuntajako_2020_10k.shp"
-    borders = getBordersFile(borders_path)
-    
-    # choose municipality borders
-    muni_borders = getJyväskyläAndMuurame()
-    
-    # create a buffer surrounding the municipalities
-    buffered = muni_borders.buffer(distance=buffer)
+    # Fetching data from WFS, in json format, only in the bounding box of the buffered municipalities
+    collections = run_blocking(fetch_lipas_layers([LipasLayer(typecode, typename) for typecode, typename in layers.items()],
+                                                  bbox=tuple(area.bounds)))
+
+    sports_facilities = {}
+    for layer, collection in collections.items():
+        if not collection['features']:
+            sports_facilities[layer.typecode] = gpd.GeoDataFrame(geometry=[], crs=CRS.from_epsg(4326))
+            continue
+
+        # Creating GeoDataFrame from geojson
+        lipas_data = gpd.GeoDataFrame.from_features(collection['features'])
     
-    # create geodaframe from the buffered zone
-    muni_borders = gpd.GeoDataFrame(gpd.GeoSeries(buffered))
-    muni_borders = muni_borders.rename(columns={0:'geometry'})
-    muni_borders.crs = CRS.from_epsg(3067)
+        # Define crs for lipas_data
+        lipas_data.crs = CRS.from_epsg(3067)
+
+        # limit the output to be only sports facilities near the two municipalities
+        sports_facilities_in_municipality = CLIPPING.clip(lipas_data, municipality, buffer, exact=exact)
+        sports_facilities[layer.typecode] = sports_facilities_in_municipality.to_crs(epsg=4326)
 
-    # limit the output to be only sports facilities near the two municipalities
-    sports_facilities_in_municipality = gpd.overlay(lipas_data, muni_borders, how='intersection') 
-    sports_facilities_in_municipality = sports_facilities_in_municipality.to_crs(epsg=4326)
+    return sports_facilities
 
-    return sports_facilities_in_municipality
+
+def getLipasData(typecode='1180', typename='frisbeegolf_rata', municipality='Jyväskylä', buffer=0, exact=False):
+    """
+    This function fetches LIPAS data from WFS and sets its crs.
+    Arguments: First argument is 4 digit typecode of the sport facility and second is the typename of the sport facility in Finnish. The third argument is the chosen municipality. Fourth argument is the buffered distance from
+    municipality border.
+    Use getLipasLayers to fetch several typecodes at once.
+    """
+    return getLipasLayers({typecode: typename}, municipality=municipality, buffer=buffer, exact=exact)[typecode]
        
 
-def getReachabilityDF(folder, reachability_type): 
+def getReachabilityDF(folder, reachability_type, prefix='reachability'):
     '''
         Get reachability of sports facilities.
         Arguments: First: folder where the reachability files are. Second:
-        reachability_type is transportation mode, possible modes are walking, cycling, transit and driving. output_file_name is the output file name. Third: output_file_name is the name of the output folder.
-    '
+        reachability_type is transportation mode, possible modes are walking, cycling, transit and driving. Third:
+        prefix of the output files.
+        The files ('.acc_dump' or individual '.geojson') are read one layer at a time, and only the shortest travel
+        time of every grid cell is kept, together with the id of the facility it is reached from (origin_id).
     '''
     
     # Get filenames into a list
-    files = [filename for filename in os.listdir(folder) if filename.startswith(r'reachability_{}'.format(reachability_type))]
+    files = layer_files(folder, reachability_type, prefix)
 
-    # Init a new empty geodataframe
-    gdf = gpd.GeoDataFrame()
-    
-    # Loop through the file names and add the files to the geodataframe
-    for name in files:
-        r_path = r"./{}/{}".format(folder,name)
-        temp_gdf = gpd.read_file(r_path, driver="GeoJSON")
-        gdf = pd.concat([gdf, temp_gdf])
-    
-    # Sort values by travel time
-    gdf = gdf.sort_values(by='travel_time', ascending=True)
-    
     # Keep the shortest time for duplicate travel time locations. This needs to be done because there
     # can be multiple travel times for individual grid cells.
-    gdf = gdf.drop_duplicates(subset='id', keep="first")
+    gdf = reduce_layers(files).to_geodataframe()
     
     assert gdf['id'].is_unique
     
-    return gdf
\ No newline at end of file
+    return gdf
+
+
+def getOriginReachabilityDF(folder, reachability_type, origin_id, prefix='reachability'):
+    '''
+        Get the reachability layer of a single sports facility, without reading the rest of the dump.
+        Arguments: First: folder where the reachability files are. Second: reachability_type is transportation
+        mode (walking, cycling, transit or driving). Third: id of the facility (origin_id). Fourth: prefix of the
+        output files.
+    '''
+    with AccDumpReader(dump_path(folder, reachability_type, prefix)) as reader:
+        layer = reader.layer(origin_id, reachability_type)
+
+    return gpd.GeoDataFrame.from_features(layer['features'], crs='EPSG:4326')
+
+
+def getOriginsReachingCell(folder, reachability_type, cell_id, max_travel_time=None, prefix='reachability'):
+    '''
+        Get the sports facilities a grid cell is reached from, fastest first, as a DataFrame of origin_id,
+        travel_mode and travel_time.
+        Arguments: First: folder where the reachability files are. Second: reachability_type is transportation
+        mode. Third: id of the grid cell. Fourth: optional maximum travel time in minutes. Fifth: prefix of the
+        output files.
+        The cell index is written by main.py with '--cell_index', or built from the dump on the first call.
+    '''
+    path = dump_path(folder, reachability_type, prefix)
+    index = CellIndex(cell_index_path(path)) if os.path.exists(cell_index_path(path)) else CellIndex.build(path)
+    try:
+        rows = index.origins(cell_id, max_travel_time)
+    finally:
+        index.close()
+
+    return pd.DataFrame(rows, columns=['origin_id', 'travel_mode', 'travel_time'])
+
+
+def getColumnarReachabilityDF(folder, reachability_type, prefix='reachability'):
+    '''
+        Same result as getReachabilityDF, for the output of main.py with '--format parquet' or '--format arrow'.
+        Arguments: First: folder where the reachability files are. Second: reachability_type is transportation
+        mode (walking, cycling, transit or driving). Third: prefix of the output files.
+    '''
+    rows = read_reachability(folder, prefix, reachability_type)
+
+    # Keep the shortest travel time of every grid cell
+    rows = rows.sort_values(by='travel_time', ascending=True)
+    rows = rows.drop_duplicates(subset='cell_id', keep="first")
+
+    # Every grid cell is stored once, the rows only refer to it
+    cells = read_cells(folder, prefix)
+    gdf = cells.join(rows.set_index('cell_id')[['origin_id', 'travel_time']], how='inner')
+    gdf = gdf.drop(columns=['longitude', 'latitude'])
+    gdf.index = gdf.index.astype(str)
+    gdf = gdf.rename_axis('id').reset_index()
+
+    assert gdf['id'].is_unique
+
+    return gdf
+
+
+def getCellGridMapping(grid, outputs, path=CELL_GRID_MAPPING_PATH):
+    '''
+        Mapping from the Mapple grid cell ids to the rows of the population grid, to attribute the reachability
+        layers with attribute_grid(output, grid, mapping) instead of a spatial join per layer.
+        Arguments: First: the population grid (getGrid). Second: outputs of getReachabilityDF. Third: file where the
+        mapping is saved. Only the cells that are not in the saved mapping yet are joined spatially.
+    '''
+    mapping = CellGridMapping.load(path) if os.path.isfile(path) else CellGridMapping()
+    if mapping.grid_size is not None and mapping.grid_size != len(grid):
+        # saved for another grid
+        mapping = CellGridMapping()
+
+    added = sum(mapping.extend(output['id'], output.geometry, grid) for output in outputs)
+    if added:
+        mapping.save(path)
+
+    return mapping
+
+
+def getAccessibilityMetrics(layers, grid, population_column='he_vakiy', bands=TIME_BANDS,
+                            path=CELL_GRID_MAPPING_PATH):
+    '''
+        Population within each travel time band for every sport and travel mode.
+        Arguments: First: dict of (sport, mode) to the outputs of getReachabilityDF. Second: the population grid
+        (getGrid). Third: population column of the grid. Fourth: upper limits of the time bands in minutes.
+        Returns a DataFrame with the columns sport, travel_mode, band, population and share (of the grid population).
+    '''
+    mapping = getCellGridMapping(grid, layers.values(), path)
+
+    return accessibility_metrics(layers, mapping, grid[population_column], bands)
@@ -0,0 +1,69 @@
+from typing import Callable, Dict, Tuple
+
+import geopandas
+from shapely.ops import unary_union
+from shapely.prepared import prep
+
+
+class ClippingEngine:
+    """
+    Limits facility layers to a buffered municipality area. The area is dissolved and buffered once per
+    (municipality, buffer) and kept, together with its prepared geometry. Facilities are selected with a spatial
+    index predicate query instead of gpd.overlay: the index discards everything outside the area's bounding box
+    and only the remaining candidates are tested for intersection with the area itself. The prepared geometry is
+    only used by clip(), to find the facilities crossing the border, and no intersection is computed unless
+    `exact` or `representative_points` is set.
+    """
+
+    def __init__(self, load_borders: Callable[[str], geopandas.GeoDataFrame]):
+        self.load_borders = load_borders
+        self._areas: Dict[Tuple[str, float], tuple] = {}
+
+    def area(self, municipality: str, buffer: float = 0):
+        return self._area(municipality, buffer)[0]
+
+    def _area(self, municipality: str, buffer: float = 0) -> tuple:
+        key = (municipality, float(buffer))
+        if key not in self._areas:
+            borders = self.load_borders(municipality)
+            area = unary_union(list(borders.geometry))
+            if buffer:
+                area = area.buffer(buffer)
+            self._areas[key] = (area, prep(area), borders.crs)
+        return self._areas[key]
+
+    def select(self, facilities: geopandas.GeoDataFrame, municipality: str,
+               buffer: float = 0) -> geopandas.GeoDataFrame:
+        """
+        The facilities intersecting the buffered area, unchanged.
+        """
+        area, _, crs = self._area(municipality, buffer)
+        if facilities.crs is not None and crs is not None and facilities.crs != crs:
+            facilities = facilities.to_crs(crs)
+        if len(facilities) == 0:
+            return facilities
+        # the index keeps the candidates whose bounding box overlaps the area's, and tests them against the area
+        return facilities.iloc[sorted(facilities.sindex.query(area, predicate="intersects"))]
+
+    def clip(self, facilities: geopandas.GeoDataFrame, municipality: str, buffer: float = 0, exact: bool = False,
+             representative_points: bool = False) -> geopandas.GeoDataFrame:
+        """
+        Same facilities as gpd.overlay(facilities, area, how='intersection'). Lines and areas are kept whole unless
+        `exact` is set, in which case only the ones crossing the border are cut. With `representative_points`,
+        every facility is replaced by a point inside it and inside the area, which is what the reachability requests
+        start from.
+        """
+        selected = self.select(facilities, municipality, buffer).reset_index(drop=True)
+        if (exact or representative_points) and len(selected):
+            area, prepared, _ = self._area(municipality, buffer)
+            crossing = [index for index, geometry in enumerate(selected.geometry) if not prepared.contains(geometry)]
+            if crossing:
+                geometries = selected.geometry.copy()
+                geometries.iloc[crossing] = selected.geometry.iloc[crossing].intersection(area).values
+                selected = selected.set_geometry(geometries)
+        if representative_points and len(selected):
+            selected = selected.set_geometry(selected.geometry.representative_point())
+        return selected
+
+    def clear(self):
+        self._areas.clear()
@@ -0,0 +1,206 @@
+import glob
+import os
+from typing import Dict, List, Optional, Tuple
+
+from src.decoding import CELL_ATTRIBUTES, ReachabilityArrays, decode_compact
+from src.mapple_api import convertEnumToValue
+from src.scheduler import ReachabilityJob
+
+FORMATS = ("parquet", "arrow")
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("The 'parquet' and 'arrow' output formats need pyarrow "
+                          "(conda install -c conda-forge pyarrow)") from e
+    return pyarrow
+
+
+def cells_path(output_folder: str, prefix: str, output_format: str = "parquet") -> str:
+    return os.path.join(output_folder, "{prefix}_cells.{format}".format(prefix=prefix, format=output_format))
+
+
+def reachability_folder(output_folder: str, prefix: str) -> str:
+    return os.path.join(output_folder, "{prefix}_reachability".format(prefix=prefix))
+
+
+class ColumnarWriter:
+    """
+    Writes the reachability layers as two tables instead of one FeatureCollection per origin:
+    '<prefix>_cells.<format>' holds every grid cell once (cell_id, geometry ids, on_land, longitude, latitude) and
+    the '<prefix>_reachability' folder holds part files of (origin_id, travel_mode, cell_id, travel_time) rows.
+    A part file is complete on disk only once it is closed, so flush() starts a new part and returns the jobs it
+    contains. Not thread safe; ReachabilityWriter calls it from its own thread.
+    """
+
+    def __init__(self, output_folder: str, prefix: str, output_format: str = "parquet",
+                 rows_per_part: int = 2000000, append: bool = False):
+        if output_format not in FORMATS:
+            raise ValueError("Unknown columnar format '{format}'".format(format=output_format))
+        self.pa = _pyarrow()
+        self.output_format = output_format
+        self.rows_per_part = rows_per_part
+        self.cells_path = cells_path(output_folder, prefix, output_format)
+        self.folder = reachability_folder(output_folder, prefix)
+        os.makedirs(self.folder, exist_ok=True)
+
+        self._cells: Dict[int, Tuple] = {}
+        existing_parts = sorted(glob.glob(os.path.join(self.folder, "part-*.{format}".format(format=output_format))))
+        if append:
+            self._part = len(existing_parts)
+            if os.path.exists(self.cells_path):
+                self.add_cells(self.cells_path)
+        else:
+            self._part = 0
+            for path in existing_parts:
+                os.remove(path)
+        self._reset_buffers()
+
+    def _reset_buffers(self):
+        self._origin_ids: List[str] = []
+        self._travel_modes: List[str] = []
+        self._cell_ids: List[int] = []
+        self._travel_times: List[float] = []
+        self._jobs: List[ReachabilityJob] = []
+
+    @property
+    def pending_rows(self) -> int:
+        return len(self._cell_ids)
+
+    def add(self, job: ReachabilityJob, reachability):
+        if isinstance(reachability, (bytes, bytearray)):
+            reachability = decode_compact(reachability)
+        if isinstance(reachability, ReachabilityArrays):
+            self._add_arrays(job, reachability)
+            return
+        origin_id = str(job.origin_id)
+        travel_mode = convertEnumToValue(job.travel_mode)
+        for feature in reachability["features"]:
+            cell_id = int(feature["id"])
+            properties = feature["properties"]
+            if cell_id not in self._cells:
+                longitude, latitude = feature["geometry"]["coordinates"][:2]
+                self._cells[cell_id] = tuple(properties.get(name) for name in CELL_ATTRIBUTES) + (longitude, latitude)
+            self._origin_ids.append(origin_id)
+            self._travel_modes.append(travel_mode)
+            self._cell_ids.append(cell_id)
+            self._travel_times.append(properties["travel_time"])
+        self._jobs.append(job)
+
+    def _add_arrays(self, job: ReachabilityJob, arrays: ReachabilityArrays):
+        rows = len(arrays)
+        for index, cell_id in enumerate(arrays.cell_ids):
+            if cell_id not in self._cells:
+                self._cells[cell_id] = arrays.cell_attributes(index) + (arrays.longitudes[index],
+                                                                        arrays.latitudes[index])
+        self._origin_ids.extend([str(job.origin_id)] * rows)
+        self._travel_modes.extend([convertEnumToValue(job.travel_mode)] * rows)
+        self._cell_ids.extend(arrays.cell_ids)
+        self._travel_times.extend(arrays.travel_times)
+        self._jobs.append(job)
+
+    def flush(self) -> List[ReachabilityJob]:
+        if not self._jobs:
+            return []
+        pa = self.pa
+        table = pa.table({
+            "origin_id": pa.array(self._origin_ids, pa.string()).dictionary_encode(),
+            "travel_mode": pa.array(self._travel_modes, pa.string()).dictionary_encode(),
+            "cell_id": pa.array(self._cell_ids, pa.int64()),
+            "travel_time": pa.array(self._travel_times, pa.float32()),
+        })
+        self._write_table(table, self.next_part_path())
+        # the rows only point at cells, so the cells table has to be on disk before the jobs count as written
+        self.write_cells()
+        jobs = self._jobs
+        self._reset_buffers()
+        return jobs
+
+    def close(self) -> List[ReachabilityJob]:
+        return self.flush()
+
+    def next_part_path(self) -> str:
+        """
+        Reserves the path of the next part file (used to add the part files of another run, e.g. a shard).
+        """
+        path = os.path.join(self.folder, "part-{part:05d}.{format}".format(part=self._part, format=self.output_format))
+        self._part += 1
+        return path
+
+    def _write_table(self, table, path: str):
+        temporary_path = "{path}.part".format(path=path)
+        if self.output_format == "parquet":
+            self.pa.parquet.write_table(table, temporary_path, compression="zstd")
+        else:
+            with self.pa.OSFile(temporary_path, "wb") as sink:
+                with self.pa.ipc.new_file(sink, table.schema) as ipc_writer:
+                    ipc_writer.write_table(table)
+        os.replace(temporary_path, path)
+
+    def write_cells(self):
+        pa = self.pa
+        cell_ids = list(self._cells)
+        rows = list(self._cells.values())
+        columns = {"cell_id": pa.array(cell_ids, pa.int64())}
+        for index, name in enumerate(CELL_ATTRIBUTES):
+            columns[name] = pa.array([row[index] for row in rows], pa.string())
+        columns["longitude"] = pa.array([row[-2] for row in rows], pa.float64())
+        columns["latitude"] = pa.array([row[-1] for row in rows], pa.float64())
+        self._write_table(pa.table(columns), self.cells_path)
+
+    def add_cells(self, path: str):
+        """
+        Adds the grid cells of a cells table, keeping the cells already known.
+        """
+        table = read_table(path)
+        columns = [table.column(name).to_pylist() for name in ("cell_id",) + CELL_ATTRIBUTES +
+                   ("longitude", "latitude")]
+        for row in zip(*columns):
+            self._cells.setdefault(row[0], tuple(row[1:]))
+
+
+def read_table(path: str, columns: Optional[List[str]] = None, filters=None):
+    pa = _pyarrow()
+    if path.endswith(".parquet") or os.path.isdir(path):
+        return pa.parquet.read_table(path, columns=columns, filters=filters)
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns else table
+
+
+def read_reachability(output_folder: str, prefix: str, travel_mode: str = None):
+    """
+    Returns the reachability rows of a columnar run as a pandas DataFrame, optionally for one travel mode.
+    """
+    pa = _pyarrow()
+    folder = reachability_folder(output_folder, prefix)
+    parts = sorted(glob.glob(os.path.join(folder, "part-*.*")))
+    if not parts:
+        raise FileNotFoundError("No reachability part files in {folder}".format(folder=folder))
+    tables = [read_table(path) for path in parts]
+    table = pa.concat_tables([table.cast(tables[0].schema) for table in tables]) if len(tables) > 1 else tables[0]
+    dataframe = table.to_pandas()
+    if travel_mode is not None:
+        dataframe = dataframe[dataframe["travel_mode"] == convertEnumToValue(travel_mode)]
+    return dataframe
+
+
+def read_cells(output_folder: str, prefix: str):
+    """
+    Returns the grid cells of a columnar run as a GeoDataFrame (EPSG:4326) indexed by cell_id.
+    """
+    import geopandas
+
+    for output_format in FORMATS:
+        path = cells_path(output_folder, prefix, output_format)
+        if os.path.exists(path):
+            cells = read_table(path).to_pandas().set_index("cell_id")
+            return geopandas.GeoDataFrame(cells, geometry=geopandas.points_from_xy(cells["longitude"],
+                                                                                 cells["latitude"]),
+                                          crs="EPSG:4326")
+    raise FileNotFoundError("No cells table for prefix '{prefix}' in {folder}".format(prefix=prefix,
+                                                                                     folder=output_folder))
@@ -7,6 +7,12 @@ class MappleAPIConfig:
     def getMappleAPIKey():
         return os.getenv("MAPPLE_API_KEY")
 
+    @staticmethod
+    def getMappleAPIKeys():
+        # comma separated keys for sharded runs, each shard uses one of them
+        keys = [key.strip() for key in os.getenv("MAPPLE_API_KEYS", "").split(",") if key.strip()]
+        return keys if keys else [MappleAPIConfig.getMappleAPIKey()]
+
 
 class TravelModes(str, Enum):
     TRANSIT = "transit"
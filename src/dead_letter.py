@@ -0,0 +1,66 @@
+import os
+from typing import Iterator
+
+import rapidjson
+from starlette.exceptions import HTTPException
+
+from src.config import TimeOfDay, TimeProfile, TravelModes
+from src.mapple_api import convertEnumToValue
+from src.scheduler import ReachabilityJob
+
+
+class DeadLetterWriter:
+    """
+    Appends the jobs that failed permanently to a newline-delimited GeoJSON file. Every line is a point feature with
+    the travel mode and the request parameters as properties, so the file can be re-run with '--failed_jobs' or
+    opened as a layer.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def write(self, job: ReachabilityJob, exception: Exception, attempts: int = 1):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        properties = {field: convertEnumToValue(value) for field, value in job._asdict().items()
+                      if field not in ("latitude", "longitude")}
+        properties["status_code"] = getattr(exception, "status_code", None)
+        properties["detail"] = exception.detail if isinstance(exception, HTTPException) else str(exception)
+        properties["attempts"] = attempts
+        feature = {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [job.longitude, job.latitude]},
+            "properties": properties
+        }
+        self._file.write("{}\n".format(rapidjson.dumps(feature)))
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_dead_letters(path: str) -> Iterator[ReachabilityJob]:
+    with open(path) as dead_letter_file:
+        for line in dead_letter_file:
+            if not line.strip():
+                continue
+            feature = rapidjson.loads(line)
+            properties = feature["properties"]
+            longitude, latitude = feature["geometry"]["coordinates"][:2]
+            yield ReachabilityJob(origin_id=str(properties["origin_id"]), latitude=latitude, longitude=longitude,
+                                  travel_mode=TravelModes(properties["travel_mode"]),
+                                  radius=properties["radius"],
+                                  maxTimeThreshold=properties["maxTimeThreshold"],
+                                  walking_speed_kmph=properties["walking_speed_kmph"],
+                                  cycling_speed_kmph=properties["cycling_speed_kmph"],
+                                  timeOfDay=TimeOfDay(properties["timeOfDay"]),
+                                  timeProfile=TimeProfile(properties["timeProfile"]))
+
+
+def dead_letter_path(output_folder: str, prefix: str) -> str:
+    return os.path.join(output_folder, "{prefix}_failed.geojsonl".format(prefix=prefix))
@@ -0,0 +1,192 @@
+import asyncio
+import queue
+from array import array
+from typing import Optional
+
+import rapidjson
+
+DECODE_MODES = ("dict", "compact", "raw")
+CELL_ATTRIBUTES = ("geometry_id_1", "geometry_id_2", "geometry_id_3", "on_land")
+MISSING = -1
+
+
+def _cell_id(feature_id) -> int:
+    try:
+        cell_id = int(feature_id)
+    except (TypeError, ValueError):
+        cell_id = None
+    if cell_id is None or str(cell_id) != str(feature_id):
+        raise ValueError("Grid cell id {feature_id!r} is not an integer".format(feature_id=feature_id))
+    return cell_id
+
+
+def _to_str(value: int) -> Optional[str]:
+    return None if value == MISSING else str(value)
+
+
+class ReachabilityArrays:
+    """
+    Column-wise copy of a reachability FeatureCollection: one typed array per field instead of one dict tree per
+    feature (about 60 bytes per grid cell instead of a few kilobytes). Travel times keep the precision of the
+    answers (float64), like the dict decoding. The grid cell ids and attributes are numeric strings in the API
+    answers; they are stored as integers, with -1 for null. An id that is not an integer written the canonical
+    way (e.g. '007' or 'A1') is rejected, as it would not come back unchanged.
+    """
+
+    __slots__ = ("cell_ids", "travel_times", "longitudes", "latitudes",
+                 "geometry_ids_1", "geometry_ids_2", "geometry_ids_3", "on_land")
+
+    def __init__(self):
+        self.cell_ids = array("q")
+        self.travel_times = array("d")
+        self.longitudes = array("d")
+        self.latitudes = array("d")
+        self.geometry_ids_1 = array("q")
+        self.geometry_ids_2 = array("q")
+        self.geometry_ids_3 = array("q")
+        self.on_land = array("b")
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    def append(self, feature: dict):
+        # called for every feature of every answer: the conversions are inlined, as the function calls took a
+        # sizeable part of the decoding time
+        properties = feature["properties"]
+        coordinates = feature["geometry"]["coordinates"]
+        feature_id = feature["id"]
+        if type(feature_id) is str and feature_id.isascii() and feature_id.isdigit() \
+                and (feature_id[0] != "0" or len(feature_id) == 1):
+            self.cell_ids.append(int(feature_id))
+        else:
+            self.cell_ids.append(_cell_id(feature_id))
+        self.travel_times.append(properties["travel_time"])
+        self.longitudes.append(coordinates[0])
+        self.latitudes.append(coordinates[1])
+        value = properties.get("geometry_id_1")
+        self.geometry_ids_1.append(MISSING if value is None else int(value))
+        value = properties.get("geometry_id_2")
+        self.geometry_ids_2.append(MISSING if value is None else int(value))
+        value = properties.get("geometry_id_3")
+        self.geometry_ids_3.append(MISSING if value is None else int(value))
+        value = properties.get("on_land")
+        self.on_land.append(MISSING if value is None else int(value))
+
+    def cell_attributes(self, index: int) -> tuple:
+        """
+        The attributes of one grid cell as they appear in the API answers (geometry ids and on_land as strings).
+        """
+        return (_to_str(self.geometry_ids_1[index]), _to_str(self.geometry_ids_2[index]),
+                _to_str(self.geometry_ids_3[index]), _to_str(self.on_land[index]))
+
+    def within(self, max_travel_time: float) -> "ReachabilityArrays":
+        """
+        The cells reached in at most `max_travel_time` minutes.
+        """
+        keep = [index for index, travel_time in enumerate(self.travel_times) if travel_time <= max_travel_time]
+        selected = ReachabilityArrays()
+        for name in self.__slots__:
+            column = getattr(self, name)
+            setattr(selected, name, array(column.typecode, [column[index] for index in keep]))
+        return selected
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(column) * column.itemsize for column in (getattr(self, name) for name in self.__slots__))
+
+    def to_feature_collection(self) -> dict:
+        features = []
+        for index in range(len(self.cell_ids)):
+            properties = dict(zip(CELL_ATTRIBUTES, self.cell_attributes(index)))
+            properties["travel_time"] = float(self.travel_times[index])
+            features.append({
+                "id": str(self.cell_ids[index]),
+                "type": "Feature",
+                "properties": properties,
+                "geometry": {"type": "Point", "coordinates": [self.longitudes[index], self.latitudes[index]]}
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+
+class ReachabilityDecoder(rapidjson.Decoder):
+    """
+    Decodes a reachability answer into ReachabilityArrays. Every feature is copied into the arrays as soon as
+    rapidjson has parsed it and then dropped, so the full dict tree is never built.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.arrays = ReachabilityArrays()
+
+    def end_object(self, mapping):
+        if mapping.get("type") == "Feature":
+            self.arrays.append(mapping)
+            return None
+        return mapping
+
+
+def decode_compact(body) -> ReachabilityArrays:
+    """
+    Decodes a whole body (bytes) or a file-like object read in chunks.
+    """
+    decoder = ReachabilityDecoder()
+    if isinstance(body, (bytes, bytearray, str)):
+        decoder(body)
+    else:
+        decoder(body, chunk_size=65536)
+    return decoder.arrays
+
+
+class ChunkStream:
+    """
+    Blocking file-like view over chunks pushed from the event loop, so that a decoder running in an executor
+    thread can parse a response body while it is still being received.
+    """
+
+    def __init__(self):
+        self._chunks: queue.Queue = queue.Queue()
+        self._buffer = b""
+        self._closed = False
+
+    def feed(self, chunk: bytes):
+        self._chunks.put(chunk)
+
+    def feed_eof(self):
+        self._chunks.put(b"")
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._closed and (size < 0 or len(self._buffer) < size):
+            chunk = self._chunks.get()
+            if not chunk:
+                self._closed = True
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+async def decode_compact_stream(content, keep_body: bool = False):
+    """
+    Decodes an aiohttp response body chunk by chunk in an executor thread. Returns (arrays, body); body is None
+    unless keep_body is set (e.g. to store the answer in the response cache).
+    """
+    stream = ChunkStream()
+    decoding = asyncio.get_event_loop().run_in_executor(None, decode_compact, stream)
+    chunks = [] if keep_body else None
+    try:
+        async for chunk in content.iter_chunked(65536):
+            stream.feed(chunk)
+            if keep_body:
+                chunks.append(chunk)
+    except BaseException:
+        # the decoder fails on the truncated body; the transfer error is the one to report
+        stream.feed_eof()
+        try:
+            await decoding
+        except Exception:
+            pass
+        raise
+    stream.feed_eof()
+    arrays = await decoding
+    return arrays, (b"".join(chunks) if keep_body else None)
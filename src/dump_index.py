@@ -0,0 +1,345 @@
+import mmap
+import os
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import rapidjson
+
+from src.decoding import ReachabilityArrays, decode_compact
+from src.mapple_api import convertEnumToValue
+
+IndexKey = Tuple[str, str]
+
+
+def dump_path(folder: str, travel_mode, prefix: str = "reachability") -> str:
+    return os.path.join(folder, "{prefix}_{travel_mode}.acc_dump".format(
+        prefix=prefix, travel_mode=convertEnumToValue(travel_mode)))
+
+
+def index_path(dump_path: str) -> str:
+    return "{path}.idx".format(path=dump_path)
+
+
+def cell_index_path(dump_path: str) -> str:
+    return "{path}.cells.sqlite".format(path=dump_path)
+
+
+def reset_indexes(dump_path: str):
+    """
+    Removes the indexes of a dump, e.g. when the dump is truncated for a new run.
+    """
+    for path in (index_path(dump_path), cell_index_path(dump_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def index_line(origin_id: str, travel_mode, offset: int, length: int) -> bytes:
+    return rapidjson.dumps([str(origin_id), convertEnumToValue(travel_mode), offset, length]).encode("utf-8") + b"\n"
+
+
+def cells_of(record) -> Tuple[Iterable[int], Iterable[float]]:
+    """
+    The cell ids and travel times of a reachability layer (dict, ReachabilityArrays or raw body).
+    """
+    if isinstance(record, (bytes, bytearray)):
+        record = decode_compact(record)
+    if isinstance(record, ReachabilityArrays):
+        return record.cell_ids, record.travel_times
+    features = record.get("features", [])
+    return [int(feature["id"]) for feature in features], [feature["properties"]["travel_time"] for feature in features]
+
+
+class _OriginDecoder(rapidjson.Decoder):
+    """
+    Reads only the 'origin' member of a layer: the features are dropped as soon as they are parsed.
+    """
+
+    def end_object(self, mapping):
+        return None if mapping.get("type") == "Feature" else mapping
+
+
+def _origin_member(line: bytes) -> Optional[dict]:
+    return (_OriginDecoder()(line) or {}).get("origin")
+
+
+def _origin_of(line: bytes) -> Optional[IndexKey]:
+    origin = _origin_member(line)
+    if not origin:
+        return None
+    return str(origin.get("origin_id")), origin.get("travel_mode")
+
+
+class AccDumpReader:
+    """
+    Random access to the layers of an '.acc_dump' file. The file is memory-mapped and only the requested lines are
+    decoded, found through the '<dump>.idx' index that ReachabilityWriter keeps next to it: one
+    [origin_id, travel_mode, offset, length] line per layer. A missing or stale index is rebuilt by scanning the
+    dump once (only the part written after the last index entry, when the dump has grown since). When a layer was
+    written twice, the last one wins.
+    """
+
+    def __init__(self, dump_path: str):
+        self.path = dump_path
+        self._file = open(dump_path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.size = size
+        self.index: Dict[IndexKey, Tuple[int, int]] = {}
+        self._origins: Dict[str, List[IndexKey]] = {}
+        self._load_index()
+
+    def _load_index(self):
+        indexed_end = 0
+        repaired = False
+        path = index_path(self.path)
+        if os.path.exists(path):
+            with open(path, "rb") as index_file:
+                for line in index_file:
+                    try:
+                        origin_id, travel_mode, offset, length = rapidjson.loads(line)
+                    except ValueError:
+                        # a line cut by a crash, the layers after it are indexed again below
+                        repaired = True
+                        break
+                    if offset + length > self.size:
+                        # the dump was truncated after the index was written
+                        self.index.clear()
+                        indexed_end = 0
+                        repaired = True
+                        break
+                    self.index[(origin_id, travel_mode)] = (offset, length)
+                    indexed_end = max(indexed_end, offset + length)
+        if indexed_end < self.size and self._scan(indexed_end):
+            repaired = True
+        if repaired:
+            self._write_index()
+        for key in self.index:
+            self._origins.setdefault(key[0], []).append(key)
+
+    def _scan(self, start: int) -> int:
+        """
+        Indexes the layers from `start` to the end of the dump. Returns the number of layers found.
+        """
+        found = 0
+        offset = start
+        while offset < self.size:
+            end = self._map.find(b"\n", offset)
+            end = self.size if end < 0 else end + 1
+            line = self._map[offset:end]
+            if line.strip():
+                key = _origin_of(line)
+                if key is not None:
+                    self.index[key] = (offset, end - offset)
+                    found += 1
+            offset = end
+        return found
+
+    def _write_index(self):
+        """
+        Replaces the index file by the entries read and scanned. It is rewritten rather than appended to, so that
+        a cut line is not kept, and other readers only ever see a complete file. A writer still appending to the
+        replaced file loses its next entries; the next reader indexes their layers again.
+        """
+        temporary_path = "{path}.{pid}.part".format(path=index_path(self.path), pid=os.getpid())
+        with open(temporary_path, "wb") as index_file:
+            index_file.writelines(index_line(origin_id, travel_mode, offset, length)
+                                  for (origin_id, travel_mode), (offset, length)
+                                  in sorted(self.index.items(), key=lambda item: item[1][0]))
+        os.replace(temporary_path, index_path(self.path))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, origin_id) -> bool:
+        return str(origin_id) in self._origins
+
+    def keys(self) -> List[IndexKey]:
+        return list(self.index)
+
+    def _key(self, origin_id, travel_mode=None) -> IndexKey:
+        origin_id = str(origin_id)
+        if travel_mode is not None:
+            return origin_id, convertEnumToValue(travel_mode)
+        keys = self._origins.get(origin_id, [])
+        if len(keys) != 1:
+            raise KeyError(origin_id if not keys else "{origin_id} is in the dump for several travel modes, give "
+                                                      "the travel mode".format(origin_id=origin_id))
+        return keys[0]
+
+    def raw(self, origin_id, travel_mode=None) -> bytes:
+        """
+        The line of a layer, as written.
+        """
+        offset, length = self.index[self._key(origin_id, travel_mode)]
+        return self._map[offset:offset + length]
+
+    def layer(self, origin_id, travel_mode=None, decode: str = "dict"):
+        """
+        The layer of an origin: a FeatureCollection dict, or ReachabilityArrays with decode='compact'.
+        """
+        line = self.raw(origin_id, travel_mode)
+        return decode_compact(line) if decode == "compact" else rapidjson.loads(line)
+
+    def origin(self, origin_id, travel_mode=None) -> dict:
+        """
+        The 'origin' member of a layer (origin_id, travel_mode and coordinates), without building its features.
+        """
+        return _origin_member(self.raw(origin_id, travel_mode))
+
+    def layers(self, decode: str = "dict") -> Iterator[Tuple[IndexKey, object]]:
+        """
+        Every layer in the order of the file, decoded one at a time.
+        """
+        for key, _ in sorted(self.index.items(), key=lambda item: item[1][0]):
+            yield key, self.layer(*key, decode=decode)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class CellIndex:
+    """
+    Inverted index of a dump: which origins reach a grid cell, and in how long. Kept in SQLite next to the dump
+    ('<dump>.cells.sqlite'), by the writer with --cell_index or afterwards with build().
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS cell_origins (
+                cell_id INTEGER NOT NULL,
+                origin_id TEXT NOT NULL,
+                travel_mode TEXT NOT NULL,
+                travel_time REAL NOT NULL
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cell_origins_cell_id ON cell_origins (cell_id)")
+        # the layers of an origin are replaced or removed by origin, without scanning the table
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cell_origins_origin "
+                                 "ON cell_origins (origin_id, travel_mode)")
+        self._connection.commit()
+
+    def add(self, origin_id: str, travel_mode, cell_ids: Iterable[int], travel_times: Iterable[float],
+            replace: bool = True):
+        """
+        Adds the cells of one layer, replacing the ones of a previous layer of the same origin unless `replace` is
+        False (the origin is known to be new). Call commit() to make them visible to the readers.
+        """
+        origin_id, travel_mode = str(origin_id), convertEnumToValue(travel_mode)
+        if replace:
+            self._connection.execute("DELETE FROM cell_origins WHERE origin_id = ? AND travel_mode = ?",
+                                     (origin_id, travel_mode))
+        self._connection.executemany("INSERT INTO cell_origins VALUES (?, ?, ?, ?)",
+                                     ((int(cell_id), origin_id, travel_mode, float(travel_time))
+                                      for cell_id, travel_time in zip(cell_ids, travel_times)))
+
+    def add_index(self, path: str):
+        """
+        Copies the rows of another cell index, e.g. the one of a shard.
+        """
+        self._connection.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            self._connection.execute("INSERT INTO cell_origins SELECT * FROM other.cell_origins")
+            self._connection.commit()
+        finally:
+            self._connection.execute("DETACH DATABASE other")
+
+    def remove_origins(self, origin_ids: Iterable[str]):
+        self._connection.executemany("DELETE FROM cell_origins WHERE origin_id = ?",
+                                     [(str(origin_id),) for origin_id in origin_ids])
+        self._connection.commit()
+
+    def commit(self):
+        self._connection.commit()
+
+    def origins(self, cell_id: int, max_travel_time: float = None) -> List[Tuple[str, str, float]]:
+        """
+        The (origin_id, travel_mode, travel_time) reaching a cell, fastest first.
+        """
+        query = "SELECT origin_id, travel_mode, travel_time FROM cell_origins WHERE cell_id = ?"
+        parameters: tuple = (int(cell_id),)
+        if max_travel_time is not None:
+            query += " AND travel_time <= ?"
+            parameters += (max_travel_time,)
+        return [tuple(row) for row in self._connection.execute(query + " ORDER BY travel_time, origin_id",
+                                                               parameters)]
+
+    @classmethod
+    def build(cls, dump_path: str) -> "CellIndex":
+        """
+        Indexes the cells of an existing dump. The index starts empty and the reader yields every layer once.
+        """
+        if os.path.exists(cell_index_path(dump_path)):
+            os.remove(cell_index_path(dump_path))
+        index = cls(cell_index_path(dump_path))
+        with AccDumpReader(dump_path) as reader:
+            for (origin_id, travel_mode), layer in reader.layers(decode="compact"):
+                index.add(origin_id, travel_mode, layer.cell_ids, layer.travel_times, replace=False)
+        index.commit()
+        return index
+
+    def close(self):
+        self._connection.close()
+
+
+def compact_dump(dump_path: str, origin_ids: Set[str]) -> int:
+    """
+    Rewrites a dump without the layers of `origin_ids`, together with its indexes. The dump is rewritten from its
+    index, so only the last copy of a layer written twice is kept, and lines without an 'origin' member are not.
+    Returns the number of layers dropped; the dump is left untouched when there are none.
+    """
+    origin_ids = {str(origin_id) for origin_id in origin_ids}
+    temporary_path = "{path}.part".format(path=dump_path)
+    with AccDumpReader(dump_path) as reader:
+        kept = sorted(((offset, length, key) for key, (offset, length) in reader.index.items()
+                       if key[0] not in origin_ids), key=lambda entry: entry[0])
+        dropped = len(reader) - len(kept)
+        if not dropped:
+            return 0
+        with open(temporary_path, "wb") as target, open("{path}.part".format(path=index_path(dump_path)), "wb") \
+                as index_file:
+            for offset, length, (origin_id, travel_mode) in kept:
+                index_file.write(index_line(origin_id, travel_mode, target.tell(), length))
+                target.write(reader.raw(origin_id, travel_mode))
+    os.replace(temporary_path, dump_path)
+    os.replace("{path}.part".format(path=index_path(dump_path)), index_path(dump_path))
+    if os.path.exists(cell_index_path(dump_path)):
+        cell_index = CellIndex(cell_index_path(dump_path))
+        cell_index.remove_origins(origin_ids)
+        cell_index.close()
+    return dropped
+
+
+def merge_indexes(dump_paths: List[str], target_path: str):
+    """
+    Writes the indexes of a dump made by concatenating `dump_paths`: the offsets of every dump move by the size of
+    the dumps before it. Dumps without an index are indexed first.
+    """
+    base = 0
+    with open("{path}.part".format(path=index_path(target_path)), "wb") as target:
+        for dump_path in dump_paths:
+            with AccDumpReader(dump_path) as reader:
+                for (origin_id, travel_mode), (offset, length) in sorted(reader.index.items(),
+                                                                          key=lambda item: item[1][0]):
+                    target.write(index_line(origin_id, travel_mode, base + offset, length))
+                base += reader.size
+    os.replace("{path}.part".format(path=index_path(target_path)), index_path(target_path))
+
+    cell_indexes = [cell_index_path(path) for path in dump_paths if os.path.exists(cell_index_path(path))]
+    if os.path.exists(cell_index_path(target_path)):
+        os.remove(cell_index_path(target_path))
+    if cell_indexes:
+        merged = CellIndex(cell_index_path(target_path))
+        for path in cell_indexes:
+            merged.add_index(path)
+        merged.close()
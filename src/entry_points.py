@@ -0,0 +1,91 @@
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+import rapidjson
+
+NEWLINE_DELIMITED_SUFFIXES = (".geojsonl", ".geojsons", ".ndjson", ".jsonl")
+
+
+class EntryPoints:
+    """
+    The entry points of a run as compact arrays: the 'id' property of every feature (None when it has none) and its
+    longitude and latitude. Iterating yields (id, longitude, latitude).
+    """
+
+    def __init__(self):
+        self.ids: List[Optional[object]] = []
+        self.longitudes = array("d")
+        self.latitudes = array("d")
+        # features without a geometry, they cannot be requested
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[Tuple[Optional[object], float, float]]:
+        return zip(self.ids, self.longitudes, self.latitudes)
+
+    def add_feature(self, feature: dict):
+        geometry = feature.get("geometry")
+        if not geometry:
+            self.skipped += 1
+            return
+        longitude, latitude = point_of(geometry)
+        self.ids.append((feature.get("properties") or {}).get("id"))
+        self.longitudes.append(longitude)
+        self.latitudes.append(latitude)
+
+
+def point_of(geometry: dict) -> Tuple[float, float]:
+    """
+    The coordinates of a Point geometry. Other geometries are converted with shapely, imported only then, to a
+    point inside them.
+    """
+    if geometry.get("type") == "Point":
+        coordinates = geometry["coordinates"]
+        return coordinates[0], coordinates[1]
+    from shapely.geometry import shape
+
+    point = shape(geometry).representative_point()
+    return point.x, point.y
+
+
+class EntryPointsDecoder(rapidjson.Decoder):
+    """
+    Decodes a GeoJSON FeatureCollection while it is read, adding every feature to `entry_points` as soon as it is
+    complete instead of keeping its dict.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.entry_points = EntryPoints()
+
+    def end_object(self, mapping):
+        if mapping.get("type") == "Feature":
+            self.entry_points.add_feature(mapping)
+            return None
+        return mapping
+
+
+def is_newline_delimited(path: str) -> bool:
+    return path.lower().endswith(NEWLINE_DELIMITED_SUFFIXES)
+
+
+def read_entry_points(path: str, chunk_size: int = 1024 * 1024) -> EntryPoints:
+    """
+    Reads the entry points of a GeoJSON FeatureCollection or of newline-delimited GeoJSON features ('.geojsonl',
+    '.geojsons', '.ndjson', '.jsonl'), in chunks of `chunk_size` bytes. Coordinates are taken as longitude and
+    latitude (WGS 84), as GeoJSON requires.
+    """
+    if is_newline_delimited(path):
+        entry_points = EntryPoints()
+        with open(path, "rb") as entry_points_file:
+            for line in entry_points_file:
+                if line.strip():
+                    entry_points.add_feature(rapidjson.loads(line))
+        return entry_points
+
+    decoder = EntryPointsDecoder()
+    with open(path, "rb") as entry_points_file:
+        decoder(entry_points_file, chunk_size=chunk_size)
+    return decoder.entry_points
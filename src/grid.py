@@ -0,0 +1,150 @@
+import os
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy
+import pandas
+
+TIME_BANDS = (5, 10, 15, 20, 30)
+OUTSIDE_GRID = -1
+
+
+class CellGridMapping:
+    """
+    Maps Mapple grid cell ids to the rows of a population grid. The cells are joined spatially once (with their
+    point geometry projected to the grid's crs) and the mapping is saved, so that attributing a reachability layer
+    is a hash lookup on the cell ids instead of a spatial join per layer. Cells outside the grid are kept too, with
+    row -1, so that they are not joined again.
+    """
+
+    def __init__(self, cell_ids: Sequence[int] = (), grid_rows: Sequence[int] = (), grid_size: int = None):
+        self.cell_ids = numpy.asarray(cell_ids, dtype=numpy.int64)
+        self.grid_rows = numpy.asarray(grid_rows, dtype=numpy.int64)
+        self.grid_size = grid_size
+        self._index = pandas.Index(self.cell_ids)
+
+    def __len__(self):
+        return len(self.cell_ids)
+
+    def _lookup(self, cell_ids) -> numpy.ndarray:
+        return self._index.get_indexer(numpy.asarray(cell_ids, dtype=numpy.int64))
+
+    def missing(self, cell_ids) -> numpy.ndarray:
+        cell_ids = numpy.asarray(cell_ids, dtype=numpy.int64)
+        return numpy.unique(cell_ids[self._lookup(cell_ids) < 0])
+
+    def rows(self, cell_ids) -> numpy.ndarray:
+        """
+        The grid rows of the given cells, -1 for the cells outside the grid or not mapped yet.
+        """
+        positions = self._lookup(cell_ids)
+        rows = numpy.full(len(positions), OUTSIDE_GRID, dtype=numpy.int64)
+        known = positions >= 0
+        rows[known] = self.grid_rows[positions[known]]
+        return rows
+
+    def extend(self, cell_ids, points, grid) -> int:
+        """
+        Joins the cells that are not mapped yet. `points` are their geometries (a GeoSeries with a crs), `grid`
+        the population grid GeoDataFrame. Returns the number of new cells.
+        """
+        import geopandas
+
+        if self.grid_size is None:
+            self.grid_size = len(grid)
+        elif self.grid_size != len(grid):
+            raise ValueError("The mapping was built for a grid of {size} cells, not {new}".format(
+                size=self.grid_size, new=len(grid)))
+        cell_ids = numpy.asarray(cell_ids, dtype=numpy.int64)
+        new = self._lookup(cell_ids) < 0
+        new &= ~pandas.Series(cell_ids).duplicated().to_numpy()
+        if not new.any():
+            return 0
+
+        cells = geopandas.GeoDataFrame({"cell_id": cell_ids[new]},
+                                       geometry=geopandas.GeoSeries(numpy.asarray(points)[new], crs=points.crs))
+        cells = cells.to_crs(grid.crs)
+        polygons = geopandas.GeoDataFrame(geometry=grid.geometry.values, crs=grid.crs)
+        joined = geopandas.sjoin(cells, polygons, how="left", op="intersects")
+        # a cell on the border of two grid cells goes to the first one
+        joined = joined[~joined.index.duplicated(keep="first")]
+        rows = joined["index_right"].fillna(OUTSIDE_GRID).to_numpy(dtype=numpy.int64)
+
+        self.cell_ids = numpy.concatenate([self.cell_ids, joined["cell_id"].to_numpy(dtype=numpy.int64)])
+        self.grid_rows = numpy.concatenate([self.grid_rows, rows])
+        self._index = pandas.Index(self.cell_ids)
+        return len(rows)
+
+    def save(self, path: str):
+        temporary_path = "{path}.part.npz".format(path=path)
+        numpy.savez(temporary_path, cell_ids=self.cell_ids, grid_rows=self.grid_rows,
+                    grid_size=numpy.int64(-1 if self.grid_size is None else self.grid_size))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CellGridMapping":
+        with numpy.load(path) as arrays:
+            grid_size = int(arrays["grid_size"])
+            return cls(arrays["cell_ids"], arrays["grid_rows"], None if grid_size < 0 else grid_size)
+
+
+def cell_ids_of(reachability: pandas.DataFrame) -> numpy.ndarray:
+    """
+    The cell ids of a reachability DataFrame: the 'cell_id' column of the columnar outputs, or the 'id' column
+    (strings) of getReachabilityDF.
+    """
+    column = reachability["cell_id"] if "cell_id" in reachability.columns else reachability["id"]
+    return column.to_numpy().astype(numpy.int64)
+
+
+def attribute_grid(reachability, grid, mapping: CellGridMapping):
+    """
+    Same rows as gpd.sjoin(reachability, grid, how='inner'): every reachability cell inside the grid, with the
+    attributes of its grid cell.
+    """
+    rows = mapping.rows(cell_ids_of(reachability))
+    inside = rows >= 0
+    attributes = grid.drop(columns=grid.geometry.name).iloc[rows[inside]]
+    joined = reachability[inside].copy()
+    joined["index_right"] = attributes.index.to_numpy()
+    for column in attributes.columns:
+        if column not in joined.columns:
+            joined[column] = attributes[column].to_numpy()
+    return joined
+
+
+def grid_travel_times(mapping: CellGridMapping, cell_ids, travel_times, grid_size: int) -> numpy.ndarray:
+    """
+    The shortest travel time to every grid cell (inf when unreached); several Mapple cells can fall in one grid cell.
+    """
+    rows = mapping.rows(cell_ids)
+    inside = rows >= 0
+    times = numpy.full(grid_size, numpy.inf)
+    numpy.minimum.at(times, rows[inside], numpy.asarray(travel_times, dtype=numpy.float64)[inside])
+    return times
+
+
+def population_by_time_band(times: numpy.ndarray, population: numpy.ndarray,
+                            bands: Sequence[float] = TIME_BANDS) -> numpy.ndarray:
+    """
+    Population within each travel time band (travel time <= band), from the grid travel times.
+    """
+    band_index = numpy.searchsorted(numpy.asarray(bands, dtype=numpy.float64), times, side="left")
+    per_band = numpy.bincount(band_index, weights=population, minlength=len(bands) + 1)[:len(bands)]
+    return numpy.cumsum(per_band)
+
+
+def accessibility_metrics(layers: Dict[Tuple[str, str], pandas.DataFrame], mapping: CellGridMapping,
+                          population: Iterable[float], bands: Sequence[float] = TIME_BANDS) -> pandas.DataFrame:
+    """
+    Population within each time band for every (sport, travel mode) reachability layer, as rows of
+    (sport, travel_mode, band, population, share).
+    """
+    population = numpy.nan_to_num(numpy.asarray(population, dtype=numpy.float64))
+    total = population.sum()
+    records: List[tuple] = []
+    for (sport, travel_mode), reachability in layers.items():
+        times = grid_travel_times(mapping, cell_ids_of(reachability), reachability["travel_time"].to_numpy(),
+                                  len(population))
+        for band, band_population in zip(bands, population_by_time_band(times, population, bands)):
+            records.append((sport, travel_mode, band, band_population, band_population / total if total else 0.0))
+    return pandas.DataFrame.from_records(records, columns=["sport", "travel_mode", "band", "population", "share"])
@@ -0,0 +1,262 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+import aiohttp
+import rapidjson
+from starlette.exceptions import HTTPException
+from starlette.status import HTTP_200_OK, HTTP_304_NOT_MODIFIED, HTTP_408_REQUEST_TIMEOUT, \
+    HTTP_500_INTERNAL_SERVER_ERROR
+
+LIPAS_WFS_URL = "http://lipas.cc.jyu.fi/geoserver/lipas/ows"
+LIPAS_CRS = "EPSG:3067"
+# the whole of Finland, what getLipasData used to request
+FINLAND_BBOX = (-548576.0, 1548576.0, 6291456.0, 8388608.0)
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "lipas_wfs_cache")
+
+
+class LipasLayer(NamedTuple):
+    typecode: str
+    typename: str
+
+    @property
+    def type_name(self) -> str:
+        return "lipas:lipas_{typecode}_{typename}".format(typecode=self.typecode, typename=self.typename)
+
+
+def getfeature_params(type_name: str, bbox: Tuple[float, float, float, float] = None, cql_filter: str = None,
+                      count: int = None, start_index: int = 0, srs_name: str = LIPAS_CRS,
+                      sort_by: str = "id") -> Dict[str, str]:
+    """
+    WFS 2.0 GetFeature parameters. GeoServer does not accept a bbox together with a CQL filter, so the bbox is
+    ignored when a filter is given (use BBOX(...) or INTERSECTS(...) in the filter instead). Pages are sorted by
+    the `sort_by` property: without an order, the server may return the features of two pages in different orders
+    and skip or repeat some of them.
+    """
+    params = {
+        "service": "wfs",
+        "version": "2.0.0",
+        "request": "GetFeature",
+        "typeNames": type_name,
+        "outputFormat": "json",
+        "srsName": srs_name,
+    }
+    if cql_filter is not None:
+        params["CQL_FILTER"] = cql_filter
+    elif bbox is not None:
+        params["bbox"] = "{},{},{},{},{srs}".format(*bbox, srs=srs_name)
+    if count is not None:
+        params["count"] = str(count)
+        params["startIndex"] = str(start_index)
+        params["sortBy"] = "{sort_by} ASC".format(sort_by=sort_by)
+    return params
+
+
+class CachedResponse(NamedTuple):
+    body: bytes
+    etag: Optional[str]
+    last_modified: Optional[str]
+    fetched_at: float
+
+
+class WFSCache:
+    """
+    Local copy of the WFS answers. Unlike the reachability cache, entries do not expire: once they are older than
+    the client's max_age they are revalidated with If-None-Match / If-Modified-Since, and kept when the server
+    answers 'Not Modified'.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, compression_level: int = 6):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "wfs_responses.sqlite")
+        self.compression_level = compression_level
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS wfs_responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )""")
+        self._connection.commit()
+
+    @staticmethod
+    def key(url: str, params: Dict[str, str]) -> str:
+        return hashlib.sha256(rapidjson.dumps([url, params], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._connection.execute("SELECT body, etag, last_modified, fetched_at FROM wfs_responses "
+                                           "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return CachedResponse(zlib.decompress(row[0]), row[1], row[2], row[3])
+
+    def put(self, key: str, body: bytes, etag: str = None, last_modified: str = None):
+        compressed = zlib.compress(body, self.compression_level)
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO wfs_responses VALUES (?, ?, ?, ?, ?)",
+                                     (key, compressed, etag, last_modified, time.time()))
+            self._connection.commit()
+
+    def touch(self, key: str):
+        with self._lock:
+            self._connection.execute("UPDATE wfs_responses SET fetched_at = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class LipasClient:
+    """
+    Fetches LIPAS layers from the GeoServer WFS. Several layers are fetched concurrently over one session, large
+    layers are fetched in pages of `page_size` features (the pages after the first one concurrently, when the
+    server tells how many features match), and every page is cached. Cached pages younger than `max_age` seconds
+    are used without asking the server.
+    """
+
+    def __init__(self, url: str = LIPAS_WFS_URL, page_size: int = 1000, concurrency: int = 4,
+                 cache: WFSCache = None, max_age: float = 24 * 3600, total_timeout: float = 300):
+        self.url = url
+        self.page_size = page_size
+        self.cache = cache
+        self.max_age = max_age
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout)
+        self.concurrency = concurrency
+        self.requests = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def open(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def fetch_body(self, params: Dict[str, str]) -> bytes:
+        loop = asyncio.get_event_loop()
+        key = WFSCache.key(self.url, params)
+        cached = await loop.run_in_executor(None, self.cache.get, key) if self.cache is not None else None
+        if cached is not None and time.time() - cached.fetched_at < self.max_age:
+            return cached.body
+
+        headers = {}
+        if cached is not None and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+        status, body, response_headers = await self._get(params, headers)
+        if status == HTTP_304_NOT_MODIFIED and cached is not None:
+            await loop.run_in_executor(None, self.cache.touch, key)
+            return cached.body
+        if self.cache is not None:
+            await loop.run_in_executor(None, self.cache.put, key, body, response_headers.get("ETag"),
+                                       response_headers.get("Last-Modified"))
+        return body
+
+    async def _get(self, params: Dict[str, str], headers: Dict[str, str]):
+        if self._session is None:
+            await self.open()
+        try:
+            async with self._semaphore:
+                self.requests += 1
+                async with self._session.get(self.url, params=params, headers=headers) as response:
+                    body = await response.read()
+                    if response.status not in (HTTP_200_OK, HTTP_304_NOT_MODIFIED):
+                        raise HTTPException(status_code=response.status,
+                                            detail=body.decode("utf-8", errors="replace"))
+                    return response.status, body, response.headers
+        except aiohttp.ClientError as e:
+            raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                                detail="LIPAS WFS server not reached") from e
+        except asyncio.TimeoutError as e:
+            raise HTTPException(status_code=HTTP_408_REQUEST_TIMEOUT,
+                                detail="LIPAS WFS did not answer within the timeout") from e
+
+    async def fetch_page(self, type_name: str, start_index: int = 0, bbox=None, cql_filter: str = None) -> dict:
+        body = await self.fetch_body(getfeature_params(type_name, bbox=bbox, cql_filter=cql_filter,
+                                                       count=self.page_size, start_index=start_index))
+        try:
+            return rapidjson.loads(body)
+        except ValueError as e:
+            # GeoServer answers exceptions as XML with a 200 status
+            raise HTTPException(status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+                                detail="LIPAS WFS answered with an invalid JSON body: {body}".format(
+                                    body=body[:500].decode("utf-8", errors="replace"))) from e
+
+    async def fetch_features(self, type_name: str, bbox=None, cql_filter: str = None) -> dict:
+        """
+        Returns all the features of a layer matching the bbox or the CQL filter, as one FeatureCollection.
+        """
+        first = await self.fetch_page(type_name, bbox=bbox, cql_filter=cql_filter)
+        features = first.get("features", [])
+        matched = first.get("numberMatched", first.get("totalFeatures"))
+        if len(features) < self.page_size:
+            return {"type": "FeatureCollection", "features": features}
+        if isinstance(matched, int):
+            pages = await asyncio.gather(*[self.fetch_page(type_name, start, bbox=bbox, cql_filter=cql_filter)
+                                           for start in range(self.page_size, matched, self.page_size)])
+            for page in pages:
+                features.extend(page.get("features", []))
+        else:
+            start = self.page_size
+            while True:
+                page = await self.fetch_page(type_name, start, bbox=bbox, cql_filter=cql_filter)
+                features.extend(page.get("features", []))
+                if len(page.get("features", [])) < self.page_size:
+                    break
+                start += self.page_size
+        return {"type": "FeatureCollection", "features": features}
+
+    async def fetch_layers(self, layers: Iterable[LipasLayer], bbox=None,
+                           cql_filter: str = None) -> Dict[LipasLayer, dict]:
+        layers = list(layers)
+        collections = await asyncio.gather(*[self.fetch_features(layer.type_name, bbox=bbox, cql_filter=cql_filter)
+                                             for layer in layers])
+        return dict(zip(layers, collections))
+
+
+async def fetch_lipas_layers(layers: Iterable[LipasLayer], bbox=None, cql_filter: str = None,
+                             cache_dir: Optional[str] = DEFAULT_CACHE_DIR, **client_options) -> Dict[LipasLayer, dict]:
+    cache = WFSCache(cache_dir) if cache_dir is not None else None
+    try:
+        async with LipasClient(cache=cache, **client_options) as client:
+            return await client.fetch_layers(layers, bbox=bbox, cql_filter=cql_filter)
+    finally:
+        if cache is not None:
+            cache.close()
+
+
+def run_blocking(coroutine):
+    """
+    Runs a coroutine to completion from synchronous code, also from a notebook whose event loop is running.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Set, Tuple
+
+from src.mapple_api import convertEnumToValue
+from src.scheduler import ReachabilityJob
+
+JobKey = Tuple[str, str, int, int, float, float, str, str]
+
+
+def job_key(job: ReachabilityJob) -> JobKey:
+    return (str(job.origin_id), convertEnumToValue(job.travel_mode), int(job.radius), int(job.maxTimeThreshold),
+            float(convertEnumToValue(job.walking_speed_kmph)), float(convertEnumToValue(job.cycling_speed_kmph)),
+            convertEnumToValue(job.timeOfDay), convertEnumToValue(job.timeProfile))
+
+
+def manifest_path(output_folder: str, prefix: str) -> str:
+    return os.path.join(output_folder, "{prefix}_manifest.sqlite".format(prefix=prefix))
+
+
+class RunManifest:
+    """
+    SQLite record of the jobs whose results have been written. Every job is keyed by its origin, travel mode and
+    request parameters, so a resumed run can skip exactly the requests that are already in the output files.
+    The coordinates of every origin are recorded too, so that a refresh can tell the facilities that moved.
+    The writer thread records the jobs once their layers are flushed, hence the lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS completed_jobs (
+                origin_id TEXT NOT NULL,
+                travel_mode TEXT NOT NULL,
+                radius INTEGER NOT NULL,
+                max_time_threshold INTEGER NOT NULL,
+                walking_speed_kmph REAL NOT NULL,
+                cycling_speed_kmph REAL NOT NULL,
+                time_of_day TEXT NOT NULL,
+                time_profile TEXT NOT NULL,
+                completed_at REAL NOT NULL,
+                PRIMARY KEY (origin_id, travel_mode, radius, max_time_threshold, walking_speed_kmph,
+                             cycling_speed_kmph, time_of_day, time_profile)
+            )""")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS origins (
+                origin_id TEXT PRIMARY KEY,
+                longitude REAL NOT NULL,
+                latitude REAL NOT NULL
+            )""")
+        self._connection.commit()
+
+    def completed_keys(self) -> Set[JobKey]:
+        with self._lock:
+            return set(self._connection.execute("""
+                SELECT origin_id, travel_mode, radius, max_time_threshold, walking_speed_kmph, cycling_speed_kmph,
+                       time_of_day, time_profile
+                FROM completed_jobs"""))
+
+    def mark_completed(self, job: ReachabilityJob):
+        self.mark_completed_many([job])
+
+    def mark_completed_many(self, jobs: Iterable[ReachabilityJob]):
+        now = time.time()
+        with self._lock:
+            self._connection.executemany("INSERT OR REPLACE INTO completed_jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                         [job_key(job) + (now,) for job in jobs])
+            self._connection.executemany("INSERT OR REPLACE INTO origins VALUES (?, ?, ?)",
+                                         [(str(job.origin_id), job.longitude, job.latitude) for job in jobs])
+            self._connection.commit()
+
+    def origins(self) -> Dict[str, Tuple[float, float]]:
+        """
+        The (longitude, latitude) of every origin with a completed job. Runs written before the coordinates were
+        recorded have origins in completed_jobs only.
+        """
+        with self._lock:
+            return {origin_id: (longitude, latitude) for origin_id, longitude, latitude in
+                    self._connection.execute("SELECT origin_id, longitude, latitude FROM origins")}
+
+    def remove_origins(self, origin_ids: Iterable[str]):
+        origin_ids = [(str(origin_id),) for origin_id in origin_ids]
+        with self._lock:
+            self._connection.executemany("DELETE FROM completed_jobs WHERE origin_id = ?", origin_ids)
+            self._connection.executemany("DELETE FROM origins WHERE origin_id = ?", origin_ids)
+            self._connection.commit()
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM completed_jobs")
+            self._connection.execute("DELETE FROM origins")
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,38 +1,191 @@
+import asyncio
+import contextlib
+import time
 from enum import Enum
-from typing import Dict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 
 import aiohttp
 import rapidjson
 from starlette.exceptions import HTTPException
-from starlette.status import HTTP_200_OK, HTTP_500_INTERNAL_SERVER_ERROR
+from starlette.status import HTTP_200_OK, HTTP_408_REQUEST_TIMEOUT, HTTP_429_TOO_MANY_REQUESTS, \
+    HTTP_500_INTERNAL_SERVER_ERROR
 
-from src.config import TimeOfDay, TimeProfile, WalkingSpeeds, CyclingSpeeds, MappleAPIConfig
+from src.config import TimeOfDay, TimeProfile, WalkingSpeeds, CyclingSpeeds, MappleAPIConfig, TravelModes
+from src.decoding import DECODE_MODES, ReachabilityArrays, decode_compact, decode_compact_stream
+from src.metrics import RunMetrics
+from src.rate_limiter import RateLimiter, parse_retry_after
+from src.response_cache import ResponseCache
+from src.retry import RetryPolicy
+from src.scheduler import ReachabilityJob
+
+REACHABILITY_PATH = "{baseUrl}/fi/reachability/travelTime/{travel_mode}/1"
+
+
+def travel_mode_of(url: str) -> str:
+    """
+    The travel mode of a REACHABILITY_PATH url.
+    """
+    return url.rstrip("/").rsplit("/", 2)[-2]
+
+
+class MappleAPIException(HTTPException):
+    def __init__(self, status_code: int, detail: str = None, retry_after: float = None):
+        super().__init__(status_code=status_code, detail=detail)
+        self.retry_after = retry_after
+        self.attempts = 1
 
 
 def convertEnumToValue(enum_param):
     return enum_param.value if isinstance(enum_param, Enum) else enum_param
 
 
-async def fetch(url, params: Dict[str, str], headers: Dict[str, str]):
+def api_key_headers(api_key: Optional[str] = None) -> Dict[str, str]:
+    return {
+        "ApiKey": "{token}".format(
+            token=api_key if api_key is not None else MappleAPIConfig.getMappleAPIKey()
+        )
+    }
+
+
+async def fetch(url, params: Dict[str, str], headers: Dict[str, str], session: aiohttp.ClientSession = None):
+    return decode(await fetch_body(url, params, headers, session=session))
+
+
+async def fetch_body(url, params: Dict[str, str], headers: Dict[str, str],
+                     session: aiohttp.ClientSession = None, read: Callable[[aiohttp.ClientResponse], Awaitable] = None):
+    """
+    Returns the body of a successful answer as bytes, or whatever `read` returns for the response. Connection
+    errors are reported as 500 (retried); a request that exceeds the session's total timeout as 408, which is not
+    retried, so that a slow request is not sent again with the same timeout. Any other error, e.g. in `read`,
+    propagates unchanged.
+    """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params, headers=headers) as response:
-                response_dict = await response.json(loads=rapidjson.loads)
-                if HTTP_200_OK.__eq__(response.status):
-                    return response_dict
-                else:
-                    detail = response_dict["detail"] if "detail" in response_dict else await response.text()
-                    raise HTTPException(
-                        status_code=response.status,
-                        detail=detail
-                    )
-    except HTTPException as e:
-        raise
-    except Exception as e:
-        raise HTTPException(
+        if session is None:
+            async with aiohttp.ClientSession() as own_session:
+                return await _get(own_session, url, params, headers, read)
+        return await _get(session, url, params, headers, read)
+    except aiohttp.ClientError as e:
+        raise MappleAPIException(
             status_code=HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Mapple API server not reached"
         ) from e
+    except asyncio.TimeoutError as e:
+        raise MappleAPIException(
+            status_code=HTTP_408_REQUEST_TIMEOUT,
+            detail="Mapple API did not answer within the timeout"
+        ) from e
+
+
+def decode(body: bytes, loads: Callable = rapidjson.loads):
+    try:
+        return loads(body)
+    except ValueError as e:
+        raise MappleAPIException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Mapple API answered with an invalid JSON body"
+        ) from e
+
+
+async def read_compact(response: aiohttp.ClientResponse, keep_body: bool = False):
+    try:
+        return await decode_compact_stream(response.content, keep_body=keep_body)
+    except ValueError as e:
+        raise MappleAPIException(
+            status_code=HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Mapple API answered with an invalid JSON body"
+        ) from e
+
+
+async def _get(session: aiohttp.ClientSession, url, params: Dict[str, str], headers: Dict[str, str],
+               read: Callable[[aiohttp.ClientResponse], Awaitable] = None):
+    async with session.get(url, params=params, headers=headers) as response:
+        if HTTP_200_OK.__eq__(response.status):
+            return await response.read() if read is None else await read(response)
+        else:
+            text = await response.text()
+            try:
+                response_dict = rapidjson.loads(text)
+            except ValueError:
+                response_dict = None
+            detail = response_dict["detail"] if isinstance(response_dict, dict) and "detail" in response_dict \
+                else text
+            raise MappleAPIException(
+                status_code=response.status,
+                detail=detail,
+                retry_after=parse_retry_after(response.headers.get("Retry-After"))
+            )
+
+
+def walking_reachability_request(base_url: str, latitude: float, longitude: float, radius: int = 20000,
+                                 walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                 maxTimeThreshold: int = 30) -> Tuple[str, Dict[str, str]]:
+    url = REACHABILITY_PATH.format(baseUrl=base_url, travel_mode=TravelModes.WALKING.value)
+    params = {
+        "latitude": str(latitude),
+        "longitude": str(longitude),
+        "radius": str(radius),
+        "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
+        "maxTimeThreshold": str(maxTimeThreshold)
+    }
+    return url, params
+
+
+def cycling_reachability_request(base_url: str, latitude: float, longitude: float, radius: int = 20000,
+                                 walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                 cycling_speed_kmph: float = CyclingSpeeds.AVERAGE_CYCLING,
+                                 maxTimeThreshold: int = 30) -> Tuple[str, Dict[str, str]]:
+    url = REACHABILITY_PATH.format(baseUrl=base_url, travel_mode=TravelModes.CYCLING.value)
+    params = {
+        "latitude": str(latitude),
+        "longitude": str(longitude),
+        "radius": str(radius),
+        "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
+        "cyclingSpeedKmph": str(convertEnumToValue(cycling_speed_kmph)),
+        "maxTimeThreshold": str(maxTimeThreshold)
+    }
+    return url, params
+
+
+def transit_reachability_request(base_url: str, latitude: float, longitude: float, radius: int = 20000,
+                                 walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                 timeOfDay: TimeOfDay = TimeOfDay.RUSH_HOUR,
+                                 timeProfile: TimeProfile = TimeProfile.FASTEST,
+                                 maxTimeThreshold: int = 30) -> Tuple[str, Dict[str, str]]:
+    url = REACHABILITY_PATH.format(baseUrl=base_url, travel_mode=TravelModes.TRANSIT.value)
+    params = {
+        "latitude": str(latitude),
+        "longitude": str(longitude),
+        "radius": str(radius),
+        "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
+
+        "timeOfDay": convertEnumToValue(timeOfDay),
+        "targetType": "origin",
+        "timeProfile": convertEnumToValue(timeProfile),
+
+        "maxTimeThreshold": str(maxTimeThreshold)
+    }
+    return url, params
+
+
+def driving_reachability_request(base_url: str, latitude: float, longitude: float, radius: int = 20000,
+                                 walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                 timeOfDay: TimeOfDay = TimeOfDay.RUSH_HOUR,
+                                 timeProfile: TimeProfile = TimeProfile.FASTEST,
+                                 maxTimeThreshold: int = 30) -> Tuple[str, Dict[str, str]]:
+    url = REACHABILITY_PATH.format(baseUrl=base_url, travel_mode=TravelModes.DRIVING.value)
+    params = {
+        "latitude": str(latitude),
+        "longitude": str(longitude),
+        "radius": str(radius),
+        "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
+
+        "timeOfDay": convertEnumToValue(timeOfDay),
+        "targetType": "origin",
+        "timeProfile": convertEnumToValue(timeProfile),
+
+        "maxTimeThreshold": str(maxTimeThreshold)
+    }
+    return url, params
 
 
 async def fetch_walking_reachability(base_url: str, latitude: float,
@@ -40,21 +193,10 @@ async def fetch_walking_reachability(base_url: str, latitude: float,
                                      radius: int = 20000,
                                      walking_speed_kmph: float = WalkingSpeeds.AVERAGE, maxTimeThreshold: int = 30):
     try:
-        url = "{baseUrl}/fi/reachability/travelTime/walking/1".format(baseUrl=base_url)
-        params = {
-            "latitude": str(latitude),
-            "longitude": str(longitude),
-            "radius": str(radius),
-            "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
-            "maxTimeThreshold": str(maxTimeThreshold)
-        }
-        headers = {
-            "ApiKey": "{token}".format(
-                token=MappleAPIConfig.getMappleAPIKey()
-            )
-        }
-
-        return await fetch(url=url, params=params, headers=headers)
+        url, params = walking_reachability_request(base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await fetch(url=url, params=params, headers=api_key_headers())
     except Exception as e:
         raise e
 
@@ -66,22 +208,11 @@ async def fetch_cycling_reachability(base_url: str, latitude: float,
                                      cycling_speed_kmph: float = CyclingSpeeds.AVERAGE_CYCLING,
                                      maxTimeThreshold: int = 30):
     try:
-        url = "{baseUrl}/fi/reachability/travelTime/cycling/1".format(baseUrl=base_url)
-        params = {
-            "latitude": str(latitude),
-            "longitude": str(longitude),
-            "radius": str(radius),
-            "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
-            "cyclingSpeedKmph": str(convertEnumToValue(cycling_speed_kmph)),
-            "maxTimeThreshold": str(maxTimeThreshold)
-        }
-        headers = {
-            "ApiKey": "{token}".format(
-                token=MappleAPIConfig.getMappleAPIKey()
-            )
-        }
-
-        return await fetch(url=url, params=params, headers=headers)
+        url, params = cycling_reachability_request(base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   cycling_speed_kmph=cycling_speed_kmph,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await fetch(url=url, params=params, headers=api_key_headers())
     except Exception as e:
         raise e
 
@@ -94,26 +225,11 @@ async def fetch_transit_reachability(base_url: str, latitude: float,
                                      timeProfile: TimeProfile = TimeProfile.FASTEST,
                                      maxTimeThreshold: int = 30):
     try:
-        url = "{baseUrl}/fi/reachability/travelTime/transit/1".format(baseUrl=base_url)
-        params = {
-            "latitude": str(latitude),
-            "longitude": str(longitude),
-            "radius": str(radius),
-            "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
-
-            "timeOfDay": convertEnumToValue(timeOfDay),
-            "targetType": "origin",
-            "timeProfile": convertEnumToValue(timeProfile),
-
-            "maxTimeThreshold": str(maxTimeThreshold)
-        }
-        headers = {
-            "ApiKey": "{token}".format(
-                token=MappleAPIConfig.getMappleAPIKey()
-            )
-        }
-
-        return await fetch(url=url, params=params, headers=headers)
+        url, params = transit_reachability_request(base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   timeOfDay=timeOfDay, timeProfile=timeProfile,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await fetch(url=url, params=params, headers=api_key_headers())
     except Exception as e:
         raise e
 
@@ -126,25 +242,233 @@ async def fetch_driving_reachability(base_url: str, latitude: float,
                                      timeProfile: TimeProfile = TimeProfile.FASTEST,
                                      maxTimeThreshold: int = 30):
     try:
-        url = "{baseUrl}/fi/reachability/travelTime/driving/1".format(baseUrl=base_url)
-        params = {
-            "latitude": str(latitude),
-            "longitude": str(longitude),
-            "radius": str(radius),
-            "walkingSpeedKmph": str(convertEnumToValue(walking_speed_kmph)),
-
-            "timeOfDay": convertEnumToValue(timeOfDay),
-            "targetType": "origin",
-            "timeProfile": convertEnumToValue(timeProfile),
-
-            "maxTimeThreshold": str(maxTimeThreshold)
-        }
-        headers = {
-            "ApiKey": "{token}".format(
-                token=MappleAPIConfig.getMappleAPIKey()
-            )
-        }
-
-        return await fetch(url=url, params=params, headers=headers)
+        url, params = driving_reachability_request(base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   timeOfDay=timeOfDay, timeProfile=timeProfile,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await fetch(url=url, params=params, headers=api_key_headers())
     except Exception as e:
         raise e
+
+
+class MappleClient:
+    """
+    Long-lived Mapple API client. All the requests share one keep-alive connection pool, so the TCP/TLS
+    handshake and the DNS lookup are paid once per connection instead of once per request.
+    Use it as an async context manager, or call open() and close() explicitly.
+    When a rate limiter is given, every request waits for a token first and 'Too Many Requests' answers slow the
+    limiter down. Failed requests are re-sent according to the retry policy; once it gives up, the last
+    MappleAPIException is raised with its `attempts` set. With a response cache, cached bodies are returned without
+    going through the rate limiter, and fresh bodies are stored.
+    `decode` sets what the fetch_*_reachability methods return: 'dict' (the decoded FeatureCollection), 'compact'
+    (ReachabilityArrays, decoded while the body streams in) or 'raw' (the body bytes, not decoded at all).
+    With `metrics`, every attempt records its status, latency and payload size per travel mode, along with the
+    retries, the time spent waiting for the rate limiter and in backoff, the cache hits and the decoding time
+    ('compact' answers are decoded while they are received, so their decoding time is part of the latency).
+    """
+
+    def __init__(self, base_url: str = "http://localhost:8080", api_key: str = None,
+                 limit: int = 100, limit_per_host: int = 10, ttl_dns_cache: int = 300,
+                 keepalive_timeout: float = 30, connect_timeout: float = 30, total_timeout: float = 300,
+                 rate_limiter: RateLimiter = None, retry_policy: RetryPolicy = None, cache: ResponseCache = None,
+                 decode: str = "dict", metrics: RunMetrics = None):
+        if decode not in DECODE_MODES:
+            raise ValueError("Unknown decode mode '{decode}'".format(decode=decode))
+        self.base_url = base_url.rstrip("/")
+        self.decode = decode
+        self.cache = cache
+        self.metrics = metrics
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.headers = api_key_headers(api_key)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def open(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             ttl_dns_cache=self.ttl_dns_cache,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def fetch_decoded(self, url: str, params: Dict[str, str]):
+        if self.decode == "raw":
+            return await self.fetch_body(url, params)
+        if self.decode == "compact":
+            return await self.fetch_compact(url, params)
+        return await self.fetch(url, params)
+
+    async def fetch(self, url: str, params: Dict[str, str]):
+        body = await self.fetch_body(url, params)
+        with self._timed("decode_seconds", url):
+            return decode(body)
+
+    def _timed(self, name: str, url: str):
+        if self.metrics is None:
+            return contextlib.nullcontext()
+        return self.metrics.timed(name, travel_mode=travel_mode_of(url))
+
+    def _cache_hit(self, url: str):
+        if self.metrics is not None:
+            self.metrics.increment("cache_hits_total", travel_mode=travel_mode_of(url))
+
+    async def fetch_body(self, url: str, params: Dict[str, str]) -> bytes:
+        if self.cache is None:
+            return await self._request(url, params)
+
+        loop = asyncio.get_event_loop()
+        key = self.cache.key(url, params)
+        body = await loop.run_in_executor(None, self.cache.get, key)
+        if body is None:
+            body = await self._request(url, params)
+            await loop.run_in_executor(None, self.cache.put, key, body)
+        else:
+            self._cache_hit(url)
+        return body
+
+    async def fetch_compact(self, url: str, params: Dict[str, str]) -> ReachabilityArrays:
+        loop = asyncio.get_event_loop()
+        if self.cache is None:
+            arrays, _ = await self._request(url, params, read=read_compact)
+            return arrays
+
+        key = self.cache.key(url, params)
+        body = await loop.run_in_executor(None, self.cache.get, key)
+        if body is not None:
+            self._cache_hit(url)
+            with self._timed("decode_seconds", url):
+                return await loop.run_in_executor(None, decode, body, decode_compact)
+        arrays, body = await self._request(url, params, read=lambda response: read_compact(response, keep_body=True))
+        await loop.run_in_executor(None, self.cache.put, key, body)
+        return arrays
+
+    async def _request(self, url: str, params: Dict[str, str],
+                       read: Callable[[aiohttp.ClientResponse], Awaitable] = None):
+        if self._session is None:
+            await self.open()
+
+        metrics = self.metrics
+        travel_mode = travel_mode_of(url) if metrics is not None else None
+        if metrics is not None:
+            read = self._measured_read(read, travel_mode)
+
+        attempt = 1
+        while True:
+            if self.rate_limiter is not None:
+                with self._timed("rate_limit_wait_seconds", url):
+                    await self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                result = await fetch_body(url=url, params=params, headers=self.headers, session=self._session,
+                                          read=read)
+            except MappleAPIException as e:
+                e.attempts = attempt
+                if metrics is not None:
+                    metrics.observe("request_seconds", time.perf_counter() - started, travel_mode=travel_mode)
+                    metrics.increment("requests_total", travel_mode=travel_mode, status=e.status_code)
+                if not self.retry_policy.should_retry(e, attempt):
+                    raise
+                if metrics is not None:
+                    metrics.increment("retries_total", travel_mode=travel_mode, status=e.status_code)
+                if e.status_code == HTTP_429_TOO_MANY_REQUESTS and self.rate_limiter is not None:
+                    # the limiter holds every request back for the 'Retry-After' time, not only this one
+                    self.rate_limiter.penalize(e.retry_after)
+                else:
+                    delay = self.retry_policy.delay(attempt, e.retry_after)
+                    if metrics is not None:
+                        metrics.increment("backoff_seconds_total", delay, travel_mode=travel_mode)
+                    await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            if metrics is not None:
+                metrics.observe("request_seconds", time.perf_counter() - started, travel_mode=travel_mode)
+                metrics.increment("requests_total", travel_mode=travel_mode, status=HTTP_200_OK)
+            if self.rate_limiter is not None:
+                self.rate_limiter.reward()
+            return result
+
+    def _measured_read(self, read: Optional[Callable[[aiohttp.ClientResponse], Awaitable]], travel_mode: str):
+        async def measured(response: aiohttp.ClientResponse):
+            try:
+                return await response.read() if read is None else await read(response)
+            finally:
+                self.metrics.observe("payload_bytes", response.content.total_bytes, travel_mode=travel_mode)
+
+        return measured
+
+    async def fetch_walking_reachability(self, latitude: float, longitude: float, radius: int = 20000,
+                                         walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                         maxTimeThreshold: int = 30):
+        url, params = walking_reachability_request(self.base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await self.fetch_decoded(url, params)
+
+    async def fetch_cycling_reachability(self, latitude: float, longitude: float, radius: int = 20000,
+                                         walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                         cycling_speed_kmph: float = CyclingSpeeds.AVERAGE_CYCLING,
+                                         maxTimeThreshold: int = 30):
+        url, params = cycling_reachability_request(self.base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   cycling_speed_kmph=cycling_speed_kmph,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await self.fetch_decoded(url, params)
+
+    async def fetch_transit_reachability(self, latitude: float, longitude: float, radius: int = 20000,
+                                         walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                         timeOfDay: TimeOfDay = TimeOfDay.RUSH_HOUR,
+                                         timeProfile: TimeProfile = TimeProfile.FASTEST,
+                                         maxTimeThreshold: int = 30):
+        url, params = transit_reachability_request(self.base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   timeOfDay=timeOfDay, timeProfile=timeProfile,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await self.fetch_decoded(url, params)
+
+    async def fetch_driving_reachability(self, latitude: float, longitude: float, radius: int = 20000,
+                                         walking_speed_kmph: float = WalkingSpeeds.AVERAGE,
+                                         timeOfDay: TimeOfDay = TimeOfDay.RUSH_HOUR,
+                                         timeProfile: TimeProfile = TimeProfile.FASTEST,
+                                         maxTimeThreshold: int = 30):
+        url, params = driving_reachability_request(self.base_url, latitude, longitude, radius=radius,
+                                                   walking_speed_kmph=walking_speed_kmph,
+                                                   timeOfDay=timeOfDay, timeProfile=timeProfile,
+                                                   maxTimeThreshold=maxTimeThreshold)
+        return await self.fetch_decoded(url, params)
+
+    async def fetch_reachability(self, job: ReachabilityJob):
+        travel_mode = TravelModes(job.travel_mode)
+        if travel_mode == TravelModes.WALKING:
+            return await self.fetch_walking_reachability(
+                latitude=job.latitude, longitude=job.longitude, radius=job.radius,
+                walking_speed_kmph=job.walking_speed_kmph, maxTimeThreshold=job.maxTimeThreshold)
+        if travel_mode == TravelModes.CYCLING:
+            return await self.fetch_cycling_reachability(
+                latitude=job.latitude, longitude=job.longitude, radius=job.radius,
+                walking_speed_kmph=job.walking_speed_kmph, cycling_speed_kmph=job.cycling_speed_kmph,
+                maxTimeThreshold=job.maxTimeThreshold)
+        if travel_mode == TravelModes.TRANSIT:
+            return await self.fetch_transit_reachability(
+                latitude=job.latitude, longitude=job.longitude, radius=job.radius,
+                walking_speed_kmph=job.walking_speed_kmph, timeOfDay=job.timeOfDay, timeProfile=job.timeProfile,
+                maxTimeThreshold=job.maxTimeThreshold)
+        return await self.fetch_driving_reachability(
+            latitude=job.latitude, longitude=job.longitude, radius=job.radius,
+            walking_speed_kmph=job.walking_speed_kmph, timeOfDay=job.timeOfDay, timeProfile=job.timeProfile,
+            maxTimeThreshold=job.maxTimeThreshold)
@@ -0,0 +1,327 @@
+import contextlib
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+# upper bounds of the histogram buckets, Prometheus style (a value equal to a bound falls in its bucket)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BYTES_BUCKETS = tuple(1024 * 4 ** power for power in range(10))
+PROMETHEUS_PREFIX = "mapple_fetch_"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((name, str(getattr(value, "value", value))) for name, value in labels.items()))
+
+
+def metrics_path(output_folder: str, prefix: str) -> str:
+    return os.path.join(output_folder, "{prefix}_metrics.json".format(prefix=prefix))
+
+
+class Histogram:
+    """
+    Counts of the observed values per bucket, plus their sum, so that histograms of several runs or shards can be
+    added up. Quantiles are interpolated inside the bucket they fall in.
+    """
+
+    def __init__(self, buckets: Sequence[float] = SECONDS_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram"):
+        if other.buckets != self.buckets:
+            raise ValueError("Histograms with different buckets cannot be merged")
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, share: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = share * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.count if self.count else None
+
+
+class Gauge:
+    """
+    A sampled level (requests in flight, queued layers): the last sample, the highest one and their mean.
+    """
+
+    def __init__(self):
+        self.last = 0.0
+        self.max = 0.0
+        self.sum = 0.0
+        self.samples = 0
+
+    def sample(self, value: float):
+        self.last = value
+        self.max = max(self.max, value)
+        self.sum += value
+        self.samples += 1
+
+    def merge(self, other: "Gauge"):
+        # the gauges of shards running side by side add up
+        self.last += other.last
+        self.max += other.max
+        self.sum += other.sum
+        self.samples = max(self.samples, other.samples)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.sum / self.samples if self.samples else None
+
+
+class RunMetrics:
+    """
+    Counters, histograms and gauges of a fetch run, labelled (e.g. by travel mode or status). They are updated from
+    the event loop and from the writer thread, and written at the end of the run as JSON or in the Prometheus text
+    format. Histograms named '*_bytes' use byte buckets, the others second buckets.
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.elapsed = None
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.gauges: Dict[Tuple[str, Labels], Gauge] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(BYTES_BUCKETS if name.endswith("_bytes")
+                                                             else SECONDS_BUCKETS)
+            histogram.observe(value)
+
+    def sample(self, name: str, value: float, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            gauge = self.gauges.get(key)
+            if gauge is None:
+                gauge = self.gauges[key] = Gauge()
+            gauge.sample(value)
+
+    @contextlib.contextmanager
+    def timed(self, name: str, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def counter(self, name: str, **labels) -> float:
+        """
+        The value of a counter, summed over the labels that are not given.
+        """
+        wanted = set(_labels(labels))
+        return sum(value for (counter_name, counter_labels), value in self.counters.items()
+                   if counter_name == name and wanted <= set(counter_labels))
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        """
+        A histogram summed over the labels that are not given (empty when nothing was observed).
+        """
+        wanted = set(_labels(labels))
+        merged = Histogram(BYTES_BUCKETS if name.endswith("_bytes") else SECONDS_BUCKETS)
+        for (histogram_name, histogram_labels), histogram in self.histograms.items():
+            if histogram_name == name and wanted <= set(histogram_labels):
+                merged.merge(histogram)
+        return merged
+
+    def label_values(self, label: str) -> List[str]:
+        keys = list(self.counters) + list(self.histograms) + list(self.gauges)
+        return sorted({value for _, labels in keys for name, value in labels if name == label})
+
+    def finish(self):
+        self.elapsed = time.time() - self.started_at
+
+    def merge(self, other: "RunMetrics"):
+        with self._lock:
+            for key, value in other.counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in other.histograms.items():
+                self.histograms.setdefault(key, Histogram(histogram.buckets)).merge(histogram)
+            for key, gauge in other.gauges.items():
+                self.gauges.setdefault(key, Gauge()).merge(gauge)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "started_at": self.started_at,
+                "elapsed_s": self.elapsed,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels), "buckets": list(histogram.buckets),
+                                "counts": histogram.counts, "count": histogram.count, "sum": histogram.sum,
+                                "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95),
+                                "p99": histogram.quantile(0.99)}
+                               for (name, labels), histogram in sorted(self.histograms.items())],
+                "gauges": [{"name": name, "labels": dict(labels), "last": gauge.last, "max": gauge.max,
+                            "mean": gauge.mean, "sum": gauge.sum, "samples": gauge.samples}
+                           for (name, labels), gauge in sorted(self.gauges.items())],
+            }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "RunMetrics":
+        metrics = cls()
+        metrics.started_at = values["started_at"]
+        metrics.elapsed = values.get("elapsed_s")
+        for counter in values["counters"]:
+            metrics.counters[(counter["name"], _labels(counter["labels"]))] = counter["value"]
+        for entry in values["histograms"]:
+            histogram = Histogram(entry["buckets"])
+            histogram.counts, histogram.count, histogram.sum = list(entry["counts"]), entry["count"], entry["sum"]
+            metrics.histograms[(entry["name"], _labels(entry["labels"]))] = histogram
+        for entry in values["gauges"]:
+            gauge = Gauge()
+            gauge.last, gauge.max, gauge.sum, gauge.samples = entry["last"], entry["max"], entry["sum"], \
+                entry["samples"]
+            metrics.gauges[(entry["name"], _labels(entry["labels"]))] = gauge
+        return metrics
+
+    def to_prometheus(self) -> str:
+        def format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+            labels = list(labels)
+            if not labels:
+                return ""
+            return "{" + ",".join('{name}="{value}"'.format(name=name, value=value.replace('"', '\\"'))
+                                  for name, value in labels) + "}"
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append("# TYPE {prefix}{name} counter".format(prefix=PROMETHEUS_PREFIX, name=name))
+                for (counter_name, labels), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append("{prefix}{name}{labels} {value}".format(
+                            prefix=PROMETHEUS_PREFIX, name=name, labels=format_labels(labels), value=value))
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append("# TYPE {prefix}{name} histogram".format(prefix=PROMETHEUS_PREFIX, name=name))
+                for (histogram_name, labels), histogram in sorted(self.histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                        cumulative += count
+                        lines.append("{prefix}{name}_bucket{labels} {count}".format(
+                            prefix=PROMETHEUS_PREFIX, name=name, count=cumulative,
+                            labels=format_labels(list(labels) + [("le", str(bound))])))
+                    lines.append("{prefix}{name}_sum{labels} {value}".format(
+                        prefix=PROMETHEUS_PREFIX, name=name, labels=format_labels(labels), value=histogram.sum))
+                    lines.append("{prefix}{name}_count{labels} {value}".format(
+                        prefix=PROMETHEUS_PREFIX, name=name, labels=format_labels(labels), value=histogram.count))
+            for name in sorted({name for name, _ in self.gauges}):
+                for suffix in ("", "_max"):
+                    lines.append("# TYPE {prefix}{name}{suffix} gauge".format(prefix=PROMETHEUS_PREFIX, name=name,
+                                                                             suffix=suffix))
+                    for (gauge_name, labels), gauge in sorted(self.gauges.items()):
+                        if gauge_name == name:
+                            lines.append("{prefix}{name}{suffix}{labels} {value}".format(
+                                prefix=PROMETHEUS_PREFIX, name=name, suffix=suffix, labels=format_labels(labels),
+                                value=gauge.max if suffix else gauge.last))
+        if self.elapsed is not None:
+            lines.append("# TYPE {prefix}elapsed_seconds gauge".format(prefix=PROMETHEUS_PREFIX))
+            lines.append("{prefix}elapsed_seconds {value}".format(prefix=PROMETHEUS_PREFIX, value=self.elapsed))
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """
+        Writes the metrics in the Prometheus text format when the path ends with '.prom' or '.txt', as JSON
+        otherwise.
+        """
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        content = self.to_prometheus() if path.endswith((".prom", ".txt")) else \
+            json.dumps(self.to_dict(), indent=2)
+        temporary_path = "{path}.part".format(path=path)
+        with open(temporary_path, "w") as metrics_file:
+            metrics_file.write(content)
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "RunMetrics":
+        with open(path) as metrics_file:
+            return cls.from_dict(json.load(metrics_file))
+
+    def summary(self) -> str:
+        """
+        A few lines for the end of a run: requests and retries, the latency and payload of the answers per travel
+        mode, and where the rest of the time went.
+        """
+        def seconds(value: Optional[float]) -> str:
+            return "-" if value is None else "{value:.3f}".format(value=value)
+
+        lines = ["{requests:.0f} requests, {retries:.0f} retried, {throttled:.0f} 'Too Many Requests', "
+                 "{errors:.0f} other errors, {hits:.0f} cache hits".format(
+                     requests=self.counter("requests_total"), retries=self.counter("retries_total"),
+                     throttled=self.counter("requests_total", status=429),
+                     errors=sum(value for (name, labels), value in self.counters.items()
+                                if name == "requests_total" and dict(labels).get("status") not in ("200", "429")),
+                     hits=self.counter("cache_hits_total"))]
+        for travel_mode in self.label_values("travel_mode"):
+            latency = self.histogram("request_seconds", travel_mode=travel_mode)
+            payload = self.histogram("payload_bytes", travel_mode=travel_mode)
+            decoding = self.histogram("decode_seconds", travel_mode=travel_mode)
+            if not latency.count:
+                continue
+            lines.append("  {mode}: latency p50 {p50} s, p95 {p95} s, p99 {p99} s; payload {size:.0f} kB on average;"
+                         " decode {decode} s on average".format(
+                             mode=travel_mode, p50=seconds(latency.quantile(0.5)), p95=seconds(latency.quantile(0.95)),
+                             p99=seconds(latency.quantile(0.99)), size=(payload.mean or 0) / 1024,
+                             decode=seconds(decoding.mean)))
+        writing = self.histogram("write_seconds")
+        lines.append("Rate limiter wait {wait:.1f} s, retry backoff {backoff:.1f} s, writing {write:.1f} s "
+                     "({per_layer} s per layer)".format(
+                         wait=self.histogram("rate_limit_wait_seconds").sum,
+                         backoff=self.counter("backoff_seconds_total"), write=writing.sum,
+                         per_layer=seconds(writing.mean)))
+        levels = ["{name} max {value:.0f}".format(name=name.replace("_", " "), value=gauge.max)
+                  for (name, _), gauge in sorted(self.gauges.items())]
+        if levels:
+            lines.append(", ".join(levels))
+        return "\n".join(lines)
+
+
+def write_profile(profiler: cProfile.Profile, path: str, top: int = 20) -> str:
+    """
+    Dumps the profile to `path` (readable with pstats or snakeviz) and returns the `top` functions by cumulative
+    time.
+    """
+    profiler.dump_stats(path)
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+    return stream.getvalue()
@@ -0,0 +1,93 @@
+import sys
+import time
+from typing import Optional, TextIO
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    if hours:
+        return "{hours}:{minutes:02d}:{seconds:02d}".format(hours=hours, minutes=rest // 60, seconds=rest % 60)
+    return "{minutes:02d}:{seconds:02d}".format(minutes=rest // 60, seconds=rest % 60)
+
+
+class ProgressBar:
+    """
+    Progress of a run with an ETA from the average completion rate. On a terminal the bar is redrawn in place at
+    most every `interval` seconds; otherwise (logs, pipes) one line is printed every `log_interval` seconds.
+    """
+
+    def __init__(self, total: int, stream: TextIO = None, width: int = 30, interval: float = 0.5,
+                 log_interval: float = 10.0):
+        self.total = total
+        self.stream = stream if stream is not None else sys.stderr
+        self.width = width
+        self.interactive = hasattr(self.stream, "isatty") and self.stream.isatty()
+        self.interval = interval if self.interactive else log_interval
+        self.completed = 0
+        self.failed = 0
+        self.details = ""
+        self.closed = False
+        self._started = time.monotonic()
+        self._drawn_at = None
+
+    @property
+    def finished(self) -> int:
+        return self.completed + self.failed
+
+    def eta(self) -> Optional[float]:
+        elapsed = time.monotonic() - self._started
+        if not self.finished or not elapsed:
+            return None
+        return max(0, self.total - self.finished) * elapsed / self.finished
+
+    def format(self) -> str:
+        share = min(1.0, self.finished / self.total) if self.total else 1.0
+        filled = int(round(share * self.width))
+        elapsed = time.monotonic() - self._started
+        line = "[{bar}] {finished}/{total} {percent:3.0f}% {rate:.1f}/s elapsed {elapsed} ETA {eta}".format(
+            bar="#" * filled + "." * (self.width - filled), finished=self.finished, total=self.total,
+            percent=100 * share, rate=self.finished / elapsed if elapsed else 0.0, elapsed=format_duration(elapsed),
+            eta=format_duration(self.eta()))
+        if self.failed:
+            line += " failed {failed}".format(failed=self.failed)
+        if self.details:
+            line += " " + self.details
+        return line
+
+    def update(self, completed: int = None, failed: int = None, details: str = None, force: bool = False):
+        if completed is not None:
+            self.completed = completed
+        if failed is not None:
+            self.failed = failed
+        if details is not None:
+            self.details = details
+        now = time.monotonic()
+        if force or self._drawn_at is None or now - self._drawn_at >= self.interval:
+            self._draw()
+            self._drawn_at = now
+
+    def advance(self, failed: bool = False, details: str = None):
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+        self.update(details=details)
+
+    def _draw(self):
+        if self.interactive:
+            self.stream.write("\r\033[K" + self.format())
+        else:
+            self.stream.write(self.format() + "\n")
+        self.stream.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.update(force=True)
+        if self.interactive:
+            self.stream.write("\n")
+            self.stream.flush()
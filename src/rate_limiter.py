@@ -0,0 +1,74 @@
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Returns the number of seconds requested by a 'Retry-After' header, given either as seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Async token bucket. Up to `burst` requests can start at once, after which requests are released at `rate`
+    requests per second. When the API answers 'Too Many Requests', penalize() halves the current rate and blocks the
+    bucket for the 'Retry-After' time. Every successful request (reward()) raises the rate back up by
+    `recovery` * `rate` until the configured ceiling is reached again.
+    """
+
+    def __init__(self, rate: float = 2.0, burst: int = 10, min_rate: float = None, recovery: float = 0.05):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        if burst < 1:
+            raise ValueError("burst must be at least 1")
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate if min_rate is not None else rate / 32
+        self.recovery = recovery
+        self.current_rate = rate
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(float(self.burst), self._tokens + (now - self._updated_at) * self.current_rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.current_rate)
+
+    def penalize(self, retry_after: Optional[float] = None):
+        now = time.monotonic()
+        self._refill(now)
+        self.current_rate = max(self.min_rate, self.current_rate / 2)
+        self._tokens = 0.0
+        wait = retry_after if retry_after is not None else 1 / self.current_rate
+        self._blocked_until = max(self._blocked_until, now + wait)
+
+    def reward(self):
+        if self.current_rate < self.rate:
+            self._refill(time.monotonic())
+            self.current_rate = min(self.rate, self.current_rate + self.rate * self.recovery)
@@ -0,0 +1,330 @@
+import bisect
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import rapidjson
+
+from src.decoding import CELL_ATTRIBUTES, ReachabilityArrays, decode_compact
+from src.mapple_api import convertEnumToValue
+from src.scheduler import ReachabilityJob
+
+
+
+def _closer(travel_time: float, origin_id: Optional[str], current: Tuple[float, Optional[str]]) -> bool:
+    if travel_time != current[0]:
+        return travel_time < current[0]
+    return origin_id is not None and (current[1] is None or origin_id < current[1])
+
+
+def _rank(entry: Tuple[float, Optional[str]]) -> tuple:
+    # the order of _closer
+    return entry[0], entry[1] is None, entry[1] or ""
+
+
+class NearestFacilityReducer:
+    """
+    Keeps, for every grid cell, the shortest travel time over all the reachability layers added so far and the
+    origin it was reached from. Layers are added one at a time, so memory grows with the number of grid cells,
+    not with the number of origins. Ties go to the smallest origin id, so the result does not depend on the order
+    the layers arrive in.
+
+    With `k` > 1, the k shortest travel times of every cell are kept, so that origins can be removed again
+    (remove()) without reading the other layers: only the cells that lose all of them need refill().
+    """
+
+    def __init__(self, k: int = 1):
+        if k < 1:
+            raise ValueError("k must be at least 1")
+        self.k = k
+        self._best: Dict[int, Tuple[float, Optional[str]]] = {}
+        self._cells: Dict[int, Tuple] = {}
+        # with k > 1: the k shortest (travel_time, origin_id) of every cell, and the cells reached by more origins
+        self._top: Dict[int, List[Tuple[float, Optional[str]]]] = {}
+        self._truncated: Set[int] = set()
+        self.layers = 0
+
+    def __len__(self):
+        return len(self._best)
+
+    def add(self, reachability: dict, origin_id: str = None):
+        if origin_id is None:
+            origin_id = reachability.get("origin", {}).get("origin_id")
+        best = self._best
+        cells = self._cells
+        for feature in reachability["features"]:
+            cell_id = int(feature["id"])
+            properties = feature["properties"]
+            travel_time = properties["travel_time"]
+            if self.k > 1:
+                self._offer(cell_id, travel_time, origin_id)
+            else:
+                current = best.get(cell_id)
+                if current is None or _closer(travel_time, origin_id, current):
+                    best[cell_id] = (travel_time, origin_id)
+            if cell_id not in cells:
+                longitude, latitude = feature["geometry"]["coordinates"][:2]
+                cells[cell_id] = tuple(properties.get(name) for name in CELL_ATTRIBUTES) + (longitude, latitude)
+        self.layers += 1
+
+    def add_rows(self, origin_ids: Iterable[str], cell_ids: Iterable[int], travel_times: Iterable[float]):
+        if self.k > 1:
+            for origin_id, cell_id, travel_time in zip(origin_ids, cell_ids, travel_times):
+                self._offer(cell_id, travel_time, origin_id)
+            return
+        best = self._best
+        for origin_id, cell_id, travel_time in zip(origin_ids, cell_ids, travel_times):
+            current = best.get(cell_id)
+            if current is None or _closer(travel_time, origin_id, current):
+                best[cell_id] = (travel_time, origin_id)
+
+    def _offer(self, cell_id: int, travel_time: float, origin_id: Optional[str]):
+        entry = (travel_time, origin_id)
+        top = self._top.get(cell_id)
+        if top is None:
+            top = self._top[cell_id] = []
+        elif origin_id is not None:
+            for index, current in enumerate(top):
+                if current[1] == origin_id:
+                    if _rank(current) <= _rank(entry):
+                        return
+                    del top[index]
+                    break
+        top.insert(bisect.bisect([_rank(current) for current in top], _rank(entry)), entry)
+        if len(top) > self.k:
+            del top[self.k:]
+            self._truncated.add(cell_id)
+        self._best[cell_id] = top[0]
+
+    def add_cell(self, cell_id: int, attributes: Tuple, longitude: float, latitude: float):
+        self._cells.setdefault(cell_id, tuple(attributes) + (longitude, latitude))
+
+    def add_arrays(self, arrays: ReachabilityArrays, origin_id: str = None):
+        self.add_rows([origin_id] * len(arrays), arrays.cell_ids, arrays.travel_times)
+        cells = self._cells
+        for index, cell_id in enumerate(arrays.cell_ids):
+            if cell_id not in cells:
+                cells[cell_id] = arrays.cell_attributes(index) + (arrays.longitudes[index], arrays.latitudes[index])
+        self.layers += 1
+
+    def add_record(self, job: ReachabilityJob, reachability):
+        """
+        ReachabilityWriter hook: reduces the layers while the fetch is still running.
+        """
+        origin_id = str(job.origin_id) if job is not None else None
+        if isinstance(reachability, (bytes, bytearray)):
+            reachability = decode_compact(reachability)
+        if isinstance(reachability, ReachabilityArrays):
+            self.add_arrays(reachability, origin_id=origin_id)
+        else:
+            self.add(reachability, origin_id=origin_id)
+
+    def remove(self, origin_ids: Iterable[str]) -> Set[int]:
+        """
+        Forgets the travel times from `origin_ids`, e.g. facilities that were removed or moved. Returns the cells
+        whose nearest origin is no longer known: the ones that lost all their kept travel times while more origins
+        reached them (with k = 1, every cell whose nearest origin was removed). They are left out of the result
+        until refill() is called with the remaining layers.
+        """
+        removed = {str(origin_id) for origin_id in origin_ids}
+        exhausted = set()
+        for cell_id in list(self._best):
+            if self.k > 1:
+                top = self._top[cell_id]
+                kept = [entry for entry in top if entry[1] not in removed]
+                if len(kept) == len(top):
+                    continue
+                if kept:
+                    self._top[cell_id] = kept
+                    self._best[cell_id] = kept[0]
+                    continue
+                del self._top[cell_id]
+                if cell_id in self._truncated:
+                    exhausted.add(cell_id)
+                    self._truncated.discard(cell_id)
+            elif self._best[cell_id][1] not in removed:
+                continue
+            else:
+                exhausted.add(cell_id)
+            del self._best[cell_id]
+        return exhausted
+
+    def refill(self, cell_ids: Iterable[int], layers: Iterable[Tuple[Optional[str], dict]]):
+        """
+        Recomputes the cells returned by remove() from the (origin_id, layer) left, e.g.
+        iter_layers(layer_files(...)). The other cells are not changed.
+        """
+        cell_ids = set(cell_ids)
+        if not cell_ids:
+            return
+        for origin_id, layer in layers:
+            for feature in layer["features"]:
+                cell_id = int(feature["id"])
+                if cell_id not in cell_ids:
+                    continue
+                travel_time = feature["properties"]["travel_time"]
+                if self.k > 1:
+                    self._offer(cell_id, travel_time, origin_id)
+                else:
+                    current = self._best.get(cell_id)
+                    if current is None or _closer(travel_time, origin_id, current):
+                        self._best[cell_id] = (travel_time, origin_id)
+
+    def nearest(self) -> Iterator[Tuple[int, float, Optional[str]]]:
+        for cell_id, (travel_time, origin_id) in self._best.items():
+            yield cell_id, travel_time, origin_id
+
+    def to_feature_collection(self) -> dict:
+        features = []
+        for cell_id, travel_time, origin_id in self.nearest():
+            cell = self._cells[cell_id]
+            properties = dict(zip(CELL_ATTRIBUTES, cell))
+            properties["travel_time"] = travel_time
+            properties["origin_id"] = origin_id
+            features.append({
+                "id": str(cell_id),
+                "type": "Feature",
+                "properties": properties,
+                "geometry": {"type": "Point", "coordinates": [cell[-2], cell[-1]]}
+            })
+        return {"type": "FeatureCollection", "features": features}
+
+    def to_geodataframe(self):
+        import geopandas
+
+        cell_ids = list(self._best)
+        cells = [self._cells[cell_id] for cell_id in cell_ids]
+        columns = {"id": [str(cell_id) for cell_id in cell_ids]}
+        for index, name in enumerate(CELL_ATTRIBUTES):
+            columns[name] = [cell[index] for cell in cells]
+        columns["travel_time"] = [self._best[cell_id][0] for cell_id in cell_ids]
+        columns["origin_id"] = [self._best[cell_id][1] for cell_id in cell_ids]
+        return geopandas.GeoDataFrame(columns, geometry=geopandas.points_from_xy([cell[-2] for cell in cells],
+                                                                                 [cell[-1] for cell in cells]),
+                                      crs="EPSG:4326")
+
+    def write(self, path: str):
+        temporary_path = "{path}.part".format(path=path)
+        with open(temporary_path, "w") as target_file:
+            target_file.write(rapidjson.dumps(self.to_feature_collection()))
+        os.replace(temporary_path, path)
+
+    def write_state(self, path: str):
+        """
+        Saves the kept travel times and the cells, to update the result later with read_state().
+        """
+        state = {
+            "k": self.k,
+            "layers": self.layers,
+            "cells": [[cell_id, self._cells.get(cell_id), self._top.get(cell_id, [best]), cell_id in self._truncated]
+                      for cell_id, best in self._best.items()]
+        }
+        temporary_path = "{path}.part".format(path=path)
+        with open(temporary_path, "w") as target_file:
+            target_file.write(rapidjson.dumps(state))
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def read_state(cls, path: str) -> "NearestFacilityReducer":
+        with open(path, "rb") as state_file:
+            state = rapidjson.loads(state_file.read())
+        reducer = cls(k=state["k"])
+        reducer.layers = state["layers"]
+        for cell_id, cell, top, truncated in state["cells"]:
+            top = [tuple(entry) for entry in top]
+            reducer._best[cell_id] = top[0]
+            if reducer.k > 1:
+                reducer._top[cell_id] = top
+            if truncated:
+                reducer._truncated.add(cell_id)
+            if cell is not None:
+                reducer._cells[cell_id] = tuple(cell)
+        return reducer
+
+
+def layer_files(folder: str, travel_mode, prefix: str = "reachability") -> List[str]:
+    """
+    The '.acc_dump' and individual '.geojson' outputs of main.py for one travel mode.
+    """
+    pattern = re.compile(r"^{prefix}_{travel_mode}(_.*)?\.(acc_dump|geojson)$".format(
+        prefix=re.escape(prefix), travel_mode=re.escape(convertEnumToValue(travel_mode))))
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if pattern.match(name))
+
+
+def iter_layers(paths: Iterable[str]) -> Iterator[Tuple[Optional[str], dict]]:
+    """
+    Yields (origin_id, layer) for every reachability layer of the given files, one layer at a time. The origin id
+    is read from the layer's 'origin' member, or from the file name of individual files written without one.
+    """
+    for path in paths:
+        with open(path, "rb") as layer_file:
+            if path.endswith(".acc_dump"):
+                for line in layer_file:
+                    if line.strip():
+                        layer = rapidjson.loads(line)
+                        yield layer.get("origin", {}).get("origin_id"), layer
+            else:
+                layer = rapidjson.loads(layer_file.read())
+                yield layer.get("origin", {}).get("origin_id", os.path.splitext(os.path.basename(path))[0]), layer
+
+
+def reduce_layers(paths: Iterable[str], reducer: NearestFacilityReducer = None) -> NearestFacilityReducer:
+    reducer = reducer if reducer is not None else NearestFacilityReducer()
+    for origin_id, layer in iter_layers(paths):
+        reducer.add(layer, origin_id=origin_id)
+    return reducer
+
+
+def reduce_columnar(output_folder: str, prefix: str, travel_mode,
+                    reducer: NearestFacilityReducer = None) -> NearestFacilityReducer:
+    """
+    Same as reduce_layers, for the output of a '--format parquet' or '--format arrow' run.
+    """
+    from src.columnar import FORMATS, cells_path, read_table, reachability_folder
+
+    reducer = reducer if reducer is not None else NearestFacilityReducer()
+    travel_mode = convertEnumToValue(travel_mode)
+    folder = reachability_folder(output_folder, prefix)
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        if not name.startswith("part-") or name.endswith(".part"):
+            continue
+        table = read_table(os.path.join(folder, name)).to_pydict()
+        rows = [row for row in zip(table["travel_mode"], table["origin_id"], table["cell_id"], table["travel_time"])
+                if row[0] == travel_mode]
+        reducer.add_rows([row[1] for row in rows], [row[2] for row in rows], [row[3] for row in rows])
+    for output_format in FORMATS:
+        path = cells_path(output_folder, prefix, output_format)
+        if os.path.exists(path):
+            cells = read_table(path).to_pydict()
+            for row in zip(cells["cell_id"], *[cells[name] for name in CELL_ATTRIBUTES],
+                           cells["longitude"], cells["latitude"]):
+                reducer.add_cell(row[0], row[1:-2], row[-2], row[-1])
+    return reducer
+
+
+def merge_nearest(paths: Iterable[str], reducer: NearestFacilityReducer = None) -> NearestFacilityReducer:
+    """
+    Reduces '<prefix>_nearest_<travel_mode>.geojson' files, e.g. the ones written by the shards of a run.
+    """
+    reducer = reducer if reducer is not None else NearestFacilityReducer()
+    for path in paths:
+        with open(path, "rb") as nearest_file:
+            features = rapidjson.loads(nearest_file.read())["features"]
+        reducer.add_rows([feature["properties"]["origin_id"] for feature in features],
+                         [int(feature["id"]) for feature in features],
+                         [feature["properties"]["travel_time"] for feature in features])
+        for feature in features:
+            reducer.add_cell(int(feature["id"]), tuple(feature["properties"].get(name) for name in CELL_ATTRIBUTES),
+                             *feature["geometry"]["coordinates"][:2])
+    return reducer
+
+
+def nearest_path(output_folder: str, prefix: str, travel_mode) -> str:
+    # not '<prefix>_<travel_mode>_...' so that it is never read back as a reachability layer
+    return os.path.join(output_folder, "{prefix}_nearest_{travel_mode}.geojson".format(
+        prefix=prefix, travel_mode=convertEnumToValue(travel_mode)))
+
+
+def nearest_state_path(output_folder: str, prefix: str, travel_mode) -> str:
+    return os.path.join(output_folder, "{prefix}_nearest_{travel_mode}.state.json".format(
+        prefix=prefix, travel_mode=convertEnumToValue(travel_mode)))
@@ -0,0 +1,75 @@
+import os
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from src.dump_index import AccDumpReader
+from src.manifest import RunManifest
+from src.scheduler import origin_id
+
+# coordinates are compared at the precision of the origin ids made from them (about a centimeter)
+PRECISION = 7
+
+
+class FacilityDiff(NamedTuple):
+    added: List[str]
+    moved: List[str]
+    removed: List[str]
+    unchanged: int
+
+    @property
+    def dropped(self) -> Set[str]:
+        """
+        The origins whose layers are out of date.
+        """
+        return set(self.moved) | set(self.removed)
+
+    def format(self) -> str:
+        return "{added} new, {moved} moved, {removed} removed and {unchanged} unchanged facilities".format(
+            added=len(self.added), moved=len(self.moved), removed=len(self.removed), unchanged=self.unchanged)
+
+
+def same_point(first: Tuple[float, float], second: Tuple[float, float]) -> bool:
+    return all(round(a, PRECISION) == round(b, PRECISION) for a, b in zip(first, second))
+
+
+def diff_origins(previous: Dict[str, Optional[Tuple[float, float]]],
+                 entry_points: Iterable[Tuple[Optional[object], float, float]]) -> FacilityDiff:
+    """
+    Compares the entry points of a new facility layer to the origins of the previous run, by id (the LIPAS id) and
+    coordinates. Origins whose coordinates are not known (None) count as moved.
+    """
+    added, moved, seen = [], [], set()
+    unchanged = 0
+    for feature_id, longitude, latitude in entry_points:
+        current = origin_id(feature_id, longitude, latitude)
+        if current in seen:
+            continue
+        seen.add(current)
+        if current not in previous:
+            added.append(current)
+        elif previous[current] is None or not same_point(previous[current], (longitude, latitude)):
+            moved.append(current)
+        else:
+            unchanged += 1
+    return FacilityDiff(added, moved, sorted(set(previous) - seen), unchanged)
+
+
+def previous_origins(manifest: RunManifest, dump_paths: Iterable[str]) -> Dict[str, Optional[Tuple[float, float]]]:
+    """
+    The origins written by the previous runs and their coordinates. Runs that did not record the coordinates in
+    the manifest yet have them read from the 'origin' member of their layers in the dumps (None when no layer has
+    one).
+    """
+    origins: Dict[str, Optional[Tuple[float, float]]] = dict(manifest.origins())
+    missing = {key[0] for key in manifest.completed_keys()} - set(origins)
+    for path in dump_paths:
+        if not missing or not os.path.exists(path):
+            continue
+        with AccDumpReader(path) as reader:
+            for origin, travel_mode in reader.keys():
+                if origin in missing:
+                    coordinates = (reader.origin(origin, travel_mode) or {}).get("coordinates")
+                    if coordinates:
+                        origins[origin] = tuple(coordinates[:2])
+                        missing.discard(origin)
+    origins.update((origin, None) for origin in missing)
+    return origins
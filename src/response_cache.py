@@ -0,0 +1,148 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, Optional
+
+import rapidjson
+
+COORDINATE_PARAMS = ("latitude", "longitude")
+# number of cache hits whose access times are kept in memory before they are written in one transaction
+ACCESS_BATCH = 1000
+
+
+class ResponseCache:
+    """
+    Persistent cache of Mapple API response bodies, stored zlib-compressed in a SQLite file. Entries are addressed by
+    a hash of the endpoint and the normalized request parameters: coordinates are rounded to `precision` decimals
+    (5 decimals is about one meter) so that the same facility read from two layers hits the same entry.
+    Entries older than `ttl` seconds are ignored, and the least recently used entries are evicted once the
+    compressed bodies take more than `max_bytes`. The methods are blocking and thread safe; MappleClient runs them
+    in the default executor.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024, ttl: float = 30 * 24 * 3600,
+                 precision: int = 5, compression_level: int = 6):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "responses.sqlite")
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.precision = precision
+        self.compression_level = compression_level
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # the access times of the hits are written in batches, so that a hit takes neither a write lock nor an fsync
+        self._accessed: Dict[str, float] = {}
+        # shards of a '--workers' run share the cache, so wait for the other processes' write locks
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=60)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        # the total size is kept in the database by triggers, so that every process sharing the cache evicts by the
+        # same count
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache_size (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                size INTEGER NOT NULL
+            )""")
+        self._connection.execute("INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+        self._connection.execute("""
+            CREATE TRIGGER IF NOT EXISTS responses_inserted AFTER INSERT ON responses BEGIN
+                UPDATE cache_size SET size = size + new.size;
+            END""")
+        self._connection.execute("""
+            CREATE TRIGGER IF NOT EXISTS responses_deleted AFTER DELETE ON responses BEGIN
+                UPDATE cache_size SET size = size - old.size;
+            END""")
+        self._connection.commit()
+
+    def key(self, url: str, params: Dict[str, str]) -> str:
+        normalized = {name: (round(float(value), self.precision) if name in COORDINATE_PARAMS else str(value))
+                      for name, value in params.items()}
+        return hashlib.sha256(rapidjson.dumps([url, normalized], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT body, created_at FROM responses WHERE key = ?",
+                                           (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            body, created_at = row
+            if now - created_at > self.ttl:
+                with self._connection:
+                    self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._accessed.pop(key, None)
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= ACCESS_BATCH:
+                with self._connection:
+                    self._write_access_times()
+            self.hits += 1
+        return zlib.decompress(body)
+
+    def put(self, key: str, body: bytes):
+        compressed = zlib.compress(body, self.compression_level)
+        now = time.time()
+        # the transaction is rolled back when a statement fails (database locked, disk full), so that the
+        # connection is not left inside it
+        with self._lock, self._connection:
+            # take the write lock up front, so that the size read here is not changed by another process before
+            # the eviction
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._accessed.pop(key, None)
+            self._write_access_times()
+            # a REPLACE would delete the previous entry without firing the delete trigger
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._connection.execute("INSERT INTO responses VALUES (?, ?, ?, ?, ?)",
+                                     (key, compressed, len(compressed), now, now))
+            if self._read_size() > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # drop the expired entries, then the least recently used ones until 90 % of the size cap is free again
+        expires_before = time.time() - self.ttl
+        self._connection.execute("DELETE FROM responses WHERE created_at < ?", (expires_before,))
+        size = self._read_size()
+        target = self.max_bytes * 0.9
+        for key, entry_size in self._connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if size <= target:
+                break
+            self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            size -= entry_size
+
+    def _write_access_times(self):
+        self._connection.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                     [(accessed_at, key) for key, accessed_at in self._accessed.items()])
+        self._accessed.clear()
+
+    def _read_size(self) -> int:
+        return self._connection.execute("SELECT size FROM cache_size").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        """
+        The size of the compressed bodies in the cache, including the entries written by other processes.
+        """
+        with self._lock:
+            return self._read_size()
+
+    def close(self):
+        with self._lock:
+            if self._accessed:
+                with self._connection:
+                    self._write_access_times()
+            self._connection.close()
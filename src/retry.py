@@ -0,0 +1,29 @@
+import random
+from typing import Optional
+
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS, HTTP_500_INTERNAL_SERVER_ERROR
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter. 'Too Many Requests', server errors (5xx) and unreachable server errors
+    (which fetch reports as 500) are retried up to `max_attempts` attempts in total; other errors are permanent.
+    """
+
+    def __init__(self, max_attempts: int = 5, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_retryable(exception: Exception) -> bool:
+        status_code = getattr(exception, "status_code", None)
+        return status_code is not None and (status_code == HTTP_429_TOO_MANY_REQUESTS or
+                                            status_code >= HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def should_retry(self, exception: Exception, attempt: int) -> bool:
+        return attempt < self.max_attempts and self.is_retryable(exception)
+
+    def delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        return max(backoff, retry_after) if retry_after is not None else backoff
@@ -0,0 +1,123 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from src.config import TimeOfDay, TimeProfile, WalkingSpeeds, CyclingSpeeds, TravelModes
+
+
+class ReachabilityJob(NamedTuple):
+    origin_id: str
+    latitude: float
+    longitude: float
+    travel_mode: TravelModes
+    radius: int = 20000
+    maxTimeThreshold: int = 30
+    walking_speed_kmph: float = WalkingSpeeds.AVERAGE
+    cycling_speed_kmph: float = CyclingSpeeds.AVERAGE_CYCLING
+    timeOfDay: TimeOfDay = TimeOfDay.RUSH_HOUR
+    timeProfile: TimeProfile = TimeProfile.FASTEST
+
+
+def origin_id(feature_id, longitude: float, latitude: float) -> str:
+    """
+    The feature id when the entry point has one (LIPAS layers do), the coordinates otherwise.
+    """
+    if feature_id is None or feature_id != feature_id:  # missing, or NaN when only some features have an id
+        return "{x:.7f},{y:.7f}".format(x=longitude, y=latitude)
+    return str(feature_id)
+
+
+_DONE = object()
+_PRODUCED = object()
+
+
+async def schedule(jobs: Iterable[ReachabilityJob], worker: Callable[[ReachabilityJob], Awaitable],
+                   concurrency: int = 10, mode_limits: Dict[TravelModes, int] = None,
+                   backlog: int = 10000) -> AsyncIterator[Tuple[ReachabilityJob, object]]:
+    """
+    Runs `worker` for every job with at most `concurrency` jobs in flight, and at most mode_limits[mode] jobs of a
+    given travel mode. Every travel mode has its own queue and consumers, so a slow mode with a tight limit does not
+    hold back the others: they run ahead of it by up to `backlog` queued jobs. Jobs are pulled lazily from `jobs`,
+    so it can be a generator over millions of points.
+    Yields (job, result) pairs in completion order. If a worker raises, the remaining jobs are cancelled and the
+    exception is raised to the consumer. Limits below 1 raise ValueError, as no job would ever run.
+    """
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1, got {concurrency}".format(concurrency=concurrency))
+    limits = {TravelModes(mode): limit for mode, limit in (mode_limits or {}).items()}
+    for mode, limit in limits.items():
+        if limit < 1:
+            raise ValueError("The limit of {mode} must be at least 1, got {limit}".format(mode=mode.value,
+                                                                                         limit=limit))
+    result_queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+    mode_queues: Dict[TravelModes, asyncio.Queue] = {}
+    consumers: List[asyncio.Future] = []
+    # a job holds a global slot only while its worker runs, never while it waits for its travel mode
+    slots = asyncio.Semaphore(concurrency)
+    queued = asyncio.Semaphore(backlog)
+
+    async def consume(job_queue: asyncio.Queue):
+        while True:
+            job = await job_queue.get()
+            if job is _DONE:
+                await result_queue.put(_DONE)
+                return
+            queued.release()
+            try:
+                async with slots:
+                    result = await worker(job)
+            except Exception as e:
+                await result_queue.put((job, None, e))
+                return
+            await result_queue.put((job, result, None))
+
+    async def produce():
+        try:
+            for job in jobs:
+                mode = TravelModes(job.travel_mode)
+                if mode not in mode_queues:
+                    mode_queues[mode] = asyncio.Queue()
+                    consumers.extend(asyncio.ensure_future(consume(mode_queues[mode]))
+                                     for _ in range(min(limits.get(mode, concurrency), concurrency)))
+                await queued.acquire()
+                mode_queues[mode].put_nowait(job)
+        except Exception as e:
+            await result_queue.put((None, None, e))
+            return
+        for mode, job_queue in mode_queues.items():
+            for _ in range(min(limits.get(mode, concurrency), concurrency)):
+                job_queue.put_nowait(_DONE)
+        await result_queue.put(_PRODUCED)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        produced, finished = False, 0
+        while not produced or finished < len(consumers):
+            item = await result_queue.get()
+            if item is _PRODUCED:
+                produced = True
+                continue
+            if item is _DONE:
+                finished += 1
+                continue
+            job, result, error = item
+            if error is not None:
+                raise error
+            yield job, result
+        await producer
+    finally:
+        for task in [producer] + consumers:
+            task.cancel()
+        await asyncio.gather(producer, *consumers, return_exceptions=True)
+
+
+def parse_mode_limits(values: Optional[Iterable[str]]) -> Dict[TravelModes, int]:
+    """
+    Parses command line values such as ['transit=2', 'driving=4'] into per travel mode concurrency limits.
+    """
+    mode_limits = {}
+    for value in values or []:
+        mode, _, limit = value.partition("=")
+        mode_limits[TravelModes(mode)] = int(limit)
+        if mode_limits[TravelModes(mode)] < 1:
+            raise ValueError("The limit of {mode} must be at least 1, got {limit}".format(mode=mode, limit=limit))
+    return mode_limits
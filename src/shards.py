@@ -0,0 +1,254 @@
+import bisect
+import math
+import multiprocessing
+import os
+import shutil
+import zlib
+from typing import Dict, List, Optional
+
+import rapidjson
+
+from src.columnar import ColumnarWriter, FORMATS, cells_path, reachability_folder
+from src.config import TravelModes
+from src.dead_letter import dead_letter_path
+from src.dump_index import merge_indexes
+from src.reducer import layer_files, merge_nearest, nearest_path
+
+SHARD_BY = ("hash", "spatial")
+
+
+class ShardPlan:
+    """
+    Assigns every origin to one of `workers` shards, either by a stable hash of its id or by latitude bands holding
+    the same number of entry points each (so that a shard's layers overlap and its nearest facility reducer stays
+    small). The plan is saved next to the outputs: a resumed run has to assign the origins to the same shards.
+    """
+
+    def __init__(self, workers: int, shard_by: str = "hash", bounds: List[float] = None):
+        if shard_by not in SHARD_BY:
+            raise ValueError("Unknown sharding '{shard_by}'".format(shard_by=shard_by))
+        self.workers = workers
+        self.shard_by = shard_by
+        self.bounds = bounds or []
+
+    @classmethod
+    def spatial(cls, latitudes: List[float], workers: int) -> "ShardPlan":
+        latitudes = sorted(latitudes)
+        bounds = [latitudes[len(latitudes) * index // workers] for index in range(1, workers)] if latitudes else []
+        return cls(workers, "spatial", bounds)
+
+    def shard_of(self, origin_id: str, latitude: float) -> int:
+        if self.shard_by == "spatial":
+            return bisect.bisect_right(self.bounds, latitude)
+        return zlib.crc32(str(origin_id).encode("utf-8")) % self.workers
+
+    def __eq__(self, other):
+        return isinstance(other, ShardPlan) and \
+            (self.workers, self.shard_by, self.bounds) == (other.workers, other.shard_by, other.bounds)
+
+    def save(self, path: str):
+        with open(path, "w") as plan_file:
+            plan_file.write(rapidjson.dumps({"workers": self.workers, "shard_by": self.shard_by,
+                                             "bounds": self.bounds}))
+
+    @classmethod
+    def load(cls, path: str) -> "ShardPlan":
+        with open(path) as plan_file:
+            plan = rapidjson.loads(plan_file.read())
+        return cls(plan["workers"], plan["shard_by"], plan["bounds"])
+
+
+def plan_path(output_folder: str, prefix: str) -> str:
+    return os.path.join(output_folder, "{prefix}_shards.json".format(prefix=prefix))
+
+
+def shard_folder(output_folder: str, index: int) -> str:
+    return os.path.join(output_folder, "shard_{index:02d}".format(index=index))
+
+
+def split_entry_points(origins: List[tuple], plan: ShardPlan, output_folder: str, prefix: str) -> List[Optional[str]]:
+    """
+    Writes the (origin_id, longitude, latitude) entry points of every shard to
+    'shard_<index>/<prefix>_entry_points.geojsonl', one feature per line. Returns the paths, None for the shards
+    without entry points.
+    """
+    streams = {}
+    try:
+        for origin_id, longitude, latitude in origins:
+            index = plan.shard_of(origin_id, latitude)
+            stream = streams.get(index)
+            if stream is None:
+                folder = shard_folder(output_folder, index)
+                os.makedirs(folder, exist_ok=True)
+                stream = streams[index] = open(entry_points_path(folder, prefix), "wb")
+            stream.write(rapidjson.dumps({
+                "type": "Feature",
+                "properties": {"id": origin_id},
+                "geometry": {"type": "Point", "coordinates": [longitude, latitude]}
+            }).encode("utf-8") + b"\n")
+    finally:
+        for stream in streams.values():
+            stream.close()
+    return [entry_points_path(shard_folder(output_folder, index), prefix) if index in streams else None
+            for index in range(plan.workers)]
+
+
+def entry_points_path(folder: str, prefix: str) -> str:
+    return os.path.join(folder, "{prefix}_entry_points.geojsonl".format(prefix=prefix))
+
+
+def split_failed_jobs(failed_jobs: str, plan: ShardPlan, output_folder: str, prefix: str) -> List[Optional[str]]:
+    """
+    Splits a failed requests file between the shards, as 'shard_<index>/<prefix>_failed.geojsonl.replayed'.
+    """
+    lines: List[List[str]] = [[] for _ in range(plan.workers)]
+    with open(failed_jobs) as failed_jobs_file:
+        for line in failed_jobs_file:
+            if not line.strip():
+                continue
+            feature = rapidjson.loads(line)
+            shard = plan.shard_of(feature["properties"]["origin_id"], feature["geometry"]["coordinates"][1])
+            lines[shard].append(line if line.endswith("\n") else line + "\n")
+    paths = []
+    for index, shard_lines in enumerate(lines):
+        if not shard_lines:
+            paths.append(None)
+            continue
+        os.makedirs(shard_folder(output_folder, index), exist_ok=True)
+        path = "{path}.replayed".format(path=dead_letter_path(shard_folder(output_folder, index), prefix))
+        with open(path, "w") as replay_file:
+            replay_file.writelines(shard_lines)
+        paths.append(path)
+    return paths
+
+
+def shard_totals(plan: ShardPlan, origins: List[tuple], jobs_per_origin: int) -> List[int]:
+    totals = [0] * plan.workers
+    for origin_id, longitude, latitude in origins:
+        totals[plan.shard_of(origin_id, latitude)] += jobs_per_origin
+    return totals
+
+
+def shard_options(options: Dict, index: int, workers: int, api_keys: List[Optional[str]]) -> Dict:
+    """
+    The main() options of one shard. Shard `index` uses API key index % len(api_keys). The rate limit and burst
+    are a budget per API key, shared by the shards using that key; the concurrency and the connections are split
+    between all the shards.
+    """
+    api_key = api_keys[index % len(api_keys)]
+    sharing = sum(1 for shard in range(workers) if api_keys[shard % len(api_keys)] == api_key)
+    return dict(options, workers=1, api_key=api_key, output_folder=shard_folder(options["output_folder"], index),
+                rate=options["rate"] / sharing, burst=math.ceil(options["burst"] / sharing),
+                concurrency=math.ceil(options["concurrency"] / workers),
+                max_connections=math.ceil(options["max_connections"] / workers))
+
+
+class ShardProgress:
+    """
+    Counters of the requests done and failed by every shard, in shared memory so that the shard processes can
+    update them and the parent process can print them.
+    """
+
+    def __init__(self, totals: List[int], context=None):
+        context = context or multiprocessing.get_context("spawn")
+        self.totals = totals
+        self._done = context.Array("q", len(totals))
+        self._failed = context.Array("q", len(totals))
+
+    def record(self, index: int, failed: bool = False):
+        counters = self._failed if failed else self._done
+        with counters.get_lock():
+            counters[index] += 1
+
+    def done(self) -> List[int]:
+        return list(self._done)
+
+    def failed(self) -> List[int]:
+        return list(self._failed)
+
+    def format(self) -> str:
+        done, failed = self.done(), self.failed()
+        total = sum(self.totals)
+        shards = " ".join("{index}:{done}/{total}".format(index=index, done=done[index] + failed[index],
+                                                          total=self.totals[index])
+                          for index in range(len(self.totals)))
+        return "{finished}/{total} requests ({percent:.0f}%), {failed} failed [{shards}]".format(
+            finished=sum(done) + sum(failed), total=total,
+            percent=100 * (sum(done) + sum(failed)) / total if total else 100, failed=sum(failed), shards=shards)
+
+
+def count_lines(path: str) -> int:
+    with open(path) as lines_file:
+        return sum(1 for line in lines_file if line.strip())
+
+
+def _link(source: str, target: str):
+    # hard links keep the merge cheap, the shard outputs are still needed to resume the shards
+    temporary_path = "{path}.part".format(path=target)
+    if os.path.exists(temporary_path):
+        os.remove(temporary_path)
+    try:
+        os.link(source, temporary_path)
+    except OSError:
+        shutil.copyfile(source, temporary_path)
+    os.replace(temporary_path, target)
+
+
+def _concatenate(sources: List[str], target: str):
+    temporary_path = "{path}.part".format(path=target)
+    with open(temporary_path, "wb") as target_file:
+        for source in sources:
+            with open(source, "rb") as source_file:
+                shutil.copyfileobj(source_file, target_file, 1024 * 1024)
+    os.replace(temporary_path, target)
+
+
+def merge_shards(folders: List[str], output_folder: str, prefix: str, output_format: str = "geojson",
+                 nearest: bool = False) -> int:
+    """
+    Combines the outputs of the shard folders into the output folder, as if a single process had written them.
+    Shards are always merged in the same order, so the result does not depend on which shard finished first.
+    Returns the number of failed requests.
+    """
+    folders = [folder for folder in folders if os.path.isdir(folder)]
+
+    if output_format in FORMATS:
+        columnar = ColumnarWriter(output_folder, prefix, output_format=output_format)
+        for folder in folders:
+            parts_folder = reachability_folder(folder, prefix)
+            for name in sorted(os.listdir(parts_folder)) if os.path.isdir(parts_folder) else []:
+                if name.startswith("part-") and name.endswith("." + output_format):
+                    _link(os.path.join(parts_folder, name), columnar.next_part_path())
+            if os.path.exists(cells_path(folder, prefix, output_format)):
+                columnar.add_cells(cells_path(folder, prefix, output_format))
+        columnar.write_cells()
+    else:
+        for mode in TravelModes:
+            for folder in folders:
+                # individual files are named after their origin, so they do not collide between shards
+                for path in layer_files(folder, mode, prefix):
+                    if path.endswith(".geojson"):
+                        _link(path, os.path.join(output_folder, os.path.basename(path)))
+            dumps = [path for folder in folders for path in layer_files(folder, mode, prefix)
+                     if path.endswith(".acc_dump")]
+            if dumps:
+                target = os.path.join(output_folder, os.path.basename(dumps[0]))
+                _concatenate(dumps, target)
+                merge_indexes(dumps, target)
+
+    if nearest:
+        for mode in TravelModes:
+            paths = [nearest_path(folder, prefix, mode) for folder in folders
+                     if os.path.exists(nearest_path(folder, prefix, mode))]
+            if paths:
+                merge_nearest(paths).write(nearest_path(output_folder, prefix, mode))
+
+    failed = [dead_letter_path(folder, prefix) for folder in folders
+              if os.path.exists(dead_letter_path(folder, prefix))]
+    target = dead_letter_path(output_folder, prefix)
+    if failed:
+        _concatenate(failed, target)
+    elif os.path.exists(target):
+        os.remove(target)
+    return sum(count_lines(path) for path in failed)
+
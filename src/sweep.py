@@ -0,0 +1,135 @@
+import itertools
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import rapidjson
+
+from src.config import CyclingSpeeds, TimeOfDay, TimeProfile, TravelModes, WalkingSpeeds
+from src.decoding import ReachabilityArrays
+from src.mapple_api import convertEnumToValue
+from src.scheduler import ReachabilityJob, origin_id
+
+# the request parameters of every travel mode (besides the threshold), the others do not change its answer
+MODE_PARAMETERS = {
+    TravelModes.WALKING: ("walking_speed_kmph",),
+    TravelModes.CYCLING: ("walking_speed_kmph", "cycling_speed_kmph"),
+    TravelModes.TRANSIT: ("walking_speed_kmph", "timeOfDay", "timeProfile"),
+    TravelModes.DRIVING: ("walking_speed_kmph", "timeOfDay", "timeProfile"),
+}
+
+
+class SweepVariant(NamedTuple):
+    maxTimeThreshold: int
+    timeOfDay: TimeOfDay = TimeOfDay.RUSH_HOUR
+    timeProfile: TimeProfile = TimeProfile.FASTEST
+    walking_speed_kmph: float = WalkingSpeeds.AVERAGE
+    cycling_speed_kmph: float = CyclingSpeeds.AVERAGE_CYCLING
+
+
+def _value(value):
+    value = convertEnumToValue(value)
+    return float(value) if isinstance(value, (int, float)) else value
+
+
+def request_key(travel_mode: TravelModes, parameters) -> tuple:
+    """
+    What a request depends on apart from its threshold, for a job or a variant.
+    """
+    travel_mode = TravelModes(travel_mode)
+    return (travel_mode,) + tuple(_value(getattr(parameters, name)) for name in MODE_PARAMETERS[travel_mode])
+
+
+class SweepPlan:
+    """
+    A parameter study: every variant is a full set of request parameters, and gets its own outputs. Only one
+    request is sent per entry point, travel mode and set of parameters the travel mode actually uses, with the
+    largest threshold of the variants sharing them; the layers of the other variants are derived from its answer by
+    keeping the cells reached within their threshold. (A walking variant does not depend on the time of day, so
+    the variants that only differ by it share one request too.)
+    """
+
+    def __init__(self, variants: Sequence[SweepVariant]):
+        if not variants:
+            raise ValueError("A sweep needs at least one variant")
+        self.variants = list(dict.fromkeys(variants))
+        self.names = self._names()
+
+    @classmethod
+    def grid(cls, thresholds: Iterable[int], times_of_day: Iterable[TimeOfDay] = (TimeOfDay.RUSH_HOUR,),
+             time_profiles: Iterable[TimeProfile] = (TimeProfile.FASTEST,),
+             walking_speeds: Iterable[float] = (WalkingSpeeds.AVERAGE,),
+             cycling_speeds: Iterable[float] = (CyclingSpeeds.AVERAGE_CYCLING,)) -> "SweepPlan":
+        return cls([SweepVariant(int(threshold), TimeOfDay(time_of_day), TimeProfile(time_profile),
+                                 float(walking_speed), float(cycling_speed))
+                    for threshold, time_of_day, time_profile, walking_speed, cycling_speed in itertools.product(
+                        thresholds, times_of_day, time_profiles, walking_speeds, cycling_speeds)])
+
+    def _names(self) -> Dict[SweepVariant, str]:
+        """
+        Folder names of the variants: the threshold, and the other parameters that differ between variants.
+        """
+        def varies(field: str) -> bool:
+            return len({_value(getattr(variant, field)) for variant in self.variants}) > 1
+
+        names = {}
+        for variant in self.variants:
+            parts = ["{threshold}min".format(threshold=variant.maxTimeThreshold)]
+            if varies("timeOfDay"):
+                parts.append(_value(variant.timeOfDay))
+            if varies("timeProfile"):
+                parts.append(_value(variant.timeProfile))
+            if varies("walking_speed_kmph"):
+                parts.append("walking{speed:g}kmh".format(speed=_value(variant.walking_speed_kmph)))
+            if varies("cycling_speed_kmph"):
+                parts.append("cycling{speed:g}kmh".format(speed=_value(variant.cycling_speed_kmph)))
+            names[variant] = "_".join(parts)
+        return names
+
+    def fetches(self, travel_mode: TravelModes) -> List[SweepVariant]:
+        """
+        The requests to send for every entry point in this travel mode, as parameters. The parameters the travel
+        mode does not use are left to their defaults, so that the same request is not cached or logged twice.
+        """
+        largest: Dict[tuple, SweepVariant] = {}
+        for variant in self.variants:
+            key = request_key(travel_mode, variant)
+            if key not in largest or variant.maxTimeThreshold > largest[key].maxTimeThreshold:
+                largest[key] = variant
+        defaults = SweepVariant(0)
+        parameters = MODE_PARAMETERS[TravelModes(travel_mode)]
+        return [defaults._replace(maxTimeThreshold=variant.maxTimeThreshold,
+                                  **{name: getattr(variant, name) for name in parameters})
+                for variant in largest.values()]
+
+    def jobs(self, entry_points: Iterable[Tuple[Optional[object], float, float]], travel_modes: List[TravelModes],
+             radius: int = 20000) -> Iterator[ReachabilityJob]:
+        fetches = {mode: self.fetches(mode) for mode in travel_modes}
+        for feature_id, longitude, latitude in entry_points:
+            job_origin_id = origin_id(feature_id, longitude, latitude)
+            for mode in travel_modes:
+                for parameters in fetches[mode]:
+                    yield ReachabilityJob(origin_id=job_origin_id, latitude=latitude, longitude=longitude,
+                                          travel_mode=mode, radius=radius, **parameters._asdict())
+
+    def requests_per_entry_point(self, travel_modes: List[TravelModes]) -> int:
+        return sum(len(self.fetches(mode)) for mode in travel_modes)
+
+    def derived(self, job: ReachabilityJob) -> List[Tuple[SweepVariant, ReachabilityJob]]:
+        """
+        The variants whose layer is derived from the answer to `job`, with the job each of them stands for.
+        """
+        key = request_key(job.travel_mode, job)
+        return [(variant, job._replace(**variant._asdict())) for variant in self.variants
+                if request_key(job.travel_mode, variant) == key and variant.maxTimeThreshold <= job.maxTimeThreshold]
+
+
+def within_threshold(reachability, max_travel_time: float):
+    """
+    The layer restricted to the cells reached in at most `max_travel_time` minutes. Works on the three decode
+    modes; raw bodies are decoded first.
+    """
+    if isinstance(reachability, ReachabilityArrays):
+        return reachability.within(max_travel_time)
+    if isinstance(reachability, (bytes, bytearray)):
+        reachability = rapidjson.loads(reachability)
+    return dict(reachability, features=[feature for feature in reachability.get("features", [])
+                                        if feature["properties"]["travel_time"] <= max_travel_time])
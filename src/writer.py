@@ -0,0 +1,230 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+import rapidjson
+
+from src.columnar import ColumnarWriter
+from src.decoding import ReachabilityArrays
+from src.dump_index import CellIndex, cell_index_path, cells_of, index_line, index_path
+from src.mapple_api import convertEnumToValue
+from src.metrics import RunMetrics
+from src.scheduler import ReachabilityJob
+
+_CLOSE = object()
+
+
+def origin_member(job: ReachabilityJob) -> dict:
+    return {
+        "origin_id": str(job.origin_id),
+        "travel_mode": convertEnumToValue(job.travel_mode),
+        "coordinates": [job.longitude, job.latitude]
+    }
+
+
+def encode(record, job: ReachabilityJob = None) -> bytes:
+    """
+    Serializes one reachability layer as a single line. When the job is known, the layer gets an 'origin' member
+    (a GeoJSON foreign member, ignored by GIS tools) naming the point it was computed from. Raw response bodies
+    (bytes) are otherwise written untouched, apart from newlines, which can only be whitespace in a JSON document.
+    """
+    if isinstance(record, (bytes, bytearray)):
+        body = bytes(record).replace(b"\n", b" ").strip()
+        if job is not None and body.startswith(b"{"):
+            rest = body[1:].lstrip()
+            body = b'{"origin":' + rapidjson.dumps(origin_member(job)).encode("utf-8") + \
+                   (b"," if not rest.startswith(b"}") else b"") + rest
+        return body + b"\n"
+    if isinstance(record, ReachabilityArrays):
+        record = record.to_feature_collection()
+    if job is not None:
+        record = dict(record, origin=origin_member(job))
+    return rapidjson.dumps(record).encode("utf-8") + b"\n"
+
+
+class ReachabilityWriter:
+    """
+    Writes the reachability layers from a background thread, so that serialization and file I/O never block the
+    event loop. '.acc_dump' streams keep one handle open for the whole run, and their lines are buffered and
+    flushed once `flush_bytes` are pending or `flush_interval` seconds have passed. Any other path is written as
+    one file per layer. With a columnar writer, the layers are handed to it instead (the path is ignored) and a
+    new part file is written every `rows_per_part` rows. After every flush, `on_flushed` is called from the writer
+    thread with the jobs whose layers are now on disk. `on_record`, when given, is called from the writer thread
+    with every (job, layer) before it is written, e.g. to reduce the layers while the fetch is running. With
+    `metrics`, the time spent writing every layer and every flush is recorded.
+
+    Every '.acc_dump' gets an index '<dump>.idx' of the offset and length of each layer (see AccDumpReader),
+    written after the layers it points to. With `cell_index`, the cells reached by every layer are also indexed in
+    '<dump>.cells.sqlite' (see CellIndex).
+    """
+
+    def __init__(self, flush_bytes: int = 4 * 1024 * 1024, flush_interval: float = 2.0, max_pending: int = 64,
+                 on_flushed: Callable[[List[ReachabilityJob]], None] = None, columnar: ColumnarWriter = None,
+                 on_record: Callable[[ReachabilityJob, object], None] = None, metrics: RunMetrics = None,
+                 cell_index: bool = False):
+        self.columnar = columnar
+        self.cell_index = cell_index
+        self.metrics = metrics
+        self.on_record = on_record
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.on_flushed = on_flushed
+        self.records = 0
+        self.bytes_written = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._streams: Dict[str, BinaryIO] = {}
+        self._pending: Dict[str, List[bytes]] = {}
+        self._pending_jobs: Dict[str, List[ReachabilityJob]] = {}
+        self._pending_keys: Dict[str, List[Optional[ReachabilityJob]]] = {}
+        self._index_streams: Dict[str, BinaryIO] = {}
+        self._cell_indexes: Dict[str, CellIndex] = {}
+        self._pending_bytes = 0
+        self._flushed_at = time.monotonic()
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="reachability-writer", daemon=True)
+        self._thread.start()
+
+    async def write(self, path: str, record, job: ReachabilityJob = None):
+        self._raise_error()
+        item = (path, record, job)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # back pressure: wait in an executor thread, not in the event loop
+            await asyncio.get_event_loop().run_in_executor(None, self._queue.put, item)
+
+    @property
+    def pending(self) -> int:
+        """
+        Number of layers waiting for the writer thread.
+        """
+        return self._queue.qsize()
+
+    @property
+    def closed(self) -> bool:
+        return not self._thread.is_alive()
+
+    async def close(self):
+        if self.closed:
+            self._raise_error()
+            return
+        await asyncio.get_event_loop().run_in_executor(None, self._queue.put, _CLOSE)
+        await asyncio.get_event_loop().run_in_executor(None, self._thread.join)
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise RuntimeError("Writing the reachability layers failed") from self._error
+
+    def _run(self):
+        try:
+            while True:
+                timeout = max(0.0, self.flush_interval - (time.monotonic() - self._flushed_at))
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush()
+                    continue
+                if item is _CLOSE:
+                    break
+                if self.metrics is not None:
+                    with self.metrics.timed("write_seconds"):
+                        self._write(*item)
+                else:
+                    self._write(*item)
+                if self._pending_bytes >= self.flush_bytes or \
+                        time.monotonic() - self._flushed_at >= self.flush_interval:
+                    self._flush()
+            self._flush()
+            if self.columnar is not None:
+                self._notify_flushed(self.columnar.close())
+        except BaseException as e:
+            self._error = e
+            # keep draining so that write() and close() never wait on a full queue
+            while self._queue.get() is not _CLOSE:
+                pass
+        finally:
+            for stream in list(self._streams.values()) + list(self._index_streams.values()):
+                stream.close()
+            self._streams.clear()
+            self._index_streams.clear()
+            for index in self._cell_indexes.values():
+                index.close()
+            self._cell_indexes.clear()
+
+    def _notify_flushed(self, jobs: List[ReachabilityJob]):
+        if jobs and self.on_flushed is not None:
+            self.on_flushed(jobs)
+
+    def _write(self, path: Optional[str], record, job: Optional[ReachabilityJob]):
+        if self.on_record is not None:
+            self.on_record(job, record)
+        if self.columnar is not None:
+            self.columnar.add(job, record)
+            self.records += 1
+            if self.columnar.pending_rows >= self.columnar.rows_per_part:
+                self._notify_flushed(self.columnar.flush())
+            return
+
+        line = encode(record, job)
+        self.records += 1
+        self.bytes_written += len(line)
+        if path.endswith(".acc_dump"):
+            self._pending.setdefault(path, []).append(line)
+            self._pending_keys.setdefault(path, []).append(job)
+            if job is not None:
+                self._pending_jobs.setdefault(path, []).append(job)
+                if self.cell_index:
+                    self._cell_index(path).add(job.origin_id, job.travel_mode, *cells_of(record))
+            self._pending_bytes += len(line)
+            return
+
+        temporary_path = "{path}.part".format(path=path)
+        with open(temporary_path, "wb") as target_file:
+            target_file.write(line)
+        os.replace(temporary_path, path)
+        if job is not None:
+            self._notify_flushed([job])
+
+    def _flush(self):
+        if self._pending and self.metrics is not None:
+            with self.metrics.timed("flush_seconds"):
+                self._flush_pending()
+        else:
+            self._flush_pending()
+        self._pending_bytes = 0
+        self._flushed_at = time.monotonic()
+
+    def _cell_index(self, path: str) -> CellIndex:
+        index = self._cell_indexes.get(path)
+        if index is None:
+            index = self._cell_indexes[path] = CellIndex(cell_index_path(path))
+        return index
+
+    def _flush_pending(self):
+        for path, lines in self._pending.items():
+            stream = self._streams.get(path)
+            if stream is None:
+                stream = self._streams[path] = open(path, "ab")
+            offset = stream.tell()
+            stream.writelines(lines)
+            stream.flush()
+            # the index only points to layers already on disk, a crash in between leaves a tail the reader indexes
+            entries = []
+            for line, job in zip(lines, self._pending_keys.pop(path)):
+                if job is not None:
+                    entries.append(index_line(job.origin_id, job.travel_mode, offset, len(line)))
+                offset += len(line)
+            if entries:
+                index_stream = self._index_streams.get(path)
+                if index_stream is None:
+                    index_stream = self._index_streams[path] = open(index_path(path), "ab")
+                index_stream.writelines(entries)
+                index_stream.flush()
+            if path in self._cell_indexes:
+                self._cell_indexes[path].commit()
+            self._notify_flushed(self._pending_jobs.pop(path, None))
+        self._pending.clear()
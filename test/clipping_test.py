@@ -0,0 +1,51 @@
+import unittest
+
+import geopandas
+from shapely.geometry import LineString, Point, box
+
+from src.clipping import ClippingEngine
+
+CRS = "EPSG:3067"
+
+
+class ClippingEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.loads = 0
+
+        def load_borders(municipality):
+            self.loads += 1
+            return geopandas.GeoDataFrame({"name": [municipality, municipality]},
+                                          geometry=[box(0, 0, 1000, 1000), box(1000, 0, 2000, 1000)], crs=CRS)
+
+        self.engine = ClippingEngine(load_borders)
+        points = [Point(x, y) for x in range(-500, 2600, 100) for y in range(-500, 1600, 100)]
+        self.points = geopandas.GeoDataFrame({"id": list(range(len(points)))}, geometry=points, crs=CRS)
+
+    def test_selects_the_same_points_as_overlay(self):
+        area = geopandas.GeoDataFrame(geometry=[self.engine.area("Jyväskylä", buffer=150)], crs=CRS)
+        expected = geopandas.overlay(self.points, area, how="intersection")
+
+        selected = self.engine.clip(self.points, "Jyväskylä", buffer=150)
+
+        self.assertEqual(sorted(expected["id"]), list(selected["id"]))
+        self.assertEqual(1, self.loads)
+        self.engine.clip(self.points, "Jyväskylä", buffer=150)
+        self.assertEqual(1, self.loads)
+        self.engine.clip(self.points, "Jyväskylä", buffer=0)
+        self.assertEqual(2, self.loads)
+
+    def test_lines_are_cut_only_when_exact(self):
+        lines = geopandas.GeoDataFrame({"id": [1, 2, 3]},
+                                       geometry=[LineString([(100, 500), (300, 500)]),
+                                                 LineString([(1500, 500), (2500, 500)]),
+                                                 LineString([(3000, 500), (4000, 500)])], crs=CRS)
+
+        whole = self.engine.clip(lines, "Jyväskylä")
+        self.assertEqual([1, 2], list(whole["id"]))
+        self.assertEqual([200, 1000], list(whole.geometry.length))
+
+        cut = self.engine.clip(lines, "Jyväskylä", exact=True)
+        self.assertEqual([200, 500], list(cut.geometry.length))
+
+        points = self.engine.clip(lines, "Jyväskylä", representative_points=True)
+        self.assertEqual(["Point", "Point"], list(points.geom_type))
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+import rapidjson
+
+from src.columnar import ColumnarWriter, read_cells, read_reachability
+from src.config import TravelModes
+from src.scheduler import ReachabilityJob
+
+
+class ColumnarWriterTest(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(os.getcwd(), "resources", "transit_reachability.geojson")) as resource_file:
+            self.reachability = rapidjson.loads(resource_file.read())
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def job(self, origin_id, travel_mode):
+        return ReachabilityJob(origin_id=origin_id, latitude=60.0, longitude=24.0, travel_mode=travel_mode)
+
+    def test_cells_are_written_once(self):
+        features = len(self.reachability["features"])
+        for output_format in ["parquet", "arrow"]:
+            writer = ColumnarWriter(self.folder.name, output_format, output_format=output_format)
+            writer.add(self.job("a", TravelModes.TRANSIT), self.reachability)
+            writer.add(self.job("b", TravelModes.TRANSIT), self.reachability)
+            writer.add(self.job("a", TravelModes.WALKING), self.reachability)
+            self.assertEqual(3, len(writer.close()))
+
+            cells = read_cells(self.folder.name, output_format)
+            self.assertEqual(features, len(cells))
+            self.assertTrue(cells.index.is_unique)
+
+            transit = read_reachability(self.folder.name, output_format, TravelModes.TRANSIT)
+            self.assertEqual(2 * features, len(transit))
+            self.assertEqual("float32", str(transit["travel_time"].dtype))
+            first = self.reachability["features"][0]
+            self.assertEqual(first["properties"]["travel_time"],
+                             transit[transit["cell_id"] == int(first["id"])]["travel_time"].iloc[0])
+            self.assertEqual(first["properties"]["geometry_id_1"], cells.loc[int(first["id"])]["geometry_id_1"])
+
+    def test_append_adds_a_part(self):
+        writer = ColumnarWriter(self.folder.name, "reachability")
+        writer.add(self.job("a", TravelModes.DRIVING), self.reachability)
+        writer.close()
+
+        writer = ColumnarWriter(self.folder.name, "reachability", append=True)
+        writer.add(self.job("b", TravelModes.DRIVING), self.reachability)
+        writer.close()
+
+        rows = read_reachability(self.folder.name, "reachability")
+        self.assertEqual({"a", "b"}, set(rows["origin_id"]))
+        self.assertEqual(len(self.reachability["features"]), len(read_cells(self.folder.name, "reachability")))
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+
+from src.config import TimeOfDay, TravelModes
+from src.dead_letter import DeadLetterWriter, read_dead_letters
+from src.mapple_api import MappleAPIException
+from src.retry import RetryPolicy
+from src.scheduler import ReachabilityJob
+
+
+class DeadLetterTest(unittest.TestCase):
+    def test_failed_jobs_can_be_read_back(self):
+        job = ReachabilityJob(origin_id="7", latitude=60.1681411, longitude=24.9306796,
+                              travel_mode=TravelModes.TRANSIT, maxTimeThreshold=60, timeOfDay=TimeOfDay.MIDDAY)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "reachability_failed.geojsonl")
+            dead_letters = DeadLetterWriter(path)
+            dead_letters.write(job, MappleAPIException(status_code=503, detail="Service Unavailable"), attempts=5)
+            dead_letters.close()
+
+            self.assertEqual(1, dead_letters.count)
+            self.assertEqual([job], list(read_dead_letters(path)))
+
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_retryable_errors(self):
+        policy = RetryPolicy(max_attempts=3)
+
+        self.assertTrue(policy.should_retry(MappleAPIException(status_code=429), attempt=1))
+        self.assertTrue(policy.should_retry(MappleAPIException(status_code=502), attempt=2))
+        self.assertFalse(policy.should_retry(MappleAPIException(status_code=502), attempt=3))
+        self.assertFalse(policy.should_retry(MappleAPIException(status_code=401), attempt=1))
+        self.assertFalse(policy.should_retry(ValueError("not an API error"), attempt=1))
+
+    def test_delay_is_bounded_and_honours_retry_after(self):
+        policy = RetryPolicy(base_delay=1.0, max_delay=4.0)
+
+        self.assertTrue(all(0 <= policy.delay(attempt) <= 4.0 for attempt in range(1, 10)))
+        self.assertGreaterEqual(policy.delay(1, retry_after=30.0), 30.0)
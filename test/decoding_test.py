@@ -0,0 +1,65 @@
+import os
+
+import asynctest
+import rapidjson
+
+from src.decoding import ReachabilityArrays, decode_compact, decode_compact_stream
+
+
+class FakeContent:
+    def __init__(self, body: bytes, fail_after: int = None):
+        self.body = body
+        self.fail_after = fail_after
+
+    async def iter_chunked(self, size: int):
+        for index, offset in enumerate(range(0, len(self.body), size)):
+            if self.fail_after is not None and index >= self.fail_after:
+                raise ConnectionResetError("connection lost")
+            yield self.body[offset:offset + size]
+
+
+class DecodeCompactTest(asynctest.TestCase):
+    def setUp(self):
+        with open(os.path.join(os.getcwd(), "resources", "transit_reachability.geojson"), "rb") as resource_file:
+            self.body = resource_file.read()
+        self.features = rapidjson.loads(self.body)["features"]
+
+    def assert_same_features(self, arrays: ReachabilityArrays):
+        self.assertEqual(len(arrays), len(self.features))
+        for index, feature in enumerate(self.features):
+            properties = feature["properties"]
+            self.assertEqual(arrays.cell_ids[index], int(feature["id"]))
+            self.assertEqual(arrays.travel_times[index], properties["travel_time"])
+            self.assertEqual([arrays.longitudes[index], arrays.latitudes[index]],
+                             feature["geometry"]["coordinates"])
+            self.assertEqual(arrays.cell_attributes(index),
+                             (properties["geometry_id_1"], properties["geometry_id_2"],
+                              properties["geometry_id_3"], properties["on_land"]))
+
+    def test_decode_body(self):
+        self.assert_same_features(decode_compact(self.body))
+
+    def test_to_feature_collection_round_trip(self):
+        collection = decode_compact(self.body).to_feature_collection()
+        self.assert_same_features(decode_compact(rapidjson.dumps(collection)))
+
+    def test_travel_times_and_ids_are_kept_as_answered(self):
+        feature = dict(self.features[0], id="12345")
+        feature["properties"] = dict(feature["properties"], travel_time=10.15)
+        arrays = decode_compact(rapidjson.dumps({"type": "FeatureCollection", "features": [feature]}))
+
+        self.assertEqual(10.15, arrays.to_feature_collection()["features"][0]["properties"]["travel_time"])
+        self.assertEqual("12345", arrays.to_feature_collection()["features"][0]["id"])
+        for feature_id in ("007", "A1", None):
+            with self.assertRaises(ValueError):
+                decode_compact(rapidjson.dumps({"type": "FeatureCollection",
+                                                "features": [dict(feature, id=feature_id)]}))
+
+    async def test_decode_stream(self):
+        arrays, body = await decode_compact_stream(FakeContent(self.body), keep_body=True)
+        self.assert_same_features(arrays)
+        self.assertEqual(body, self.body)
+
+    async def test_transfer_error_is_raised(self):
+        with self.assertRaises(ConnectionResetError):
+            await decode_compact_stream(FakeContent(self.body, fail_after=1))
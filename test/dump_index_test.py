@@ -0,0 +1,127 @@
+import os
+import tempfile
+
+import asynctest
+import rapidjson
+
+from src.config import TravelModes
+from src.decoding import decode_compact
+from src.dump_index import AccDumpReader, CellIndex, cell_index_path, index_path, merge_indexes
+from src.scheduler import ReachabilityJob
+from src.writer import ReachabilityWriter
+
+with open(os.path.join(os.getcwd(), "resources", "transit_reachability.geojson"), "rb") as resource_file:
+    REACHABILITY = resource_file.read()
+
+
+def job(origin_id) -> ReachabilityJob:
+    return ReachabilityJob(origin_id=origin_id, latitude=60.1, longitude=24.9, travel_mode=TravelModes.TRANSIT)
+
+
+def layer_within(threshold: float) -> dict:
+    reachability = rapidjson.loads(REACHABILITY)
+    reachability["features"] = [feature for feature in reachability["features"]
+                                if feature["properties"]["travel_time"] <= threshold]
+    return reachability
+
+
+class DumpIndexTest(asynctest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "reachability_transit.acc_dump")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    async def write(self, path, records, cell_index=False):
+        writer = ReachabilityWriter(flush_bytes=1, cell_index=cell_index)
+        for origin_id, record in records:
+            await writer.write(path, record, job(origin_id))
+        await writer.close()
+
+    async def test_layers_are_read_by_origin(self):
+        await self.write(self.path, [("a", layer_within(20)), ("b", REACHABILITY), ("c", decode_compact(REACHABILITY))])
+
+        with AccDumpReader(self.path) as reader:
+            self.assertEqual(3, len(reader))
+            self.assertIn("b", reader)
+            self.assertEqual(layer_within(20)["features"], reader.layer("a")["features"])
+            self.assertEqual("b", reader.layer("b", TravelModes.TRANSIT)["origin"]["origin_id"])
+            self.assertEqual(len(decode_compact(REACHABILITY).cell_ids),
+                             len(reader.layer("c", decode="compact").cell_ids))
+            self.assertEqual(["a", "b", "c"], [key[0] for key, _ in reader.layers()])
+            with self.assertRaises(KeyError):
+                reader.layer("d")
+
+    async def test_missing_or_stale_index_is_rebuilt(self):
+        await self.write(self.path, [("a", layer_within(20)), ("b", layer_within(30))])
+        os.remove(index_path(self.path))
+        with AccDumpReader(self.path) as reader:
+            self.assertEqual(["a", "b"], sorted(origin_id for origin_id, _ in reader.keys()))
+        self.assertTrue(os.path.exists(index_path(self.path)))
+
+        # layers appended without the index, e.g. by a run killed between the two writes
+        with open(self.path, "ab") as dump:
+            dump.write(rapidjson.dumps(dict(layer_within(10), origin={"origin_id": "c", "travel_mode": "transit"}))
+                       .encode("utf-8") + b"\n")
+        with AccDumpReader(self.path) as reader:
+            self.assertEqual(len(layer_within(10)["features"]), len(reader.layer("c")["features"]))
+            self.assertEqual(layer_within(30)["features"], reader.layer("b")["features"])
+
+        # the dump was replaced by a shorter one, the index points past its end
+        open(self.path, "w").close()
+        await self.write(self.path, [("d", layer_within(10))])
+        with open(index_path(self.path), "ab") as index_file:
+            index_file.write(b'["a","transit",100000000,10]\n')
+        with AccDumpReader(self.path) as reader:
+            self.assertEqual([("d", "transit")], reader.keys())
+
+    async def test_index_cut_by_a_crash_is_repaired(self):
+        await self.write(self.path, [("a", layer_within(20)), ("b", layer_within(30)), ("c", layer_within(10))])
+        with open(index_path(self.path), "rb") as index_file:
+            complete = index_file.read()
+        with open(index_path(self.path), "wb") as index_file:
+            index_file.write(complete[:-7])
+
+        for _ in range(2):
+            with AccDumpReader(self.path) as reader:
+                self.assertEqual(["a", "b", "c"], [key[0] for key, _ in reader.layers()])
+                self.assertEqual(len(layer_within(10)["features"]), len(reader.layer("c")["features"]))
+            with open(index_path(self.path), "rb") as index_file:
+                self.assertEqual(complete, index_file.read())
+
+    async def test_cell_index(self):
+        await self.write(self.path, [("a", layer_within(20)), ("b", REACHABILITY)], cell_index=True)
+        feature = layer_within(20)["features"][0]
+
+        index = CellIndex(cell_index_path(self.path))
+        origins = index.origins(int(feature["id"]))
+        self.assertEqual(["a", "b"], sorted(origin_id for origin_id, _, _ in origins))
+        self.assertEqual(feature["properties"]["travel_time"], origins[0][2])
+        self.assertEqual([], index.origins(int(feature["id"]), max_travel_time=-1))
+        index.close()
+
+        os.remove(cell_index_path(self.path))
+        built = CellIndex.build(self.path)
+        self.assertEqual(origins, built.origins(int(feature["id"])))
+        built.close()
+
+    async def test_merged_dumps(self):
+        first = os.path.join(self.folder.name, "first.acc_dump")
+        second = os.path.join(self.folder.name, "second.acc_dump")
+        await self.write(first, [("a", layer_within(20))], cell_index=True)
+        await self.write(second, [("b", layer_within(30)), ("c", layer_within(10))], cell_index=True)
+        with open(self.path, "wb") as target:
+            for path in (first, second):
+                with open(path, "rb") as source:
+                    target.write(source.read())
+
+        merge_indexes([first, second], self.path)
+
+        with AccDumpReader(self.path) as reader:
+            self.assertEqual(len(layer_within(10)["features"]), len(reader.layer("c")["features"]))
+            self.assertEqual("a", reader.layer("a")["origin"]["origin_id"])
+        index = CellIndex(cell_index_path(self.path))
+        self.assertEqual(["a", "b", "c"], sorted(origin_id for origin_id, _, _ in
+                                                 index.origins(int(layer_within(10)["features"][0]["id"]))))
+        index.close()
@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import rapidjson
+
+from src.entry_points import read_entry_points
+
+FEATURES = [
+    {"type": "Feature", "properties": {"id": 7, "name": "Uimahalli"},
+     "geometry": {"type": "Point", "coordinates": [24.93, 60.17]}},
+    {"type": "Feature", "properties": {"name": "Kenttä"},
+     "geometry": {"type": "Polygon", "coordinates": [[[25.0, 60.0], [25.2, 60.0], [25.2, 60.2], [25.0, 60.2],
+                                                      [25.0, 60.0]]]}},
+    {"type": "Feature", "properties": {"id": "no geometry"}, "geometry": None},
+    {"type": "Feature", "properties": None, "geometry": {"type": "Point", "coordinates": [25, 61, 12.5]}},
+]
+
+
+class EntryPointsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def check(self, entry_points):
+        self.assertEqual(3, len(entry_points))
+        self.assertEqual(1, entry_points.skipped)
+        (first_id, longitude, latitude), (second_id, polygon_x, polygon_y), (third_id, x, y) = list(entry_points)
+        self.assertEqual((7, 24.93, 60.17), (first_id, longitude, latitude))
+        self.assertIsNone(second_id)
+        self.assertTrue(25.0 < polygon_x < 25.2 and 60.0 < polygon_y < 60.2)
+        self.assertEqual((None, 25.0, 61.0), (third_id, x, y))
+        self.assertIsInstance(x, float)
+
+    def test_feature_collection_read_in_chunks(self):
+        path = os.path.join(self.folder.name, "pois.geojson")
+        with open(path, "w") as pois_file:
+            pois_file.write(rapidjson.dumps({"type": "FeatureCollection", "name": "pois", "features": FEATURES}))
+
+        self.check(read_entry_points(path, chunk_size=16))
+
+    def test_newline_delimited_features(self):
+        path = os.path.join(self.folder.name, "pois.geojsonl")
+        with open(path, "w") as pois_file:
+            for feature in FEATURES:
+                pois_file.write(rapidjson.dumps(feature) + "\n\n")
+
+        self.check(read_entry_points(path))
+
+    def test_points_need_neither_geopandas_nor_shapely(self):
+        script = "import sys, main; from src.entry_points import read_entry_points; " \
+                 "entry_points = read_entry_points('resources/pois.geojson'); " \
+                 "print(len(entry_points), sorted({name.split('.')[0] for name in sys.modules} & " \
+                 "{'geopandas', 'shapely', 'pandas'}))"
+        output = subprocess.run([sys.executable, "-c", script], cwd=os.getcwd(), check=True, capture_output=True,
+                                text=True).stdout
+
+        self.assertEqual("18 []", output.strip())
@@ -0,0 +1,55 @@
+import random
+import unittest
+
+import asynctest
+
+from benchmarks.fake_mapple_server import FakeMappleAPI, Latency, start_server
+from src.mapple_api import MappleClient
+from src.rate_limiter import RateLimiter
+from src.retry import RetryPolicy
+
+EMPTY_REACHABILITY = b'{"type": "FeatureCollection", "features": []}'
+
+
+class LatencyTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(0.0, Latency.parse(None).sample(random.Random(0)))
+        self.assertEqual(0.05, Latency.parse("constant:0.05").sample(random.Random(0)))
+        delay = Latency.parse("uniform:0.01:0.02").sample(random.Random(0))
+        self.assertTrue(0.01 <= delay <= 0.02)
+        self.assertGreater(Latency.parse("lognormal:0.05:0.5").sample(random.Random(0)), 0)
+        with self.assertRaises(ValueError):
+            Latency.parse("gamma:1:2")
+
+
+class FakeMappleAPITest(asynctest.TestCase):
+    async def test_client_retries_injected_errors(self):
+        api = FakeMappleAPI(EMPTY_REACHABILITY, error_rate=0.5, seed=1)
+        runner, url = await start_server(api)
+        try:
+            async with MappleClient(base_url=url, api_key="key",
+                                    retry_policy=RetryPolicy(max_attempts=10, base_delay=0.01)) as client:
+                for _ in range(5):
+                    reachability = await client.fetch_walking_reachability(latitude=60.1, longitude=24.9)
+                    self.assertEqual([], reachability["features"])
+        finally:
+            await runner.cleanup()
+
+        self.assertEqual(5, api.statuses[200])
+        self.assertGreater(api.requests, 5)
+        self.assertEqual(5, len(api.latencies))
+        self.assertEqual(5 * len(EMPTY_REACHABILITY), api.bytes_sent)
+
+    async def test_quota_is_answered_with_retry_after(self):
+        api = FakeMappleAPI(EMPTY_REACHABILITY, quota=2, quota_window=0.5)
+        runner, url = await start_server(api)
+        try:
+            async with MappleClient(base_url=url, api_key="key", rate_limiter=RateLimiter(rate=100, burst=3),
+                                    retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01)) as client:
+                for _ in range(3):
+                    await client.fetch_walking_reachability(latitude=60.1, longitude=24.9)
+        finally:
+            await runner.cleanup()
+
+        self.assertEqual(3, api.statuses[200])
+        self.assertEqual(1, api.statuses[429])
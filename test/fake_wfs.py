@@ -0,0 +1,73 @@
+"""
+Local stand-in of the LIPAS GeoServer WFS for the tests: GetFeature with bbox filtering, count/startIndex paging
+and ETag revalidation. Like a database without an ORDER BY, the features come in a different order on every request
+unless sortBy is given.
+"""
+from typing import Dict, List
+
+import rapidjson
+from aiohttp import web
+
+
+def point_features(count: int, x: float = 435000.0, y: float = 6900000.0, step: float = 100.0) -> List[dict]:
+    return [{
+        "type": "Feature",
+        "id": "lipas_1180_frisbeegolf_rata.{index}".format(index=index),
+        "geometry": {"type": "Point", "coordinates": [x + index * step, y]},
+        "properties": {"id": index, "nimi_fi": "Rata {index}".format(index=index), "vapaa_kaytto": index % 2 == 0}
+    } for index in range(count)]
+
+
+class FakeWFS:
+    def __init__(self, layers: Dict[str, List[dict]]):
+        self.layers = layers
+        self.version = 1
+        self.requests: List[dict] = []
+        self.not_modified = 0
+
+    @property
+    def etag(self) -> str:
+        return '"v{version}"'.format(version=self.version)
+
+    async def get_feature(self, request: web.Request):
+        params = request.query
+        self.requests.append(dict(params))
+        if request.headers.get("If-None-Match") == self.etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={"ETag": self.etag})
+        if params.get("typeNames") not in self.layers:
+            # GeoServer answers errors as XML
+            return web.Response(text="<ows:ExceptionReport>Unknown type</ows:ExceptionReport>",
+                                content_type="application/xml")
+        features = self.layers[params["typeNames"]]
+        if "bbox" in params:
+            min_x, min_y, max_x, max_y = [float(value) for value in params["bbox"].split(",")[:4]]
+            features = [feature for feature in features
+                        if min_x <= feature["geometry"]["coordinates"][0] <= max_x
+                        and min_y <= feature["geometry"]["coordinates"][1] <= max_y]
+        if "sortBy" in params:
+            name, _, direction = params["sortBy"].partition(" ")
+            features = sorted(features, key=lambda feature: feature["properties"][name],
+                              reverse=direction.upper() in ("DESC", "D"))
+        else:
+            shift = len(self.requests) % max(1, len(features))
+            features = features[shift:] + features[:shift]
+        matched = len(features)
+        if "count" in params:
+            start = int(params.get("startIndex", 0))
+            features = features[start:start + int(params["count"])]
+        body = {"type": "FeatureCollection", "features": features, "totalFeatures": matched,
+                "numberMatched": matched, "numberReturned": len(features)}
+        return web.Response(body=rapidjson.dumps(body).encode("utf-8"), content_type="application/json",
+                            headers={"ETag": self.etag})
+
+
+async def start_wfs(wfs: FakeWFS, host: str = "127.0.0.1"):
+    app = web.Application()
+    app.router.add_get("/geoserver/lipas/ows", wfs.get_feature)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, "http://{host}:{port}/geoserver/lipas/ows".format(host=host, port=port)
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+
+import geopandas
+import numpy
+import pandas
+from shapely.geometry import box
+
+from src.grid import CellGridMapping, accessibility_metrics, attribute_grid
+
+
+class CellGridMappingTest(unittest.TestCase):
+    def setUp(self):
+        # a 3 x 3 population grid of 250 m cells (ETRS-TM35FIN), one Mapple cell in the middle of each grid cell
+        # and one more cell outside of the grid
+        squares = [box(384750 + 250 * column, 6691750 + 250 * row, 385000 + 250 * column, 6692000 + 250 * row)
+                   for row in range(3) for column in range(3)]
+        self.grid = geopandas.GeoDataFrame({"he_vakiy": [10, 20, 30, 40, 50, 60, 70, 80, 90],
+                                            "grd_id": ["g{}".format(index) for index in range(9)]},
+                                           geometry=squares, crs="EPSG:3067")
+        centers = geopandas.GeoSeries([square.centroid for square in squares] +
+                                      [box(390000, 6691750, 390250, 6692000).centroid], crs="EPSG:3067")
+        self.cells = geopandas.GeoDataFrame({"id": [str(5280000 + index) for index in range(10)],
+                                             "travel_time": [4.0, 8.0, 12.0, 16.0, 20.0, 25.0, 29.0, 35.0, 40.0,
+                                                             1.0]},
+                                            geometry=centers.to_crs("EPSG:4326"))
+
+    def test_attribution_matches_sjoin(self):
+        mapping = CellGridMapping()
+        self.assertEqual(10, mapping.extend(self.cells["id"], self.cells.geometry, self.grid))
+        self.assertEqual(0, mapping.extend(self.cells["id"], self.cells.geometry, self.grid))
+
+        joined = attribute_grid(self.cells, self.grid, mapping)
+        expected = geopandas.sjoin(self.cells, self.grid.to_crs(self.cells.crs), how="inner", op="intersects")
+        self.assertEqual(list(expected["id"]), list(joined["id"]))
+        self.assertEqual(list(expected["grd_id"]), list(joined["grd_id"]))
+        self.assertEqual(list(expected["index_right"]), list(joined["index_right"]))
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "cells.npz")
+            mapping.save(path)
+            loaded = CellGridMapping.load(path)
+        self.assertEqual(list(mapping.rows(self.cells["id"])), list(loaded.rows(self.cells["id"])))
+        self.assertEqual(9, loaded.grid_size)
+        self.assertEqual([5280010], list(loaded.missing(numpy.array([5280001, 5280010]))))
+
+    def test_population_per_time_band(self):
+        mapping = CellGridMapping()
+        mapping.extend(self.cells["id"], self.cells.geometry, self.grid)
+        # a second facility reaching the last grid cell faster
+        other = pandas.DataFrame({"id": ["5280008"], "travel_time": [3.0]})
+        layers = {("disc_golf", "walking"): self.cells, ("disc_golf", "cycling"): pandas.concat([self.cells, other])}
+
+        metrics = accessibility_metrics(layers, mapping, self.grid["he_vakiy"], bands=[5, 10, 30])
+
+        walking = metrics[metrics["travel_mode"] == "walking"]
+        self.assertEqual([10, 30, 280], list(walking["population"]))
+        self.assertAlmostEqual(280 / 450, walking["share"].iloc[-1])
+        cycling = metrics[metrics["travel_mode"] == "cycling"]
+        self.assertEqual([100, 120, 370], list(cycling["population"]))
@@ -0,0 +1,76 @@
+import tempfile
+
+import asynctest
+from starlette.exceptions import HTTPException
+
+from src.lipas import LipasClient, LipasLayer, WFSCache, getfeature_params
+from test.fake_wfs import FakeWFS, point_features, start_wfs
+
+DISC_GOLF = LipasLayer("1180", "frisbeegolf_rata")
+FITNESS_CENTERS = LipasLayer("2120", "kuntosali")
+
+
+class LipasClientTest(asynctest.TestCase):
+    async def setUp(self):
+        self.wfs = FakeWFS({DISC_GOLF.type_name: point_features(25),
+                            FITNESS_CENTERS.type_name: point_features(3, y=6910000.0)})
+        self.runner, self.url = await start_wfs(self.wfs)
+        self.folder = tempfile.TemporaryDirectory()
+        self.cache = WFSCache(self.folder.name)
+
+    async def tearDown(self):
+        self.cache.close()
+        self.folder.cleanup()
+        await self.runner.cleanup()
+
+    def test_bbox_is_not_combined_with_a_cql_filter(self):
+        params = getfeature_params(DISC_GOLF.type_name, bbox=(1, 2, 3, 4), cql_filter="BBOX(the_geom,1,2,3,4)")
+        self.assertNotIn("bbox", params)
+        self.assertEqual("1,2,3,4,EPSG:3067", getfeature_params(DISC_GOLF.type_name, bbox=(1, 2, 3, 4))["bbox"])
+
+    async def test_layers_are_paged_and_filtered(self):
+        async with LipasClient(self.url, page_size=10) as client:
+            collections = await client.fetch_layers([DISC_GOLF, FITNESS_CENTERS],
+                                                    bbox=(435000.0, 6890000.0, 436000.0, 6905000.0))
+
+        self.assertEqual(list(range(11)),
+                         [feature["properties"]["id"] for feature in collections[DISC_GOLF]["features"]])
+        self.assertEqual([], collections[FITNESS_CENTERS]["features"])
+        self.assertEqual(["0", "10"], [params["startIndex"] for params in self.wfs.requests
+                                       if params["typeNames"] == DISC_GOLF.type_name])
+        self.assertTrue(all(params["sortBy"] == "id ASC" for params in self.wfs.requests))
+
+    async def test_cached_pages_are_revalidated(self):
+        async with LipasClient(self.url, page_size=10, cache=self.cache) as client:
+            first = await client.fetch_features(DISC_GOLF.type_name)
+        self.assertEqual(list(range(25)), [feature["properties"]["id"] for feature in first["features"]])
+        self.assertEqual(3, len(self.wfs.requests))
+
+        # fresh entries are used without asking the server
+        async with LipasClient(self.url, page_size=10, cache=self.cache) as client:
+            self.assertEqual(first, await client.fetch_features(DISC_GOLF.type_name))
+        self.assertEqual(3, len(self.wfs.requests))
+
+        # stale entries are revalidated, and kept when the layer did not change
+        async with LipasClient(self.url, page_size=10, cache=self.cache, max_age=0) as client:
+            self.assertEqual(first, await client.fetch_features(DISC_GOLF.type_name))
+        self.assertEqual(3, self.wfs.not_modified)
+
+        self.wfs.version += 1
+        self.wfs.layers[DISC_GOLF.type_name] = point_features(5)
+        async with LipasClient(self.url, page_size=10, cache=self.cache, max_age=0) as client:
+            self.assertEqual(5, len((await client.fetch_features(DISC_GOLF.type_name))["features"]))
+
+    async def test_geoserver_errors_are_raised(self):
+        async with LipasClient(self.url) as client:
+            with self.assertRaises(HTTPException) as context:
+                await client.fetch_features("lipas:lipas_0000_unknown")
+        self.assertEqual(500, context.exception.status_code)
+
+    async def test_unreachable_server_is_raised(self):
+        await self.runner.cleanup()
+        async with LipasClient(self.url) as client:
+            with self.assertRaises(HTTPException) as context:
+                await client.fetch_features(DISC_GOLF.type_name)
+        self.assertEqual(500, context.exception.status_code)
+        self.assertEqual("LIPAS WFS server not reached", context.exception.detail)
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+import asynctest
+import rapidjson
+from asynctest.mock import patch
+
+import main
+from src.config import TimeOfDay, TravelModes
+from src.manifest import RunManifest, job_key
+from src.scheduler import ReachabilityJob
+from src.sweep import SweepPlan
+
+with open(os.path.join(os.getcwd(), "resources", "transit_reachability.geojson"), "rb") as resource_file:
+    REACHABILITY = resource_file.read()
+
+
+class RunManifestTest(unittest.TestCase):
+    def test_completed_jobs_are_keyed_by_parameters(self):
+        job = ReachabilityJob(origin_id="1180.42", latitude=62.2, longitude=25.7, travel_mode=TravelModes.TRANSIT)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "reachability_manifest.sqlite")
+            manifest = RunManifest(path)
+            manifest.mark_completed(job)
+            manifest.close()
+
+            manifest = RunManifest(path)
+            completed = manifest.completed_keys()
+            self.assertIn(job_key(job), completed)
+            self.assertNotIn(job_key(job._replace(maxTimeThreshold=60)), completed)
+            self.assertNotIn(job_key(job._replace(timeOfDay=TimeOfDay.MIDDAY)), completed)
+            self.assertNotIn(job_key(job._replace(travel_mode=TravelModes.DRIVING)), completed)
+
+            manifest.clear()
+            self.assertEqual(set(), manifest.completed_keys())
+            manifest.close()
+
+    def test_origins_are_recorded_with_their_coordinates(self):
+        job = ReachabilityJob(origin_id="1180.42", latitude=62.2, longitude=25.7, travel_mode=TravelModes.TRANSIT)
+
+        with tempfile.TemporaryDirectory() as folder:
+            manifest = RunManifest(os.path.join(folder, "reachability_manifest.sqlite"))
+            manifest.mark_completed_many([job, job._replace(travel_mode=TravelModes.WALKING),
+                                          job._replace(origin_id="1180.43", latitude=62.3)])
+            self.assertEqual({"1180.42": (25.7, 62.2), "1180.43": (25.7, 62.3)}, manifest.origins())
+
+            manifest.remove_origins(["1180.42"])
+            self.assertEqual({"1180.43"}, {key[0] for key in manifest.completed_keys()})
+            self.assertEqual(["1180.43"], list(manifest.origins()))
+            manifest.close()
+
+
+class ResumeProgressTest(asynctest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.pois = os.path.join(self.folder.name, "pois.geojsonl")
+        with open(os.path.join(os.getcwd(), "resources", "pois.geojson")) as pois_file, open(self.pois, "w") as target:
+            for feature in rapidjson.loads(pois_file.read())["features"][:3]:
+                target.write(rapidjson.dumps(feature) + "\n")
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    async def resumed_total(self, **options) -> int:
+        with patch('main.ProgressBar') as progress_bar:
+            self.assertTrue(await main.main(self.pois, output_folder=self.folder.name, rate=1000, burst=100,
+                                            resume=True, progress=True, **options))
+        return progress_bar.call_args[0][0]
+
+    @patch('src.mapple_api.fetch_body')
+    async def test_only_the_planned_jobs_are_taken_off_the_total(self, fetch_body):
+        fetch_body.return_value = REACHABILITY
+        self.assertTrue(await main.main(self.pois, output_folder=self.folder.name, travel_mode=["walking", "transit"],
+                                        rate=1000, burst=100))
+
+        # the transit jobs of the previous run are not part of this one
+        self.assertEqual(3, await self.resumed_total(travel_mode=["walking", "cycling"]))
+
+        plan = SweepPlan.grid([15, 30])
+        self.assertTrue(await main.main(self.pois, output_folder=self.folder.name, travel_mode=["walking"],
+                                        rate=1000, burst=100, resume=True, sweep=plan))
+        self.assertEqual(3, await self.resumed_total(travel_mode=["walking", "transit"], sweep=plan))
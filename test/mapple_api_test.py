@@ -1,14 +1,20 @@
 import asyncio
 import json
 import os
+import tempfile
 
+import aiohttp
 import asynctest
 import geopandas
 import pandas
 from asynctest.mock import patch
 
+from benchmarks.fake_mapple_server import FakeMappleAPI, Latency, start_server
 from src.config import WalkingSpeeds, TimeOfDay, TimeProfile
-from src.mapple_api import fetch_transit_reachability
+from src.mapple_api import fetch_body, fetch_transit_reachability, MappleClient, MappleAPIException
+from src.rate_limiter import RateLimiter
+from src.response_cache import ResponseCache
+from src.retry import RetryPolicy
 
 
 class MappleAPITest(asynctest.TestCase):
@@ -61,3 +67,117 @@ class MappleAPITest(asynctest.TestCase):
             # with open(target_file_path, "a") as target_file:
             #     temp = [target_file.write("{}\n".format(json.dumps(reachability))) for reachability in
             #             transit_reachability]
+
+
+EMPTY_REACHABILITY = b'{"type": "FeatureCollection", "features": []}'
+
+
+class MappleClientTest(asynctest.TestCase):
+    def setUp(self):
+        self.mapple_url = "http://localhost:8000"
+
+    @patch('src.mapple_api.fetch_body')
+    async def test_fetch_reachability_shares_session(self, fetch_body):
+        fetch_body.return_value = EMPTY_REACHABILITY
+
+        async with MappleClient(base_url=self.mapple_url, api_key="key") as client:
+            await client.fetch_walking_reachability(latitude=60.1, longitude=24.9)
+            await client.fetch_transit_reachability(latitude=60.1, longitude=24.9, timeOfDay=TimeOfDay.MIDDAY)
+
+            self.assertEqual(2, fetch_body.call_count)
+            walking_call, transit_call = fetch_body.call_args_list
+            self.assertEqual("http://localhost:8000/fi/reachability/travelTime/walking/1", walking_call[1]["url"])
+            self.assertEqual("http://localhost:8000/fi/reachability/travelTime/transit/1", transit_call[1]["url"])
+            self.assertEqual("midday", transit_call[1]["params"]["timeOfDay"])
+            self.assertEqual({"ApiKey": "key"}, walking_call[1]["headers"])
+            self.assertIs(walking_call[1]["session"], transit_call[1]["session"])
+
+        self.assertTrue(walking_call[1]["session"].closed)
+
+    @patch('src.mapple_api.fetch_body')
+    async def test_fetch_reachability_retries_throttled_requests(self, fetch_body):
+        fetch_body.side_effect = [MappleAPIException(status_code=429, detail="Too Many Requests", retry_after=0.01),
+                                  EMPTY_REACHABILITY]
+        rate_limiter = RateLimiter(rate=100, burst=1)
+
+        async with MappleClient(base_url=self.mapple_url, api_key="key", rate_limiter=rate_limiter) as client:
+            reachability = await client.fetch_cycling_reachability(latitude=60.1, longitude=24.9)
+
+        self.assertEqual([], reachability["features"])
+        self.assertEqual(2, fetch_body.call_count)
+        self.assertLess(rate_limiter.current_rate, 100)
+
+    @patch('src.mapple_api.fetch_body')
+    async def test_fetch_reachability_retries_server_errors(self, fetch_body):
+        fetch_body.side_effect = [MappleAPIException(status_code=503, detail="Service Unavailable"),
+                                  MappleAPIException(status_code=500, detail="Mapple API server not reached"),
+                                  EMPTY_REACHABILITY]
+
+        async with MappleClient(base_url=self.mapple_url, api_key="key",
+                                retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01)) as client:
+            reachability = await client.fetch_driving_reachability(latitude=60.1, longitude=24.9)
+
+        self.assertEqual([], reachability["features"])
+        self.assertEqual(3, fetch_body.call_count)
+
+    @patch('src.mapple_api.fetch_body')
+    async def test_fetch_reachability_does_not_retry_client_errors(self, fetch_body):
+        fetch_body.side_effect = MappleAPIException(status_code=422, detail="Unprocessable Entity")
+
+        async with MappleClient(base_url=self.mapple_url, api_key="key",
+                                retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01)) as client:
+            with self.assertRaises(MappleAPIException) as context:
+                await client.fetch_walking_reachability(latitude=60.1, longitude=24.9)
+
+        self.assertEqual(1, fetch_body.call_count)
+        self.assertEqual(1, context.exception.attempts)
+
+    @patch('src.mapple_api.fetch_body')
+    async def test_cached_responses_skip_the_api(self, fetch_body):
+        fetch_body.return_value = EMPTY_REACHABILITY
+        rate_limiter = RateLimiter(rate=100, burst=1)
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResponseCache(cache_dir)
+            async with MappleClient(base_url=self.mapple_url, api_key="key", rate_limiter=rate_limiter,
+                                    cache=cache) as client:
+                first = await client.fetch_walking_reachability(latitude=60.1681411, longitude=24.9306796)
+                # the same point read from another layer, with more decimals
+                second = await client.fetch_walking_reachability(latitude=60.16814112, longitude=24.93067961)
+                await client.fetch_walking_reachability(latitude=60.1681411, longitude=24.9306796, radius=5000)
+            cache.close()
+
+        self.assertEqual(first, second)
+        self.assertEqual(2, fetch_body.call_count)
+        self.assertEqual(1, cache.hits)
+
+
+class FetchBodyErrorsTest(asynctest.TestCase):
+    async def test_only_connection_errors_are_reported_as_unreachable(self):
+        api = FakeMappleAPI(EMPTY_REACHABILITY, latency=Latency("constant", 0.5))
+        runner, url = await start_server(api)
+        try:
+            async def broken_read(response):
+                raise RuntimeError("bug in the reader")
+
+            async with aiohttp.ClientSession() as session:
+                with self.assertRaises(RuntimeError):
+                    await fetch_body(url + "/fi/reachability/travelTime/walking/1", {}, {}, session=session,
+                                     read=broken_read)
+
+            async with MappleClient(base_url=url, api_key="key", total_timeout=0.05,
+                                    retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01)) as client:
+                with self.assertRaises(MappleAPIException) as context:
+                    await client.fetch_walking_reachability(latitude=60.1, longitude=24.9)
+            # a timeout is not retried
+            self.assertEqual(408, context.exception.status_code)
+            self.assertEqual(1, context.exception.attempts)
+        finally:
+            await runner.cleanup()
+
+        async with MappleClient(base_url=url, api_key="key",
+                                retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01)) as client:
+            with self.assertRaises(MappleAPIException) as context:
+                await client.fetch_walking_reachability(latitude=60.1, longitude=24.9)
+        self.assertEqual(500, context.exception.status_code)
+        self.assertEqual(2, context.exception.attempts)
@@ -0,0 +1,103 @@
+import io
+import os
+import tempfile
+import unittest
+
+import asynctest
+from asynctest.mock import patch
+
+from src.mapple_api import MappleAPIException, MappleClient
+from src.metrics import Histogram, RunMetrics
+from src.progress import ProgressBar, format_duration
+from src.retry import RetryPolicy
+
+EMPTY_REACHABILITY = b'{"type": "FeatureCollection", "features": []}'
+
+
+class HistogramTest(unittest.TestCase):
+    def test_quantiles_are_interpolated_in_their_bucket(self):
+        histogram = Histogram(buckets=(1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+
+        self.assertEqual([1, 2, 1, 1], histogram.counts)
+        self.assertEqual(5, histogram.count)
+        self.assertAlmostEqual(16.5, histogram.sum)
+        self.assertAlmostEqual(1.75, histogram.quantile(0.5))
+        # values above the last bucket are reported at its bound
+        self.assertEqual(4, histogram.quantile(0.99))
+        self.assertIsNone(Histogram().quantile(0.5))
+
+
+class RunMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.metrics = RunMetrics()
+        self.metrics.increment("requests_total", travel_mode="walking", status=200)
+        self.metrics.increment("requests_total", travel_mode="walking", status=429)
+        self.metrics.increment("requests_total", travel_mode="transit", status=200)
+        self.metrics.observe("request_seconds", 0.2, travel_mode="walking")
+        self.metrics.observe("payload_bytes", 3000, travel_mode="walking")
+        self.metrics.sample("in_flight", 3)
+        self.metrics.sample("in_flight", 1)
+        self.metrics.finish()
+
+    def test_counters_are_summed_over_the_missing_labels(self):
+        self.assertEqual(3, self.metrics.counter("requests_total"))
+        self.assertEqual(2, self.metrics.counter("requests_total", status=200))
+        self.assertEqual(1, self.metrics.counter("requests_total", travel_mode="walking", status=429))
+        self.assertEqual(["transit", "walking"], self.metrics.label_values("travel_mode"))
+
+    def test_json_round_trip_and_merge(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "metrics.json")
+            self.metrics.write(path)
+            loaded = RunMetrics.load(path)
+
+        self.assertEqual(self.metrics.to_dict(), loaded.to_dict())
+        loaded.merge(self.metrics)
+        self.assertEqual(6, loaded.counter("requests_total"))
+        self.assertEqual(2, loaded.histogram("request_seconds").count)
+        self.assertEqual(6, loaded.gauges[("in_flight", ())].max)
+
+    def test_prometheus_text(self):
+        text = self.metrics.to_prometheus()
+
+        self.assertIn("# TYPE mapple_fetch_requests_total counter", text)
+        self.assertIn('mapple_fetch_requests_total{status="429",travel_mode="walking"} 1', text)
+        self.assertIn('mapple_fetch_request_seconds_bucket{travel_mode="walking",le="0.25"} 1', text)
+        self.assertIn('mapple_fetch_request_seconds_bucket{travel_mode="walking",le="+Inf"} 1', text)
+        self.assertIn('mapple_fetch_payload_bytes_count{travel_mode="walking"} 1', text)
+        self.assertIn("mapple_fetch_in_flight_max 3", text)
+
+
+class ProgressBarTest(unittest.TestCase):
+    def test_format(self):
+        stream = io.StringIO()
+        progress_bar = ProgressBar(4, stream=stream, width=4)
+        progress_bar.advance()
+        progress_bar.advance(failed=True, details="in flight 2")
+        progress_bar.close()
+
+        line = stream.getvalue().splitlines()[-1]
+        self.assertTrue(line.startswith("[##..] 2/4  50%"))
+        self.assertTrue(line.endswith("failed 1 in flight 2"))
+        self.assertEqual("1:01:05", format_duration(3665))
+        self.assertEqual("--:--", format_duration(None))
+
+
+class MappleClientMetricsTest(asynctest.TestCase):
+    @patch('src.mapple_api.fetch_body')
+    async def test_attempts_and_retries_are_recorded(self, fetch_body):
+        fetch_body.side_effect = [MappleAPIException(status_code=503, detail="Service Unavailable"),
+                                  EMPTY_REACHABILITY]
+        metrics = RunMetrics()
+
+        async with MappleClient(base_url="http://localhost:8000", api_key="key", metrics=metrics,
+                                retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01)) as client:
+            await client.fetch_transit_reachability(latitude=60.1, longitude=24.9)
+
+        self.assertEqual(1, metrics.counter("requests_total", travel_mode="transit", status=503))
+        self.assertEqual(1, metrics.counter("requests_total", travel_mode="transit", status=200))
+        self.assertEqual(1, metrics.counter("retries_total", travel_mode="transit"))
+        self.assertEqual(2, metrics.histogram("request_seconds", travel_mode="transit").count)
+        self.assertEqual(1, metrics.histogram("decode_seconds", travel_mode="transit").count)
@@ -0,0 +1,41 @@
+import time
+
+import asynctest
+
+from src.rate_limiter import RateLimiter, parse_retry_after
+
+
+class RateLimiterTest(asynctest.TestCase):
+    async def test_burst_then_rate(self):
+        limiter = RateLimiter(rate=50, burst=5)
+
+        start = time.monotonic()
+        for _ in range(5):
+            await limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.05)
+
+        for _ in range(5):
+            await limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 5 / 50 * 0.9)
+
+    async def test_penalize_backs_off_and_reward_recovers(self):
+        limiter = RateLimiter(rate=100, burst=1, recovery=0.25)
+
+        limiter.penalize(retry_after=0.1)
+        self.assertEqual(50, limiter.current_rate)
+
+        start = time.monotonic()
+        await limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+        limiter.reward()
+        limiter.reward()
+        self.assertEqual(100, limiter.current_rate)
+        limiter.reward()
+        self.assertEqual(100, limiter.current_rate)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(3.0, parse_retry_after("3"))
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertEqual(0.0, parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"))
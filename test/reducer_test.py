@@ -0,0 +1,92 @@
+import copy
+import os
+import tempfile
+
+import asynctest
+import rapidjson
+
+from src.config import TravelModes
+from src.reducer import NearestFacilityReducer, layer_files, reduce_layers
+from src.scheduler import ReachabilityJob
+from src.writer import ReachabilityWriter
+
+
+class NearestFacilityReducerTest(asynctest.TestCase):
+    def setUp(self):
+        with open(os.path.join(os.getcwd(), "resources", "transit_reachability.geojson")) as resource_file:
+            self.reachability = rapidjson.loads(resource_file.read())
+        # a second facility that is five minutes closer to every other cell, and five minutes further from the rest
+        self.other_reachability = copy.deepcopy(self.reachability)
+        for index, feature in enumerate(self.other_reachability["features"]):
+            feature["properties"]["travel_time"] += -5 if index % 2 else 5
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def job(self, origin_id):
+        return ReachabilityJob(origin_id=origin_id, latitude=60.0, longitude=24.0, travel_mode=TravelModes.TRANSIT)
+
+    def assert_nearest(self, reducer):
+        self.assertEqual(len(self.reachability["features"]), len(reducer))
+        nearest = {cell_id: (travel_time, origin_id) for cell_id, travel_time, origin_id in reducer.nearest()}
+        for index, feature in enumerate(self.reachability["features"]):
+            travel_time = feature["properties"]["travel_time"]
+            expected = (travel_time - 5, "b") if index % 2 else (travel_time, "a")
+            self.assertEqual(expected, nearest[int(feature["id"])])
+
+    async def test_reduces_dumped_layers_one_at_a_time(self):
+        writer = ReachabilityWriter()
+        dump_path = os.path.join(self.folder.name, "reachability_transit.acc_dump")
+        await writer.write(dump_path, self.reachability, self.job("a"))
+        await writer.write(dump_path, rapidjson.dumps(self.other_reachability).encode("utf-8"), self.job("b"))
+        await writer.close()
+        open(os.path.join(self.folder.name, "reachability_walking.acc_dump"), "w").close()
+
+        files = layer_files(self.folder.name, TravelModes.TRANSIT)
+        self.assertEqual([dump_path], files)
+        self.assert_nearest(reduce_layers(files))
+
+    async def test_reduces_while_writing(self):
+        reducer = NearestFacilityReducer()
+        writer = ReachabilityWriter(on_record=reducer.add_record)
+        dump_path = os.path.join(self.folder.name, "reachability_transit.acc_dump")
+        await writer.write(dump_path, self.other_reachability, self.job("b"))
+        await writer.write(dump_path, self.reachability, self.job("a"))
+        await writer.close()
+
+        self.assert_nearest(reducer)
+        gdf = reducer.to_geodataframe()
+        self.assertTrue(gdf["id"].is_unique)
+        self.assertEqual({"id", "geometry_id_1", "geometry_id_2", "geometry_id_3", "on_land", "travel_time",
+                          "origin_id", "geometry"}, set(gdf.columns))
+
+    def test_removed_origins_fall_back_to_the_kept_travel_times(self):
+        third_reachability = copy.deepcopy(self.reachability)
+        for feature in third_reachability["features"]:
+            feature["properties"]["travel_time"] += 1
+        for k in (1, 2):
+            reducer = NearestFacilityReducer(k=k)
+            reducer.add(self.reachability, origin_id="a")
+            reducer.add(self.other_reachability, origin_id="b")
+            reducer.add(third_reachability, origin_id="c")
+            state_path = os.path.join(self.folder.name, "state.json")
+            reducer.write_state(state_path)
+            reducer = NearestFacilityReducer.read_state(state_path)
+
+            exhausted = reducer.remove(["b"])
+            # with k = 2 every cell still knows a or c, with k = 1 the cells b was nearest to are recomputed
+            self.assertEqual(set() if k == 2 else {int(feature["id"]) for index, feature in
+                                                   enumerate(self.reachability["features"]) if index % 2}, exhausted)
+            reducer.refill(exhausted, [("a", self.reachability), ("c", third_reachability)])
+
+            self.assertEqual(len(self.reachability["features"]), len(reducer))
+            expected = {int(feature["id"]): (feature["properties"]["travel_time"], "a")
+                        for feature in self.reachability["features"]}
+            self.assertEqual(expected, {cell_id: (travel_time, origin_id)
+                                        for cell_id, travel_time, origin_id in reducer.nearest()})
+
+        # b and a are the two times kept for the cells b is nearest to, c reaches them too but was not kept
+        reducer = NearestFacilityReducer.read_state(state_path)
+        self.assertEqual({int(feature["id"]) for index, feature in enumerate(self.reachability["features"])
+                          if index % 2}, reducer.remove(["a", "b"]))
@@ -0,0 +1,97 @@
+import copy
+import os
+import tempfile
+import unittest
+
+import asynctest
+import rapidjson
+from asynctest.mock import patch
+
+import main
+from src.dump_index import AccDumpReader
+from src.refresh import diff_origins
+from src.reducer import nearest_path
+
+with open(os.path.join(os.getcwd(), "resources", "transit_reachability.geojson"), "rb") as resource_file:
+    REACHABILITY = rapidjson.loads(resource_file.read())
+
+
+def answer_by_location(url, params, headers, session=None, read=None):
+    # every facility reaches the cells in different times, so that the nearest one differs between cells
+    shift = int(float(params["latitude"]) * 1e4 + float(params["longitude"]) * 1e4)
+    reachability = copy.deepcopy(REACHABILITY)
+    for index, feature in enumerate(reachability["features"]):
+        feature["properties"]["travel_time"] += (index + shift) % 7
+    return rapidjson.dumps(reachability).encode("utf-8")
+
+
+def write_pois(path, features):
+    with open(path, "w") as pois_file:
+        for feature in features:
+            pois_file.write(rapidjson.dumps(feature) + "\n")
+
+
+def nearest(folder) -> dict:
+    with open(nearest_path(folder, "reachability", "walking")) as nearest_file:
+        return {feature["id"]: (feature["properties"]["travel_time"], feature["properties"]["origin_id"])
+                for feature in rapidjson.loads(nearest_file.read())["features"]}
+
+
+class DiffOriginsTest(unittest.TestCase):
+    def test_facilities_are_compared_by_id_and_coordinates(self):
+        previous = {"1": (25.0, 60.0), "2": (25.1, 60.1), "3": (25.2, 60.2), "4": None}
+        entry_points = [(1, 25.0, 60.0), (2, 25.1, 60.15), (4, 25.3, 60.3), (5, 25.4, 60.4), (1, 25.0, 60.0)]
+
+        diff = diff_origins(previous, entry_points)
+
+        self.assertEqual(["5"], diff.added)
+        self.assertEqual(["2", "4"], diff.moved)
+        self.assertEqual(["3"], diff.removed)
+        self.assertEqual(1, diff.unchanged)
+        self.assertEqual({"2", "3", "4"}, diff.dropped)
+
+
+class RefreshTest(asynctest.TestCase):
+    def setUp(self):
+        with open(os.path.join(os.getcwd(), "resources", "pois.geojson")) as pois_file:
+            self.features = rapidjson.loads(pois_file.read())["features"][:5]
+        for index, feature in enumerate(self.features):
+            feature["properties"]["id"] = 1000 + index
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    @patch('src.mapple_api.fetch_body')
+    async def test_only_new_and_moved_facilities_are_fetched(self, fetch_body):
+        fetch_body.side_effect = answer_by_location
+        pois = os.path.join(self.folder.name, "pois.geojsonl")
+        output = os.path.join(self.folder.name, "output")
+        options = dict(output_folder=output, travel_mode=["walking"], rate=1000, burst=100, nearest=True, nearest_k=2)
+        write_pois(pois, self.features)
+        self.assertTrue(await main.main(pois, **options))
+
+        # one facility removed, one moved and one added
+        moved = copy.deepcopy(self.features[1])
+        moved["geometry"]["coordinates"] = [moved["geometry"]["coordinates"][0] + 0.01,
+                                            moved["geometry"]["coordinates"][1]]
+        added = copy.deepcopy(self.features[2])
+        added["properties"]["id"] = 2000
+        added["geometry"]["coordinates"] = [added["geometry"]["coordinates"][0] - 0.02,
+                                            added["geometry"]["coordinates"][1]]
+        features = [moved] + self.features[2:] + [added]
+        write_pois(pois, features)
+        fetch_body.reset_mock()
+        self.assertTrue(await main.main(pois, refresh=True, **options))
+        self.assertEqual(2, fetch_body.call_count)
+
+        with AccDumpReader(main.output_file_path(output, "reachability", "walking")) as reader:
+            self.assertEqual(sorted(str(feature["properties"]["id"]) for feature in features),
+                             sorted(origin_id for origin_id, _ in reader.keys()))
+            self.assertEqual(moved["geometry"]["coordinates"], reader.origin("1001")["coordinates"])
+
+        # the same nearest facilities as a run over the new layer from scratch
+        rebuilt = os.path.join(self.folder.name, "rebuilt")
+        self.assertTrue(await main.main(pois, **dict(options, output_folder=rebuilt)))
+        self.assertEqual(nearest(rebuilt), nearest(output))
+        self.assertNotIn("1000", {origin_id for _, origin_id in nearest(output).values()})
@@ -0,0 +1,102 @@
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from src.response_cache import ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.url = "http://localhost:8000/fi/reachability/travelTime/walking/1"
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_round_trip_with_normalized_coordinates(self):
+        cache = ResponseCache(self.cache_dir.name, precision=5)
+        key = cache.key(self.url, {"latitude": "60.1681411", "longitude": "24.9306796", "radius": "20000"})
+        cache.put(key, b'{"features": []}')
+
+        self.assertEqual(key, cache.key(self.url, {"radius": "20000", "longitude": "24.93068",
+                                                   "latitude": "60.168141"}))
+        self.assertNotEqual(key, cache.key(self.url, {"latitude": "60.1681411", "longitude": "24.9306796",
+                                                      "radius": "5000"}))
+        self.assertEqual(b'{"features": []}', cache.get(key))
+        cache.close()
+
+        reopened = ResponseCache(self.cache_dir.name)
+        self.assertEqual(b'{"features": []}', reopened.get(key))
+        reopened.close()
+
+    def test_expired_entries_are_misses(self):
+        cache = ResponseCache(self.cache_dir.name, ttl=0.01)
+        cache.put("key", b"body")
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get("key"))
+        self.assertEqual(0, cache.size)
+        cache.close()
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResponseCache(self.cache_dir.name, max_bytes=2500, compression_level=0)
+        for key in ["a", "b", "c"]:
+            cache.put(key, bytes(1000))
+            time.sleep(0.01)
+            cache.get("a")
+
+        self.assertLessEqual(cache.size, 2500)
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        cache.close()
+
+    def test_processes_sharing_the_cache_evict_by_the_total_size(self):
+        # the shards of a '--workers' run open the same cache file
+        shards = [ResponseCache(self.cache_dir.name, max_bytes=2500, compression_level=0) for _ in range(2)]
+        for index in range(6):
+            shards[index % 2].put(str(index), bytes(1000))
+            time.sleep(0.01)
+
+        self.assertLessEqual(shards[0].size, 2500)
+        self.assertEqual(shards[0].size, shards[1].size)
+        self.assertIsNone(shards[1].get("0"))
+        self.assertIsNotNone(shards[1].get("5"))
+        for shard in shards:
+            shard.close()
+
+    def test_hits_write_their_access_times_in_batches(self):
+        cache = ResponseCache(self.cache_dir.name)
+        cache.put("a", b"body")
+        other = ResponseCache(self.cache_dir.name)
+
+        def accessed_at():
+            return other._connection.execute("SELECT accessed_at FROM responses WHERE key = 'a'").fetchone()[0]
+
+        written = accessed_at()
+        time.sleep(0.01)
+        self.assertEqual(b"body", cache.get("a"))
+        self.assertEqual(written, accessed_at())
+        cache.put("b", b"body")
+        self.assertGreater(accessed_at(), written)
+        cache.close()
+        other.close()
+
+    def test_failed_put_is_rolled_back(self):
+        cache = ResponseCache(self.cache_dir.name, max_bytes=1)
+
+        def fail():
+            raise sqlite3.OperationalError("disk I/O error")
+
+        cache._evict = fail
+        with self.assertRaises(sqlite3.OperationalError):
+            cache.put("a", b"body")
+        del cache._evict
+
+        self.assertFalse(cache._connection.in_transaction)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(0, cache.size)
+        cache.put("b", b"body")
+        self.assertEqual(0, cache.size)
+        cache.close()
@@ -0,0 +1,82 @@
+import asyncio
+
+import asynctest
+
+from src.config import TravelModes
+from src.scheduler import ReachabilityJob, parse_mode_limits, schedule
+
+
+class SchedulerTest(asynctest.TestCase):
+    def jobs(self, points, travel_modes):
+        for index in range(points):
+            for mode in travel_modes:
+                yield ReachabilityJob(origin_id=str(index), latitude=60.0, longitude=24.0, travel_mode=mode)
+
+    async def test_results_arrive_in_completion_order_within_limits(self):
+        in_flight = {"all": 0, TravelModes.TRANSIT: 0}
+        peaks = {"all": 0, TravelModes.TRANSIT: 0}
+
+        async def worker(job):
+            in_flight["all"] += 1
+            peaks["all"] = max(peaks["all"], in_flight["all"])
+            if job.travel_mode == TravelModes.TRANSIT:
+                in_flight[TravelModes.TRANSIT] += 1
+                peaks[TravelModes.TRANSIT] = max(peaks[TravelModes.TRANSIT], in_flight[TravelModes.TRANSIT])
+            await asyncio.sleep(0.05 if job.travel_mode == TravelModes.TRANSIT else 0.001)
+            in_flight["all"] -= 1
+            if job.travel_mode == TravelModes.TRANSIT:
+                in_flight[TravelModes.TRANSIT] -= 1
+            return job.origin_id
+
+        results = [(job, result) async for job, result in schedule(
+            self.jobs(10, [TravelModes.TRANSIT, TravelModes.WALKING]), worker, concurrency=4,
+            mode_limits={TravelModes.TRANSIT: 1})]
+
+        self.assertEqual(20, len(results))
+        self.assertTrue(all(job.origin_id == result for job, result in results))
+        self.assertLessEqual(peaks["all"], 4)
+        self.assertEqual(1, peaks[TravelModes.TRANSIT])
+        # the slow transit requests do not hold back the walking ones
+        self.assertEqual(TravelModes.WALKING, results[0][0].travel_mode)
+        self.assertEqual(TravelModes.TRANSIT, results[-1][0].travel_mode)
+
+    async def test_slow_limited_mode_does_not_delay_the_others(self):
+        async def worker(job):
+            await asyncio.sleep(0.1 if job.travel_mode == TravelModes.TRANSIT else 0.005)
+            return job.origin_id
+
+        modes = [TravelModes.TRANSIT, TravelModes.WALKING, TravelModes.CYCLING, TravelModes.DRIVING]
+        results = [job.travel_mode async for job, _ in schedule(
+            self.jobs(20, modes), worker, concurrency=10, mode_limits={TravelModes.TRANSIT: 2})]
+
+        self.assertEqual(80, len(results))
+        # the 60 fast jobs are done while the first two transit jobs are still in flight
+        last_fast = max(index for index, mode in enumerate(results) if mode != TravelModes.TRANSIT)
+        self.assertLessEqual(results[:last_fast].count(TravelModes.TRANSIT), 2)
+
+    async def test_worker_error_is_raised(self):
+        async def worker(job):
+            if job.origin_id == "3":
+                raise ValueError("failed")
+            return job
+
+        with self.assertRaises(ValueError):
+            async for _ in schedule(self.jobs(10, [TravelModes.WALKING]), worker, concurrency=2):
+                pass
+
+    def test_parse_mode_limits(self):
+        self.assertEqual({TravelModes.TRANSIT: 2, TravelModes.DRIVING: 4},
+                         parse_mode_limits(["transit=2", "driving=4"]))
+        self.assertEqual({}, parse_mode_limits(None))
+        with self.assertRaises(ValueError):
+            parse_mode_limits(["transit=0"])
+
+    async def test_limits_below_one_are_rejected(self):
+        async def worker(job):
+            return job
+
+        # a concurrency of 0 would start no worker and end the run without a single request
+        for options in ({"concurrency": 0}, {"concurrency": 2, "mode_limits": {TravelModes.WALKING: 0}}):
+            with self.assertRaises(ValueError):
+                async for _ in schedule(self.jobs(3, [TravelModes.WALKING]), worker, **options):
+                    pass
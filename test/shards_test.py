@@ -0,0 +1,92 @@
+import os
+import tempfile
+import unittest
+
+import rapidjson
+
+from src.config import TravelModes
+from src.dead_letter import DeadLetterWriter, dead_letter_path
+from src.reducer import NearestFacilityReducer, nearest_path
+from src.scheduler import ReachabilityJob
+from src.shards import ShardPlan, merge_shards, shard_folder, shard_options, split_failed_jobs
+
+
+class ShardPlanTest(unittest.TestCase):
+    def test_hash_plan_is_stable(self):
+        plan = ShardPlan(4)
+        shards = [plan.shard_of(str(origin_id), 60.0) for origin_id in range(100)]
+        self.assertEqual(shards, [ShardPlan(4).shard_of(str(origin_id), 61.0) for origin_id in range(100)])
+        self.assertEqual(set(shards), {0, 1, 2, 3})
+
+    def test_spatial_plan_balances_latitude_bands(self):
+        latitudes = [60 + index / 100 for index in range(90)]
+        plan = ShardPlan.spatial(latitudes, 3)
+        counts = [0, 0, 0]
+        for latitude in latitudes:
+            counts[plan.shard_of("id", latitude)] += 1
+        self.assertEqual([30, 30, 30], counts)
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "reachability_shards.json")
+            plan.save(path)
+            self.assertEqual(plan, ShardPlan.load(path))
+
+    def test_shards_sharing_an_api_key_share_its_rate(self):
+        options = {"output_folder": "/tmp/out", "rate": 6.0, "burst": 10, "concurrency": 10, "max_connections": 10}
+        shards = [shard_options(options, index, 3, ["a", "b"]) for index in range(3)]
+        self.assertEqual(["a", "b", "a"], [shard["api_key"] for shard in shards])
+        self.assertEqual([3.0, 6.0, 3.0], [shard["rate"] for shard in shards])
+        self.assertEqual([5, 10, 5], [shard["burst"] for shard in shards])
+        self.assertEqual({4}, {shard["concurrency"] for shard in shards})
+        self.assertEqual(shard_folder("/tmp/out", 1), shards[1]["output_folder"])
+
+
+class MergeShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.output_folder = self.folder.name
+        self.folders = [shard_folder(self.output_folder, index) for index in range(2)]
+        for folder in self.folders:
+            os.makedirs(folder)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def job(self, origin_id):
+        return ReachabilityJob(origin_id=origin_id, latitude=60.0, longitude=24.0, travel_mode=TravelModes.WALKING)
+
+    def test_failed_jobs_are_routed_to_their_shard(self):
+        plan = ShardPlan(2)
+        writer = DeadLetterWriter(dead_letter_path(self.output_folder, "reachability"))
+        for origin_id in range(10):
+            writer.write(self.job(str(origin_id)), Exception("timeout"))
+        writer.close()
+
+        paths = split_failed_jobs(writer.path, plan, self.output_folder, "reachability")
+        for index, path in enumerate(paths):
+            with open(path) as replay_file:
+                origin_ids = [rapidjson.loads(line)["properties"]["origin_id"] for line in replay_file]
+            self.assertEqual(origin_ids, [str(origin_id) for origin_id in range(10)
+                                          if plan.shard_of(str(origin_id), 60.0) == index])
+
+    def test_merge_in_shard_order(self):
+        for index, folder in enumerate(self.folders):
+            with open(os.path.join(folder, "reachability_walking.acc_dump"), "w") as dump_file:
+                dump_file.write('{{"shard": {index}}}\n'.format(index=index))
+            reducer = NearestFacilityReducer()
+            reducer.add_rows([str(index)], [1], [10.0 - index])
+            reducer.add_cell(1, ("3848756691875", None, None, "1"), 24.9, 60.3)
+            reducer.write(nearest_path(folder, "reachability", TravelModes.WALKING))
+        writer = DeadLetterWriter(dead_letter_path(self.folders[1], "reachability"))
+        writer.write(self.job("9"), Exception("timeout"))
+        writer.close()
+
+        failed = merge_shards(self.folders, self.output_folder, "reachability", nearest=True)
+
+        self.assertEqual(1, failed)
+        with open(os.path.join(self.output_folder, "reachability_walking.acc_dump")) as dump_file:
+            self.assertEqual('{"shard": 0}\n{"shard": 1}\n', dump_file.read())
+        with open(nearest_path(self.output_folder, "reachability", TravelModes.WALKING)) as nearest_file:
+            feature, = rapidjson.loads(nearest_file.read())["features"]
+        self.assertEqual(("1", 9.0), (feature["properties"]["origin_id"], feature["properties"]["travel_time"]))
+        self.assertEqual("3848756691875", feature["properties"]["geometry_id_1"])
@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+import asynctest
+import rapidjson
+from asynctest.mock import patch
+
+import main
+from src.config import TimeOfDay, TimeProfile, TravelModes
+from src.decoding import decode_compact
+from src.scheduler import ReachabilityJob
+from src.sweep import SweepPlan, SweepVariant, within_threshold
+
+with open(os.path.join(os.getcwd(), "resources", "transit_reachability.geojson"), "rb") as resource_file:
+    REACHABILITY = resource_file.read()
+
+
+def features_within(threshold: float) -> set:
+    return {feature["id"] for feature in rapidjson.loads(REACHABILITY)["features"]
+            if feature["properties"]["travel_time"] <= threshold}
+
+
+class SweepPlanTest(unittest.TestCase):
+    def setUp(self):
+        self.plan = SweepPlan.grid([15, 30, 60], times_of_day=[TimeOfDay.MIDDAY, TimeOfDay.RUSH_HOUR],
+                                   time_profiles=[TimeProfile.FASTEST])
+
+    def test_one_request_per_set_of_parameters_a_mode_uses(self):
+        walking = self.plan.fetches(TravelModes.WALKING)
+        transit = self.plan.fetches(TravelModes.TRANSIT)
+
+        # walking does not depend on the time of day
+        self.assertEqual([SweepVariant(60)], walking)
+        self.assertEqual([60, 60], [fetch.maxTimeThreshold for fetch in transit])
+        self.assertEqual({TimeOfDay.MIDDAY, TimeOfDay.RUSH_HOUR}, {fetch.timeOfDay for fetch in transit})
+        self.assertEqual(3, self.plan.requests_per_entry_point([TravelModes.WALKING, TravelModes.TRANSIT]))
+
+    def test_variant_names_show_the_parameters_that_vary(self):
+        self.assertEqual(["15min_midday", "30min_midday", "60min_midday", "15min_rushHour", "30min_rushHour",
+                          "60min_rushHour"], sorted(self.plan.names.values(), key=lambda name: name[-6:]))
+
+    def test_derived_variants(self):
+        job = ReachabilityJob(origin_id="a", latitude=60.1, longitude=24.9, travel_mode=TravelModes.TRANSIT,
+                              maxTimeThreshold=60, timeOfDay=TimeOfDay.MIDDAY)
+
+        derived = self.plan.derived(job)
+
+        self.assertEqual([15, 30, 60], sorted(variant.maxTimeThreshold for variant, _ in derived))
+        self.assertTrue(all(variant.timeOfDay == TimeOfDay.MIDDAY for variant, _ in derived))
+        self.assertTrue(all(variant_job.maxTimeThreshold == variant.maxTimeThreshold
+                            for variant, variant_job in derived))
+
+    def test_within_threshold(self):
+        expected = features_within(40)
+
+        from_dict = within_threshold(rapidjson.loads(REACHABILITY), 40)
+        from_bytes = within_threshold(REACHABILITY, 40)
+        from_arrays = within_threshold(decode_compact(REACHABILITY), 40)
+
+        self.assertEqual(expected, {feature["id"] for feature in from_dict["features"]})
+        self.assertEqual(expected, {feature["id"] for feature in from_bytes["features"]})
+        self.assertEqual(expected, {str(cell_id) for cell_id in from_arrays.cell_ids})
+        self.assertEqual(len(expected), len(from_arrays.travel_times))
+
+
+ANSWERS = {}
+
+
+def answer_within_threshold(url, params, headers, session=None, read=None):
+    threshold = int(params["maxTimeThreshold"])
+    if threshold not in ANSWERS:
+        reachability = rapidjson.loads(REACHABILITY)
+        reachability["features"] = [feature for feature in reachability["features"]
+                                    if feature["properties"]["travel_time"] <= threshold]
+        ANSWERS[threshold] = rapidjson.dumps(reachability).encode("utf-8")
+    return ANSWERS[threshold]
+
+
+class SweepRunTest(asynctest.TestCase):
+    @patch('src.mapple_api.fetch_body')
+    async def test_variants_are_derived_from_the_largest_threshold(self, fetch_body):
+        fetch_body.side_effect = answer_within_threshold
+        plan = SweepPlan.grid([15, 60], times_of_day=[TimeOfDay.MIDDAY, TimeOfDay.RUSH_HOUR])
+
+        with tempfile.TemporaryDirectory() as folder:
+            pois = os.path.join(folder, "pois.geojsonl")
+            with open(os.path.join(os.getcwd(), "resources", "pois.geojson")) as pois_file, open(pois, "w") as target:
+                for feature in rapidjson.loads(pois_file.read())["features"][:3]:
+                    target.write(rapidjson.dumps(feature) + "\n")
+            succeeded = await main.main(pois, output_folder=folder, travel_mode=["walking", "transit"],
+                                        rate=1000, burst=100, sweep=plan)
+
+            self.assertTrue(succeeded)
+            # one walking and two transit requests per entry point
+            self.assertEqual(3 * 3, fetch_body.call_count)
+            for variant, name in plan.names.items():
+                for mode in ("walking", "transit"):
+                    with open(os.path.join(folder, name, "reachability_{mode}.acc_dump".format(mode=mode))) as dump:
+                        layers = [rapidjson.loads(line) for line in dump]
+                    self.assertEqual(3, len(layers))
+                    self.assertEqual(features_within(variant.maxTimeThreshold),
+                                     {feature["id"] for feature in layers[0]["features"]})
+
+            # every variant is recorded, so a resumed sweep has nothing left to fetch
+            fetch_body.reset_mock()
+            self.assertTrue(await main.main(pois, output_folder=folder, travel_mode=["walking", "transit"],
+                                            resume=True, sweep=plan))
+            self.assertEqual(0, fetch_body.call_count)
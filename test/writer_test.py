@@ -0,0 +1,54 @@
+import os
+import tempfile
+
+import asynctest
+import rapidjson
+
+from src.config import TravelModes
+from src.scheduler import ReachabilityJob
+from src.writer import ReachabilityWriter
+
+
+class ReachabilityWriterTest(asynctest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def job(self, origin_id):
+        return ReachabilityJob(origin_id=origin_id, latitude=60.0, longitude=24.0, travel_mode=TravelModes.WALKING)
+
+    async def test_dump_and_individual_files(self):
+        flushed = []
+        writer = ReachabilityWriter(flush_bytes=1024 * 1024, flush_interval=60, on_flushed=flushed.extend)
+        dump_path = os.path.join(self.folder.name, "reachability_walking.acc_dump")
+        geojson_path = os.path.join(self.folder.name, "reachability_walking_3.geojson")
+
+        await writer.write(dump_path, {"type": "FeatureCollection", "features": [{"id": "1"}]}, self.job("1"))
+        await writer.write(dump_path, b'{"type": "FeatureCollection",\n "features": []}\n', self.job("2"))
+        await writer.write(geojson_path, {"type": "FeatureCollection", "features": []}, self.job("3"))
+        await writer.close()
+
+        with open(dump_path) as dump_file:
+            lines = dump_file.read().splitlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual([{"id": "1"}], rapidjson.loads(lines[0])["features"])
+        self.assertEqual([], rapidjson.loads(lines[1])["features"])
+        with open(geojson_path) as geojson_file:
+            self.assertEqual("FeatureCollection", rapidjson.loads(geojson_file.read())["type"])
+        self.assertEqual({"1", "2", "3"}, {job.origin_id for job in flushed})
+        self.assertTrue(writer.closed)
+
+    async def test_no_file_descriptors_are_leaked(self):
+        open_files = len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None
+        writer = ReachabilityWriter(flush_bytes=1)
+        for index in range(50):
+            await writer.write(os.path.join(self.folder.name, "reachability_driving_{}.geojson".format(index)),
+                               {"features": []})
+            await writer.write(os.path.join(self.folder.name, "reachability_driving.acc_dump"), {"features": []})
+        await writer.close()
+
+        self.assertEqual(51, len(os.listdir(self.folder.name)))
+        if open_files is not None:
+            self.assertEqual(open_files, len(os.listdir("/proc/self/fd")))